@@ -0,0 +1,315 @@
+"""Incrementally maintained sales aggregates for the seller dashboards.
+
+Every committed purchase is folded into running totals per product and into
+fixed-size rings of hourly and daily buckets (for the shop, each product and
+each seller), so the analytics endpoints never scan purchase history: a totals
+lookup is a dict read, a time series reads exactly one ring, and the top-N
+bestsellers come from a heap over per-product totals (one entry per product,
+however many sales there were).
+
+The aggregates live in process. On startup they are rebuilt from the inventory
+ledger, which is the durable record of every sale. With several workers, each
+one only sees the purchases it handles itself, so ANALYTICS_TAIL_SECONDS > 0
+switches to tailing the ledger instead: every worker folds in new ledger
+events (its own and the others') every few seconds, and live recording is off.
+"""
+import heapq
+import os
+import threading
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, func, select, type_coerce
+from sqlalchemy.orm import Session
+
+from . import ledger, models, money
+
+products_table = models.Product.__table__
+
+# How many buckets each ring keeps (one week of hours, three months of days)
+ANALYTICS_HOURLY_BUCKETS = int(os.getenv("ANALYTICS_HOURLY_BUCKETS", "168"))
+ANALYTICS_DAILY_BUCKETS = int(os.getenv("ANALYTICS_DAILY_BUCKETS", "90"))
+# Seconds between ledger catch-ups in multi-worker mode; 0 records live instead
+ANALYTICS_TAIL_SECONDS = int(os.getenv("ANALYTICS_TAIL_SECONDS", "0"))
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class Totals:
+    __slots__ = ("units_sold", "revenue", "sales")
+
+    def __init__(self):
+        self.units_sold = 0
+        self.revenue = money.ZERO
+        self.sales = 0
+
+    def add(self, units: int, revenue: Decimal):
+        self.units_sold += units
+        self.revenue += revenue
+        self.sales += 1
+
+    def as_dict(self) -> dict:
+        return {"units_sold": self.units_sold, "revenue": self.revenue, "sales": self.sales}
+
+
+class BucketRing:
+    """Totals per fixed-width time bucket, for the most recent `size` buckets.
+
+    Bucket n lives in slot n % size and is reset when a later bucket reuses
+    the slot, so memory is fixed and old buckets expire without a sweep.
+    """
+
+    def __init__(self, width: timedelta, size: int):
+        self.width = width
+        self.size = size
+        self._numbers: list[int | None] = [None] * size
+        self._totals: list[Totals | None] = [None] * size
+
+    def bucket(self, at: datetime) -> int:
+        return (at - EPOCH) // self.width
+
+    def add(self, at: datetime, units: int, revenue: Decimal):
+        number = self.bucket(at)
+        slot = number % self.size
+        if self._numbers[slot] != number:
+            if self._numbers[slot] is not None and self._numbers[slot] > number:
+                # Older than anything the ring still holds
+                return
+            self._numbers[slot] = number
+            self._totals[slot] = Totals()
+        self._totals[slot].add(units, revenue)
+
+    def series(self, now: datetime, periods: int) -> list[dict]:
+        """The last `periods` buckets up to and including the one holding `now`, oldest first."""
+        current = self.bucket(now)
+        result = []
+        for number in range(current - min(periods, self.size) + 1, current + 1):
+            slot = number % self.size
+            totals = self._totals[slot] if self._numbers[slot] == number else None
+            result.append({"start": EPOCH + number * self.width, **(totals or Totals()).as_dict()})
+        return result
+
+
+class SalesAggregates:
+    def __init__(
+        self,
+        hourly_buckets: int = ANALYTICS_HOURLY_BUCKETS,
+        daily_buckets: int = ANALYTICS_DAILY_BUCKETS,
+        tailing: bool = ANALYTICS_TAIL_SECONDS > 0,
+    ):
+        self.hourly_buckets = hourly_buckets
+        self.daily_buckets = daily_buckets
+        self.tailing = tailing
+        # Newest ledger event folded in by load() or catch_up()
+        self.last_event_id = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._totals: dict[int, Totals] = {}
+            self._rings: dict[tuple[int | None, str], BucketRing] = {}
+            self._seller_rings: dict[tuple[int, str], BucketRing] = {}
+            # Which seller's ring a product's sales go to
+            self._seller_of: dict[int, int] = {}
+
+    def _new_ring(self, bucket: str) -> BucketRing:
+        if bucket == "hour":
+            return BucketRing(timedelta(hours=1), self.hourly_buckets)
+        return BucketRing(timedelta(days=1), self.daily_buckets)
+
+    def _ring(self, product_id: int | None, bucket: str, rings: dict | None = None) -> BucketRing:
+        rings = self._rings if rings is None else rings
+        ring = rings.get((product_id, bucket))
+        if ring is None:
+            ring = rings[(product_id, bucket)] = self._new_ring(bucket)
+        return ring
+
+    def record(self, product_id: int, units: int, unit_price: Decimal | None, at: datetime, per_product: bool = True):
+        """Folds one sale into the shop-wide buckets and (unless told not to) the product's and its seller's."""
+        revenue = units * (unit_price or money.ZERO)
+        with self._lock:
+            keys = (None, product_id) if per_product else (None,)
+            if per_product:
+                self._totals.setdefault(product_id, Totals()).add(units, revenue)
+                seller_id = self._seller_of.get(product_id)
+                if seller_id is not None:
+                    self._ring(seller_id, "hour", self._seller_rings).add(at, units, revenue)
+                    self._ring(seller_id, "day", self._seller_rings).add(at, units, revenue)
+            for key in keys:
+                self._ring(key, "hour").add(at, units, revenue)
+                self._ring(key, "day").add(at, units, revenue)
+
+    def record_entries(self, entries: list[dict]):
+        """Records the purchases among a list of ledger.entry() rows (unless tailing the ledger)."""
+        if self.tailing:
+            return
+        for row in entries:
+            if row["reason"] == "purchase":
+                self.record(row["product_id"], -row["delta"], row["unit_price"], row["created_at"])
+
+    def forget(self, product_id: int, seller_id: int | None = None):
+        """Drops a product's own aggregates when its id starts a new history.
+
+        SQLite can hand a deleted product's id to a new one, which must not
+        inherit the old sales. The shop-wide and seller buckets keep them.
+        `seller_id` is the new product's seller, whose ring its sales go to.
+        """
+        with self._lock:
+            self._totals.pop(product_id, None)
+            self._rings.pop((product_id, "hour"), None)
+            self._rings.pop((product_id, "day"), None)
+            if seller_id is None:
+                self._seller_of.pop(product_id, None)
+            else:
+                self._seller_of[product_id] = seller_id
+
+    def totals(self, product_id: int) -> dict:
+        with self._lock:
+            totals = self._totals.get(product_id) or Totals()
+            return {"product_id": product_id, **totals.as_dict()}
+
+    def series(
+        self,
+        bucket: str,
+        periods: int,
+        product_id: int | None = None,
+        now: datetime | None = None,
+        seller_id: int | None = None,
+    ) -> list[dict]:
+        """The shop's buckets, one product's, or one seller's."""
+        now = ledger.utcnow() if now is None else ledger.as_utc(now)
+        with self._lock:
+            if seller_id is not None:
+                ring = self._seller_rings.get((seller_id, bucket))
+            else:
+                ring = self._rings.get((product_id, bucket))
+            # Nothing sold yet: an empty ring gives the right run of zero buckets
+            return (ring or self._new_ring(bucket)).series(now, periods)
+
+    def top(self, limit: int, by: str = "units_sold", product_ids: Iterable[int] | None = None) -> list[dict]:
+        """Best sellers by units sold or revenue, ties broken by product id.
+
+        Ranks the whole shop, or only `product_ids` if given.
+        """
+        with self._lock:
+            if product_ids is None:
+                candidates = self._totals.items()
+            else:
+                candidates = [(key, self._totals[key]) for key in product_ids if key in self._totals]
+            if by == "revenue":
+                best = heapq.nsmallest(limit, candidates, key=lambda item: (-item[1].revenue, item[0]))
+            else:
+                best = heapq.nsmallest(limit, candidates, key=lambda item: (-item[1].units_sold, item[0]))
+            return [{"product_id": product_id, **totals.as_dict()} for product_id, totals in best]
+
+    def load(self, db: Session, now: datetime | None = None) -> int:
+        """Rebuilds the aggregates from the ledger; returns the number of products seen."""
+        now = ledger.utcnow() if now is None else now
+        events = ledger.events_table
+        # Everything up to the newest event now; catch_up() takes it from there
+        upto = db.scalar(select(func.max(events.c.id))) or 0
+        purchases = and_(events.c.reason == "purchase", events.c.id <= upto)
+        # Per-product figures only count sales since the product's latest
+        # start event, matching what forget() does for live traffic
+        starts = (
+            select(events.c.product_id, func.max(events.c.id).label("start"))
+            .where(events.c.reason.in_(ledger.START_REASONS), events.c.id <= upto)
+            .group_by(events.c.product_id)
+            .subquery()
+        )
+        current = and_(events.c.product_id == starts.c.product_id, events.c.id > starts.c.start)
+
+        # Lifetime totals in one grouped query
+        totals: dict[int, Totals] = {}
+        for product_id, units, revenue, sales in db.execute(
+            select(
+                events.c.product_id,
+                func.sum(-events.c.delta),
+                type_coerce(func.sum(-events.c.delta * func.coalesce(events.c.unit_price, 0)), money.Money()),
+                func.count(),
+            )
+            .join(starts, current)
+            .where(purchases)
+            .group_by(events.c.product_id)
+        ):
+            totals[product_id] = Totals()
+            totals[product_id].units_sold = units
+            totals[product_id].revenue = revenue or money.ZERO
+            totals[product_id].sales = sales
+
+        # Buckets only need the sales the rings can still hold
+        since = min(
+            now - timedelta(hours=self.hourly_buckets),
+            now - timedelta(days=self.daily_buckets),
+        )
+        recent = db.execute(
+            select(
+                events.c.product_id,
+                events.c.delta,
+                events.c.unit_price,
+                events.c.created_at,
+                starts.c.start.is_not(None),
+            )
+            .outerjoin(starts, current)
+            .where(purchases, events.c.created_at >= since)
+            .order_by(events.c.id)
+        ).all()
+
+        sellers = dict(db.execute(
+            select(products_table.c.id, products_table.c.seller_id).where(products_table.c.seller_id.is_not(None))
+        ).all())
+
+        self.reset()
+        with self._lock:
+            self._seller_of = sellers
+        for product_id, delta, unit_price, created_at, is_current in recent:
+            self.record(product_id, -delta, unit_price, created_at, per_product=bool(is_current))
+        with self._lock:
+            self._totals = totals
+            self.last_event_id = upto
+        return len(totals)
+
+    def catch_up(self, db: Session) -> int:
+        """Folds in ledger events newer than the last ones seen; returns how many.
+
+        Relies on event ids becoming visible in order, which holds for SQLite's
+        single writer.
+        """
+        events = ledger.events_table
+        rows = db.execute(
+            select(
+                events.c.id,
+                events.c.product_id,
+                events.c.delta,
+                events.c.reason,
+                events.c.unit_price,
+                events.c.created_at,
+                products_table.c.seller_id,
+            )
+            # The seller of products other workers created
+            .outerjoin(products_table, products_table.c.id == events.c.product_id)
+            .where(events.c.id > self.last_event_id, events.c.reason.in_(("purchase", *ledger.START_REASONS)))
+            .order_by(events.c.id)
+        ).all()
+        for event_id, product_id, delta, reason, unit_price, created_at, seller_id in rows:
+            if reason == "purchase":
+                self.record(product_id, -delta, unit_price, created_at)
+            else:
+                self.forget(product_id, seller_id)
+            self.last_event_id = event_id
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "products": len(self._totals),
+                "rings": len(self._rings) + len(self._seller_rings),
+                "tailing": self.tailing,
+                "last_event_id": self.last_event_id,
+            }
+
+
+# Shared aggregates for the analytics endpoints
+sales = SalesAggregates()
@@ -1,20 +1,70 @@
 from passlib.context import CryptContext
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Any
 from jose import jwt
+import asyncio
+import multiprocessing
+import os
+import threading
 
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .database import get_db # Assuming get_db is available in database.py
-from . import models
+from .database import get_read_db
+from . import metrics, models
+from .cache import TTLCache
 # Security Configuration
 SECRET_KEY = "your-secret-key"  # IMPORTANT: Change this in a real application
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Define the hashing context using bcrypt
-pwd_context = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
+# Authenticated users are cached by token subject so most requests skip the DB.
+# The TTL bounds staleness for changes made outside the ORM (e.g. raw SQL).
+PRINCIPAL_CACHE_SIZE = 10_000
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+
+# Password hashing configuration. The first scheme hashes new passwords; the
+# others are still accepted and are transparently upgraded on the next login.
+PASSWORD_SCHEMES = os.getenv("PASSWORD_SCHEMES", "bcrypt,sha256_crypt").split(",")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536")) # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+SHA256_CRYPT_ROUNDS = int(os.getenv("SHA256_CRYPT_ROUNDS", "535000"))
+
+# KDF work runs in a dedicated process pool so it can't starve the request
+# threadpool. 0 workers hashes in the threadpool instead (useful for debugging).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashing requests beyond this many in flight are refused with 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+def build_pwd_context(
+    schemes: list[str] | None = None,
+    bcrypt_rounds: int | None = None,
+    argon2_time_cost: int | None = None,
+    argon2_memory_cost: int | None = None,
+    sha256_crypt_rounds: int | None = None,
+) -> CryptContext:
+    """Builds a CryptContext from the configured schemes and cost parameters."""
+    return CryptContext(
+        schemes=schemes or PASSWORD_SCHEMES,
+        deprecated="auto",
+        # min_rounds makes needs_update() flag hashes made at a lower cost
+        bcrypt__rounds=bcrypt_rounds or BCRYPT_ROUNDS,
+        bcrypt__min_rounds=bcrypt_rounds or BCRYPT_ROUNDS,
+        argon2__time_cost=argon2_time_cost or ARGON2_TIME_COST,
+        argon2__memory_cost=argon2_memory_cost or ARGON2_MEMORY_COST,
+        argon2__parallelism=ARGON2_PARALLELISM,
+        sha256_crypt__rounds=sha256_crypt_rounds or SHA256_CRYPT_ROUNDS,
+        sha256_crypt__min_rounds=sha256_crypt_rounds or SHA256_CRYPT_ROUNDS,
+    )
+
+pwd_context = build_pwd_context()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 # Function to get the hashed password for storage
 def get_password_hash(password: str) -> str:
@@ -24,6 +74,65 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+# Verifies a password and, if the stored hash uses an old scheme or cost,
+# returns a fresh hash to store (passlib's needs_update check)
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# --- Offloaded hashing ---
+
+_hash_pool: ProcessPoolExecutor | None = None
+_hash_pool_lock = threading.Lock()
+_pending_hashes = 0
+
+def _get_hash_pool() -> ProcessPoolExecutor | None:
+    global _hash_pool
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            # spawn, not fork: the server process has threads running
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _hash_pool
+
+def shutdown_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=True, cancel_futures=True)
+            _hash_pool = None
+
+async def _run_kdf(func, *args):
+    """Runs a hashing function off the event loop, refusing work past the queue bound."""
+    global _pending_hashes
+    with _hash_pool_lock:
+        if _pending_hashes >= PASSWORD_HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent logins, please retry",
+                headers={"Retry-After": "1"},
+            )
+        _pending_hashes += 1
+    try:
+        pool = _get_hash_pool()
+        if pool is None:
+            return await run_in_threadpool(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    finally:
+        with _hash_pool_lock:
+            _pending_hashes -= 1
+
+async def hash_password_async(password: str) -> str:
+    with metrics.KDF_SECONDS.time(operation="hash"):
+        return await _run_kdf(get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    with metrics.KDF_SECONDS.time(operation="verify"):
+        return await _run_kdf(verify_and_update_password, plain_password, hashed_password)
+
 # Function to create a JWT access token
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
@@ -35,8 +144,51 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Decodes JWT, finds the user in the DB, and raises 401 on failure."""
+@dataclass(frozen=True)
+class Principal:
+    """Read-only snapshot of an authenticated user, safe to share between requests."""
+    id: int
+    username: str
+    email: str
+    role: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            is_active=user.is_active is not False,
+        )
+
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+def invalidate_principal(username: str):
+    principal_cache.pop(username)
+
+# --- Cache invalidation ---
+# Any ORM change to a user (role, is_active, ...) drops that user's cache entry.
+# Bulk UPDATE/DELETE statements don't say which rows they touch, so they clear
+# the whole cache.
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_principal(target.username)
+    # A rename leaves the entry under the old name too
+    for old_name in inspect(target).attrs.username.history.deleted or ():
+        invalidate_principal(old_name)
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_on_bulk_user_change(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is models.User:
+            principal_cache.clear()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)) -> Principal:
+    """Decodes JWT, finds the user (cache first, then DB), and raises 401 on failure."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -44,24 +196,36 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     )
     try:
         # Decode the JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.JWT_DECODE_SECONDS.time():
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         
-        # Pull the user from the database
-        user = db.query(models.User).filter(models.User.username == username).first()
-        if user is None:
+        principal = principal_cache.get(username)
+        if principal is None:
+            # Pull the user from the database
+            user = (await db.execute(
+                select(models.User).where(models.User.username == username)
+            )).scalars().first()
+            # Release the connection now rather than holding it for the rest
+            # of the request, which may also need a write connection
+            await db.close()
+            if user is None:
+                raise credentials_exception
+            principal = Principal.from_user(user)
+            principal_cache.set(username, principal)
+
+        if not principal.is_active:
             raise credentials_exception
-            
-        return user
+        return principal
         
     except Exception:
         raise credentials_exception
 
 def check_role(required_role: str):
     """Dependency checker that ensures the current user has the required role."""
-    def role_checker(current_user: models.User = Depends(get_current_user)):
+    async def role_checker(current_user: Principal = Depends(get_current_user)):
         if current_user.role != required_role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
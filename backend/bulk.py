@@ -0,0 +1,280 @@
+"""Bulk product import/export.
+
+Imports stream CSV or NDJSON rows in fixed-size chunks. Each chunk is
+validated against schemas.ProductCreate, name conflicts are resolved with one
+SELECT ... WHERE name IN (...) and the rows are written with executemany, so
+loading a supplier catalogue costs a few statements per chunk instead of
+several round trips per product. Existing products (matched by name within
+the importing seller's catalogue) are updated in place.
+
+Command line usage:
+
+    python -m backend.bulk import catalogue.csv
+    python -m backend.bulk export --format ndjson > catalogue.ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+from typing import Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import analytics, ledger, models, schemas, search
+
+FORMATS = ("csv", "ndjson")
+CSV_COLUMNS = ["name", "description", "price", "quantity"]
+EXPORT_COLUMNS = ["id"] + CSV_COLUMNS
+
+DEFAULT_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+# Stop collecting row errors past this many so a bad file can't blow up memory
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def add_error(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+# --- Parsing ---
+
+def parse_csv(lines: Iterable[str]) -> Iterator[tuple[int, dict]]:
+    """Yields (line_number, row) pairs; the first line must be a header."""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # Empty cells mean "not given", e.g. a product without a description
+        yield reader.line_num, {k: v for k, v in row.items() if k and v != ""}
+
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[tuple[int, dict | None]]:
+    """Yields (line_number, row) pairs; unparseable lines yield a None row."""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def parse(lines: Iterable[str], fmt: str):
+    if fmt == "csv":
+        return parse_csv(lines)
+    if fmt == "ndjson":
+        return parse_ndjson(lines)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+# --- Import ---
+
+def upsert_chunk(
+    db: Session,
+    rows: list[tuple[int, dict | None]],
+    report: ImportReport,
+    seller_id: int | None = None,
+    on_sale=None,
+):
+    """Validates one chunk of rows and writes it in a single transaction.
+
+    `on_sale(product_id)` says whether an existing product is in a flash sale;
+    rows for those are reported as errors, since overwriting the row would
+    leave the sale's counter selling stock that is no longer there.
+    """
+    # 1. Validate; a later row for the same name wins within the chunk
+    valid: dict[str, dict] = {}
+    lines: dict[str, int] = {}
+    for line_number, row in rows:
+        if row is None:
+            report.add_error(line_number, "Line is not a JSON object")
+            continue
+        try:
+            product = schemas.ProductCreate.model_validate(row)
+        except ValidationError as exc:
+            first = exc.errors()[0]
+            location = ".".join(str(part) for part in first["loc"])
+            report.add_error(line_number, f"{location}: {first['msg']}")
+            continue
+        valid[product.name] = product.model_dump()
+        lines[product.name] = line_number
+    if not valid:
+        return
+
+    # 2. Resolve name conflicts for the whole chunk with one query
+    in_catalogue = (models.Product.seller_id == seller_id) & models.Product.name.in_(list(valid))
+    existing = {
+        name: (product_id, quantity or 0)
+        for name, product_id, quantity in db.execute(
+            select(models.Product.name, models.Product.id, models.Product.quantity).where(in_catalogue)
+        )
+    }
+    if on_sale is not None:
+        for name, (product_id, _) in existing.items():
+            if on_sale(product_id):
+                report.add_error(lines[name], "Product is in a flash sale; end the sale before importing it")
+                del valid[name]
+    new_rows = [dict(data, seller_id=seller_id) for name, data in valid.items() if name not in existing]
+    changed_rows = [dict(data, _id=existing[name][0]) for name, data in valid.items() if name in existing]
+
+    # 3. Write both groups with executemany
+    products_table = models.Product.__table__
+    if new_rows:
+        db.execute(insert(products_table), new_rows)
+    if changed_rows:
+        db.execute(
+            update(products_table)
+            .where(products_table.c.id == bindparam("_id"))
+            .values({c: bindparam(c) for c in CSV_COLUMNS}),
+            changed_rows,
+        )
+
+    # 4. Record the stock changes in the ledger, then commit once
+    ids = dict(db.execute(select(models.Product.name, models.Product.id).where(in_catalogue)).all())
+    ledger_rows = []
+    for name, data in valid.items():
+        previous = existing[name][1] if name in existing else None
+        if previous is None:
+            # New products get a start entry, like ones created through the API
+            ledger_rows.append(ledger.entry(ids[name], data["quantity"], "create", user_id=seller_id))
+        elif data["quantity"] != previous:
+            ledger_rows.append(ledger.entry(ids[name], data["quantity"] - previous, "import", user_id=seller_id))
+    if ledger_rows:
+        db.execute(ledger.INSERT_EVENTS, ledger_rows)
+    db.commit()
+    report.inserted += len(new_rows)
+    report.updated += len(changed_rows)
+    for data in new_rows:
+        # A reused id must not inherit a deleted product's sales figures
+        analytics.sales.forget(ids[data["name"]], seller_id)
+
+    # 5. Keep the search index in step with the new names and descriptions
+    if search.product_index.is_loaded:
+        for name, data in valid.items():
+            search.product_index.upsert(ids[name], name, data["description"])
+
+
+def import_products(
+    db: Session,
+    lines: Iterable[str],
+    fmt: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    seller_id: int | None = None,
+    on_sale=None,
+) -> ImportReport:
+    """Streams rows from `lines` into `seller_id`'s catalogue, chunk by chunk."""
+    report = ImportReport()
+    rows = parse(lines, fmt)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        upsert_chunk(db, chunk, report, seller_id, on_sale)
+    return report
+
+
+# --- Export ---
+
+def export_products(
+    db: Session,
+    fmt: str,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    seller_id: int | None = None,
+) -> Iterator[str]:
+    """Yields the catalogue (of `seller_id` only, if given) as CSV or NDJSON text,
+    one batch of rows at a time.
+
+    Rows are fetched with yield_per over a server-side cursor (where the driver
+    supports one), so the whole table is never held in memory.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    stmt = (
+        select(*(getattr(models.Product, c) for c in EXPORT_COLUMNS))
+        .order_by(models.Product.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    if seller_id is not None:
+        stmt = stmt.where(models.Product.seller_id == seller_id)
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    for partition in db.execute(stmt).partitions():
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(partition)
+            yield buffer.getvalue()
+        else:
+            yield "".join(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=float) + "\n" for row in partition
+            )
+
+
+# --- Command line ---
+
+def _guess_format(path: str) -> str:
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def main(argv: list[str] | None = None) -> int:
+    from .database import SessionLocal, create_db_and_tables
+
+    parser = argparse.ArgumentParser(prog="python -m backend.bulk", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_cmd = commands.add_parser("import", help="Upsert products from a CSV or NDJSON file")
+    import_cmd.add_argument("path", help="Input file, or - for stdin")
+    import_cmd.add_argument("--format", choices=FORMATS)
+    import_cmd.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    import_cmd.add_argument("--seller-id", type=int, help="Seller whose catalogue the rows go into")
+
+    export_cmd = commands.add_parser("export", help="Write every product to stdout")
+    export_cmd.add_argument("--format", choices=FORMATS, default="csv")
+    export_cmd.add_argument("--seller-id", type=int, help="Only this seller's products")
+
+    args = parser.parse_args(argv)
+    create_db_and_tables()
+    db = SessionLocal()
+    try:
+        if args.command == "import":
+            fmt = args.format or _guess_format(args.path)
+            source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+            with source:
+                report = import_products(db, source, fmt, args.chunk_size, args.seller_id)
+            json.dump(report.as_dict(), sys.stdout, indent=2)
+            sys.stdout.write("\n")
+            return 1 if report.failed else 0
+
+        for text in export_products(db, args.format, seller_id=args.seller_id):
+            sys.stdout.write(text)
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import base64
+import json
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Columns a client may ask for with ?fields=
+PRODUCT_FIELDS = {
+    "id": models.Product.id,
+    "name": models.Product.name,
+    "description": models.Product.description,
+    "price": models.Product.price,
+    "quantity": models.Product.quantity,
+}
+
+# Sort keys accepted by GET /products; a leading "-" means descending
+SORT_COLUMNS = {
+    "id": models.Product.id,
+    "name": models.Product.name,
+    "price": models.Product.price,
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class CatalogueQueryError(ValueError):
+    """Raised for a bad sort key, field name or cursor."""
+
+
+def encode_cursor(sort_value, product_id: int) -> str:
+    """Packs the last row's sort value and id into an opaque URL-safe token."""
+    # Prices are Decimals; as strings they come back exact
+    raw = json.dumps([sort_value, product_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, product_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, int(product_id)
+    except (ValueError, TypeError):
+        raise CatalogueQueryError("Invalid cursor")
+
+
+def parse_fields(fields: str | None) -> list[str]:
+    if not fields:
+        return list(PRODUCT_FIELDS)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in PRODUCT_FIELDS]
+    if unknown or not names:
+        raise CatalogueQueryError(f"Unknown fields: {', '.join(unknown) or fields}")
+    return names
+
+
+def fetch_product_page(
+    db: Session,
+    *,
+    fields: list[str],
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+    sort: str = "id",
+    min_price: float | None = None,
+    max_price: float | None = None,
+    in_stock: bool | None = None,
+    seller_id: int | None = None,
+) -> tuple[list[dict], str | None]:
+    """Returns one keyset page of products as plain dicts plus the next cursor.
+
+    Rows come straight from a Core select() of the requested columns, so no
+    ORM objects are built. The query seeks past the cursor with
+    (sort_col, id) > (last_value, last_id), which stays an index range scan no
+    matter how deep into the catalogue the client pages. With `seller_id`,
+    only that seller's products, read through the (seller_id, ...) indexes.
+    """
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in SORT_COLUMNS:
+        raise CatalogueQueryError(f"Unknown sort key: {sort}")
+    sort_col = SORT_COLUMNS[sort_key]
+    id_col = models.Product.id
+
+    # The sort column and id are always selected so the cursor can be built
+    selected = fields + [k for k in (sort_key, "id") if k not in fields]
+    stmt = select(*(PRODUCT_FIELDS[f] for f in selected))
+
+    if seller_id is not None:
+        stmt = stmt.where(models.Product.seller_id == seller_id)
+    if min_price is not None:
+        stmt = stmt.where(models.Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(models.Product.price <= max_price)
+    if in_stock is True:
+        stmt = stmt.where(models.Product.quantity > 0)
+    elif in_stock is False:
+        stmt = stmt.where(models.Product.quantity <= 0)
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        if sort_col is id_col:
+            stmt = stmt.where(id_col < last_id if descending else id_col > last_id)
+        elif descending:
+            stmt = stmt.where(or_(sort_col < last_value, and_(sort_col == last_value, id_col < last_id)))
+        else:
+            stmt = stmt.where(or_(sort_col > last_value, and_(sort_col == last_value, id_col > last_id)))
+
+    if descending:
+        stmt = stmt.order_by(sort_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(sort_col, id_col)
+    # Fetch one extra row to learn whether another page exists
+    rows = db.execute(stmt.limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[selected.index(sort_key)], last[selected.index("id")])
+
+    return [{f: row[i] for i, f in enumerate(fields)} for row in rows], next_cursor
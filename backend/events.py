@@ -0,0 +1,153 @@
+"""In-process pub/sub hub for catalogue change events.
+
+Endpoints publish compact deltas (stock, price, created, deleted) after they
+commit, and GET /products/events streams them to storefronts as Server-Sent
+Events. Each event is encoded once and the same bytes are handed to every
+subscriber, so fan-out cost is a queue append per client.
+
+Every subscriber has a bounded queue. A client that falls so far behind that
+its queue fills up is evicted: its stream ends, and the browser's EventSource
+reconnects and refetches the catalogue. One slow client can therefore never
+hold memory or delay delivery to the others.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", "10000"))
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+
+
+class HubFull(Exception):
+    """Raised when the subscriber limit has been reached."""
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=queue_size)
+        self.evicted = False
+
+    def offer(self, message: bytes) -> bool:
+        """Queues a message; returns False (and ends the stream) if the queue is full."""
+        if self.evicted:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.evicted = True
+            # Drop the backlog and wake the consumer with the end-of-stream marker
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class EventHub:
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, max_subscribers: int = EVENT_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self.published = 0
+        self.evicted = 0
+
+    def subscribe(self) -> Subscriber:
+        """Registers a subscriber on the running event loop."""
+        subscriber = Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise HubFull()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, payload: dict):
+        """Encodes an event once and offers it to every subscriber without blocking."""
+        with self._lock:
+            event_id = next(self._sequence)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        message = (
+            f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+        ).encode()
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        for subscriber in subscribers:
+            if subscriber.loop is current_loop:
+                if not subscriber.offer(message):
+                    self._evict(subscriber)
+            else:
+                # asyncio queues are not thread-safe: hand over on the owner's loop
+                subscriber.loop.call_soon_threadsafe(self._offer_or_evict, subscriber, message)
+
+    def _offer_or_evict(self, subscriber: Subscriber, message: bytes):
+        if not subscriber.offer(message):
+            self._evict(subscriber)
+
+    def _evict(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.discard(subscriber)
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "evicted": self.evicted,
+            }
+
+
+async def stream(hub: EventHub, subscriber: Subscriber, keepalive: float = EVENT_KEEPALIVE_SECONDS):
+    """Yields SSE frames for one subscriber until it is evicted or disconnects."""
+    try:
+        # Tell EventSource how long to wait before reconnecting
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                yield b": keepalive\n\n"
+                continue
+            if message is None:
+                return
+            yield message
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+# --- Delta helpers used by the endpoints ---
+
+def stock_changed(product_id: int, quantity: int):
+    stock_events.publish("stock", {"id": product_id, "quantity": quantity})
+
+
+def product_changed(product: dict, event_type: str = "product"):
+    stock_events.publish(event_type, product)
+
+
+def product_deleted(product_id: int):
+    stock_events.publish("deleted", {"id": product_id})
+
+
+def catalogue_reloaded():
+    """Tells clients to refetch, for changes too large to send as deltas."""
+    stock_events.publish("reload", {})
+
+
+# Shared hub for catalogue changes
+stock_events = EventHub()
@@ -0,0 +1,147 @@
+"""Fast JSON encoding and compression for the catalogue responses.
+
+By default catalogue rows are validated against schemas.Product before they
+are sent. With FAST_JSON=1 the rows that come straight from a Core select()
+are encoded as they are: their columns already have the schema's types, so
+the per-row validation only costs CPU. Encoding uses orjson when it is
+installed (`pip install .[speedups]`), otherwise the standard library.
+Decimal prices are written as plain numbers either way.
+
+Large bodies can also be compressed (RESPONSE_COMPRESSION=br,gzip, in order
+of preference; brotli needs the "speedups" extra). A compressed body is kept
+per ETag, so each cached catalogue response is compressed once, not once per
+request.
+"""
+import gzip
+import json
+import os
+from decimal import Decimal
+
+from .cache import TTLCache
+
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "off") # e.g. "br,gzip", or "off"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "4096"))
+COMPRESSED_CACHE_SIZE = int(os.getenv("COMPRESSED_CACHE_SIZE", "256"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # Brotli's slower levels cost far more CPU for a few percent
+
+try:
+    import orjson # Optional dependency (the "speedups" extra)
+except ImportError:
+    orjson = None
+
+try:
+    import brotli # Optional dependency (the "speedups" extra)
+except ImportError:
+    brotli = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Encodes plain dicts, lists and scalars to compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return dumps_stdlib(value)
+
+
+def dumps_stdlib(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+def _compress_gzip(body: bytes) -> bytes:
+    # mtime=0 keeps the output, and so any cache of it, deterministic
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def _available_codings() -> dict:
+    codings = {"gzip": _compress_gzip}
+    if brotli is not None:
+        codings["br"] = _compress_brotli
+    return codings
+
+
+def _enabled_codings(setting: str) -> list[str]:
+    if setting == "off":
+        return []
+    available = _available_codings()
+    return [name.strip() for name in setting.split(",") if name.strip() in available]
+
+
+def accepted_codings(accept_encoding: str | None) -> set[str]:
+    """Codings the client accepts, ignoring any with q=0."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class Compressor:
+    def __init__(
+        self,
+        codings: list[str],
+        min_bytes: int = COMPRESSION_MIN_BYTES,
+        maxsize: int = COMPRESSED_CACHE_SIZE,
+    ):
+        self.codings = codings
+        self.min_bytes = min_bytes
+        self._compressors = _available_codings()
+        # (etag, coding) -> compressed body; cached bodies never change under an ETag
+        self._bodies = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def choose(self, body: bytes, accept_encoding: str | None) -> str | None:
+        """The preferred coding for this body and client, if any."""
+        if len(body) < self.min_bytes or not self.codings:
+            return None
+        accepted = accepted_codings(accept_encoding)
+        for coding in self.codings:
+            if coding in accepted or "*" in accepted:
+                return coding
+        return None
+
+    def compress(self, body: bytes, coding: str, etag: str | None = None) -> bytes:
+        if etag is not None:
+            cached = self._bodies.get((etag, coding))
+            if cached is not None:
+                return cached
+        compressed = self._compressors[coding](body)
+        self.compressed += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        if etag is not None:
+            self._bodies.set((etag, coding), compressed)
+        return compressed
+
+    def stats(self) -> dict:
+        return {
+            **self._bodies.stats(),
+            "codings": self.codings,
+            "compressed": self.compressed,
+            "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 0.0,
+        }
+
+
+# Shared compressor for the cached catalogue responses
+compressor = Compressor(_enabled_codings(RESPONSE_COMPRESSION))
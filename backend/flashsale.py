@@ -0,0 +1,395 @@
+"""Flash-sale mode: in-memory stock for hot products, written behind in batches.
+
+During a promotion thousands of purchases hit the same few products rows,
+and every one of them would otherwise be its own SELECT, UPDATE and commit,
+serialized by SQLite's single writer. A seller can flag such products as hot
+(PUT /admin/flash-sale/{id}). For a hot product:
+
+* The authoritative stock lives in an in-memory counter. A purchase checks and
+  decrements it without an await in between, so it is atomic on the event
+  loop and can never oversell, and it is acknowledged without touching the
+  database.
+* Before it is acknowledged, the sale is appended to a small write-ahead file
+  (FLASH_SALE_WAL_PATH). A background flusher then commits all pending sales
+  in one transaction every FLASH_SALE_FLUSH_MS: one UPDATE per product, the
+  ledger rows, the orders and the sequence number of the last sale applied,
+  together.
+* On startup, sales in the write-ahead file past that sequence number are
+  applied before anything else runs, so a crash loses nothing that was
+  acknowledged. (The file is written, not fsynced, per sale: a process crash
+  is covered, a power cut has the same window as SQLITE_PROFILE=production.)
+
+The counter always equals the available stock in the database (quantity
+minus units held by cart reservations) minus the sales still pending, so
+restocks, checkouts and reservation confirms and releases keep working on
+hot products by moving both by the same amount; new reservations are
+refused. Edits, deletes and imports that set the quantity outright
+are refused until the sale ends (DELETE /admin/flash-sale/{id}), which
+flushes first. The catalogue endpoints read the database, so they can lag
+the counter by one flush interval.
+
+Counters are per process: run flash sales on a single worker. Hot flags do
+not survive a restart (the sales do).
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from . import analytics, jobs, ledger, models, orders, response_cache
+from .database import SessionLocal
+
+FLASH_SALE_ENABLED = os.getenv("FLASH_SALE_ENABLED", "0") == "1"
+FLASH_SALE_WAL_PATH = os.getenv("FLASH_SALE_WAL_PATH", os.path.join(tempfile.gettempdir(), "sweet_shop_flash_sale.wal"))
+FLASH_SALE_FLUSH_MS = int(os.getenv("FLASH_SALE_FLUSH_MS", "50"))
+# Rewrite the write-ahead file down to the pending sales once it passes this size
+FLASH_SALE_WAL_MAX_BYTES = int(os.getenv("FLASH_SALE_WAL_MAX_BYTES", str(8 * 1024 * 1024)))
+SETTLE_POLL_SECONDS = 0.001 # Sales start and end rarely, so polling is fine
+
+logger = logging.getLogger(__name__)
+
+checkpoints_table = models.WriteBehindCheckpoint.__table__
+
+# One executemany for every hot product in a batch
+_DECREMENT = (
+    update(models.Product.__table__)
+    .where(models.Product.__table__.c.id == bindparam("pid"))
+    .values(quantity=models.Product.__table__.c.quantity - bindparam("n"))
+)
+
+
+class ProductOnSale(Exception):
+    """Raised for a write that can't be combined with a running flash sale."""
+
+
+class WriteAheadLog:
+    """Append-only file of sales not yet committed to the database."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: int | None = None
+
+    def open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, record: dict):
+        os.write(self._fd, (json.dumps(record, default=str, separators=(",", ":")) + "\n").encode())
+
+    def size(self) -> int:
+        return os.fstat(self._fd).st_size
+
+    def truncate(self):
+        os.ftruncate(self._fd, 0)
+
+    def rewrite(self, records: list[dict]):
+        """Replaces the file with just `records`, atomically."""
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, default=str, separators=(",", ":")) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.close()
+        os.replace(temporary, self.path)
+        self.open()
+
+    def read(self) -> list[dict]:
+        """Every complete record; a torn last line was never acknowledged."""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+
+def _to_entry(record: dict) -> dict:
+    """Turns a pending or write-ahead record back into a ledger.entry() row."""
+    entry = {key: value for key, value in record.items() if key not in ("seq", "name", "jobs")}
+    # Records read back from the file hold strings
+    if isinstance(entry["created_at"], str):
+        entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+    if isinstance(entry["unit_price"], str):
+        entry["unit_price"] = Decimal(entry["unit_price"])
+    return entry
+
+
+def commit_sales(db: Session, stream: str, records: list[dict]) -> int:
+    """Applies a batch of sales in one transaction; returns how many were new.
+
+    Records at or below the stream's checkpoint were applied before (a crash
+    between commit and cleanup), so they are skipped.
+    """
+    applied = db.scalar(select(checkpoints_table.c.sequence).where(checkpoints_table.c.stream == stream))
+    records = [record for record in records if applied is None or record["seq"] > applied]
+    if not records:
+        return 0
+    totals: dict[int, int] = {}
+    for record in records:
+        totals[record["product_id"]] = totals.get(record["product_id"], 0) - record["delta"]
+    db.execute(_DECREMENT, [{"pid": pid, "n": n} for pid, n in totals.items()])
+    entries = [_to_entry(record) for record in records]
+    db.execute(ledger.INSERT_EVENTS, entries)
+    # Each sale is its own order, dated when it was made rather than written
+    orders.record_many(db, [
+        (entry["user_id"], entry["created_at"], [{
+            "product_id": entry["product_id"],
+            "name": record["name"],
+            "quantity": -entry["delta"],
+            "unit_price": entry["unit_price"],
+        }])
+        for record, entry in zip(records, entries)
+    ])
+    follow_ups = [job for record in records for job in record.get("jobs", ())]
+    if follow_ups:
+        db.execute(jobs.INSERT_JOBS, follow_ups)
+    last = records[-1]["seq"]
+    if applied is None:
+        db.execute(checkpoints_table.insert().values(stream=stream, sequence=last))
+    else:
+        db.execute(checkpoints_table.update().where(checkpoints_table.c.stream == stream).values(sequence=last))
+    db.commit()
+    return len(records)
+
+
+class HotStock:
+    """Counters and pending sales for the hot products.
+
+    Only used from the event loop thread, and never across an await between
+    a check and its update, so no locks are needed for the counters.
+
+    Starting or ending a sale must not overlap a purchase that goes to the
+    database for the same product, or the counter and the row would disagree.
+    Such writes run inside db_write(), which start() waits out, and call
+    settle() first, which waits out a sale starting or ending.
+    """
+
+    def __init__(self, wal_path: str = FLASH_SALE_WAL_PATH):
+        self.stream = os.path.abspath(wal_path)
+        self.wal = WriteAheadLog(wal_path)
+        self.products: dict[int, dict] = {} # id -> product row, quantity being the counter
+        self.pending: list[dict] = []
+        self.sequence = 0
+        self.starting: set[int] = set()
+        self.draining: set[int] = set()
+        self._db_writers: dict[int, int] = {}
+        self._bulk_writers = 0 # Imports, which may write any product
+        self._flush_lock = asyncio.Lock()
+        self.sold = 0
+        self.flushes = 0
+        self.flushed = 0
+
+    # --- Lifecycle ---
+
+    def recover(self, db: Session) -> int:
+        """Applies sales left in the write-ahead file; call before serving."""
+        records = self.wal.read()
+        recovered = commit_sales(db, self.stream, records) if records else 0
+        applied = db.scalar(select(checkpoints_table.c.sequence).where(checkpoints_table.c.stream == self.stream))
+        self.sequence = max([applied or 0] + [record["seq"] for record in records])
+        self.wal.close()
+        self.wal.rewrite([])
+        return recovered
+
+    def close(self):
+        self.wal.close()
+
+    # --- Starting and ending sales ---
+
+    def is_hot(self, product_id: int) -> bool:
+        return product_id in self.products
+
+    async def start(self, product_id: int, load) -> dict | None:
+        """Makes a product hot, with `load()` reading its current row; None if it doesn't exist."""
+        if product_id in self.products:
+            return self.products[product_id]
+        await self.settle([product_id])
+        self.starting.add(product_id)
+        try:
+            while self._db_writers.get(product_id) or self._bulk_writers:
+                await asyncio.sleep(SETTLE_POLL_SECONDS)
+            row = await load()
+            if row is not None:
+                self.products[product_id] = dict(row)
+            return row
+        finally:
+            self.starting.discard(product_id)
+
+    async def stop(self, product_id: int):
+        """Hands a product back to the database once its pending sales are committed."""
+        if self.products.pop(product_id, None) is None:
+            return
+        self.draining.add(product_id)
+        await self.flush()
+        # Left draining if the flush failed, so writes keep waiting for a retry
+        self.draining.discard(product_id)
+
+    async def settle(self, product_ids):
+        """Waits while any of the products is starting or ending a sale."""
+        while any(pid in self.starting or pid in self.draining for pid in product_ids):
+            if any(pid in self.draining for pid in product_ids):
+                await self.flush()
+            await asyncio.sleep(SETTLE_POLL_SECONDS)
+
+    @contextmanager
+    def db_write(self, product_ids):
+        """Marks a stock change that goes straight to the database."""
+        for pid in product_ids:
+            self._db_writers[pid] = self._db_writers.get(pid, 0) + 1
+        try:
+            yield
+        finally:
+            for pid in product_ids:
+                self._db_writers[pid] -= 1
+                if not self._db_writers[pid]:
+                    del self._db_writers[pid]
+
+    @contextmanager
+    def bulk_write(self):
+        """Marks a write to products not known up front; sales wait for it to start."""
+        self._bulk_writers += 1
+        try:
+            yield
+        finally:
+            self._bulk_writers -= 1
+
+    def check_writable(self, product_id: int):
+        if product_id in self.products:
+            raise ProductOnSale("Product is in a flash sale; end the sale before editing or deleting it")
+
+    def refresh(self, rows: list[dict]):
+        """Picks up new names, descriptions or prices of hot products."""
+        for row in rows:
+            if row["id"] in self.products:
+                self.products[row["id"]].update({k: v for k, v in row.items() if k != "quantity"})
+
+    # --- Stock ---
+
+    def take(self, wanted: dict[int, int]) -> list[int]:
+        """Takes stock of hot products, all or nothing; returns the ids that are short."""
+        short = [pid for pid, n in wanted.items() if self.products[pid]["quantity"] < n]
+        if not short:
+            for pid, n in wanted.items():
+                self.products[pid]["quantity"] -= n
+        return short
+
+    def give_back(self, wanted: dict[int, int]):
+        for pid, n in wanted.items():
+            if pid in self.products:
+                self.products[pid]["quantity"] += n
+
+    def add(self, product_id: int, quantity: int):
+        """Mirrors a restock that was committed straight to the database."""
+        if product_id in self.products:
+            self.products[product_id]["quantity"] += quantity
+
+    def purchase(self, product_id: int, quantity: int, user_id: int) -> dict | None:
+        """Sells from the counter and logs the sale; None if there isn't enough."""
+        if self.take({product_id: quantity}):
+            return None
+        product = self.products[product_id]
+        self.sequence += 1
+        sold = {product_id: quantity}
+        record = {
+            "seq": self.sequence,
+            **ledger.entry(product_id, -quantity, "purchase", user_id=user_id, unit_price=product["price"]),
+            "name": product["name"], # For the order line
+            # Receipt and alert jobs, inserted with the sale when it is written behind
+            "jobs": [jobs.receipt(user_id, [product], sold), *jobs.low_stock_alerts([product], sold)],
+        }
+        # Logged before the purchase is acknowledged, so recovery can replay it
+        self.wal.append(record)
+        self.pending.append(record)
+        self.sold += 1
+        return dict(product)
+
+    # --- Write-behind ---
+
+    async def flush(self) -> int:
+        """Commits every pending sale in one transaction; returns how many."""
+        async with self._flush_lock:
+            batch = list(self.pending)
+            if not batch:
+                return 0
+            await run_in_threadpool(self._commit, batch)
+            # Sales made during the commit stay pending for the next flush
+            del self.pending[:len(batch)]
+            if not self.pending:
+                self.wal.truncate()
+            elif self.wal.size() > FLASH_SALE_WAL_MAX_BYTES:
+                self.wal.rewrite(self.pending)
+            self.flushes += 1
+            self.flushed += len(batch)
+
+        jobs.runner.wake()
+        entries = [_to_entry(record) for record in batch]
+        analytics.sales.record_entries(entries)
+        response_cache.catalogue_cache.bump_version()
+        return len(batch)
+
+    def _commit(self, batch: list[dict]):
+        with SessionLocal() as db:
+            commit_sales(db, self.stream, batch)
+
+    async def run_flusher(self, interval: float = FLASH_SALE_FLUSH_MS / 1000):
+        """Background task: group-commits pending sales every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                # The sales stay pending (and in the write-ahead file) for the next try
+                logger.exception("Flash-sale flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": FLASH_SALE_ENABLED,
+            "hot_products": {pid: product["quantity"] for pid, product in self.products.items()},
+            "pending": len(self.pending),
+            "sold": self.sold,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "sales_per_flush": self.flushed / self.flushes if self.flushes else 0.0,
+        }
+
+
+# Shared state for the purchase endpoints
+hot_stock = HotStock()
+
+
+# --- Route dependencies ---
+
+async def stock_write_guard(product_id: int):
+    """Holds off starting or ending a sale while the endpoint writes this product's stock."""
+    await hot_stock.settle([product_id])
+    with hot_stock.db_write([product_id]):
+        yield
+
+
+async def product_edit_guard(product_id: int):
+    """Refuses edits and deletes of a product while it is in a flash sale."""
+    await hot_stock.settle([product_id])
+    try:
+        hot_stock.check_writable(product_id)
+    except ProductOnSale as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    with hot_stock.db_write([product_id]):
+        yield
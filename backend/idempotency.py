@@ -0,0 +1,141 @@
+"""Idempotency keys for the stock-changing endpoints.
+
+A client that sends an Idempotency-Key header can retry a purchase, checkout
+or restock safely: the first request with a key does the work, and its
+outcome is kept for IDEMPOTENCY_TTL_SECONDS. A retry with the same key gets
+that outcome back (with an Idempotent-Replayed header) without touching the
+products table. Duplicates that arrive while the first is still running wait
+for it instead of running the work again.
+
+Keys are scoped to the user, so two customers can't collide. Reusing a key
+for a different request (another product or quantity) is a client bug and
+gets a 422. Only outcomes that a retry would get anyway are kept: successes
+and client errors such as insufficient stock. Transient failures (409, 429,
+5xx) are not, so the retry runs for real.
+
+Outcomes are stored per process in a bounded LRU, like the other in-process
+caches.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException, Response, status
+
+from .cache import TTLCache
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+MAX_KEY_LENGTH = 255
+
+# Failures a retry could succeed at, so they are never replayed
+TRANSIENT_STATUSES = {status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+@dataclass(frozen=True)
+class Outcome:
+    fingerprint: str
+    result: Any = None
+    error: tuple[int, Any, dict | None] | None = None # (status, detail, headers)
+
+    def replay(self, response: Response) -> Any:
+        if self.error is not None:
+            status_code, detail, headers = self.error
+            raise HTTPException(
+                status_code=status_code,
+                detail=detail,
+                headers={**(headers or {}), "Idempotent-Replayed": "true"},
+            )
+        response.headers["Idempotent-Replayed"] = "true"
+        return self.result
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable digest of what a request asked for."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self._outcomes = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: dict[tuple, tuple[str, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    async def run(
+        self,
+        key: str | None,
+        scope: str,
+        request_fingerprint: str,
+        response: Response,
+        work: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Runs `work` once per (scope, key), replaying its outcome for repeats."""
+        if key is None:
+            return await work()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+        cache_key = (scope, key)
+        outcome = self._outcomes.get(cache_key)
+        if outcome is not None:
+            self._check_fingerprint(outcome.fingerprint, request_fingerprint)
+            return outcome.replay(response)
+
+        with self._lock:
+            running = self._in_flight.get(cache_key)
+            if running is None:
+                future = asyncio.get_running_loop().create_future()
+                self._in_flight[cache_key] = (request_fingerprint, future)
+        if running is not None:
+            running_fingerprint, future = running
+            self._check_fingerprint(running_fingerprint, request_fingerprint)
+            self.coalesced += 1
+            # Shielded, so a client giving up doesn't cancel the shared work
+            outcome = await asyncio.shield(future)
+            return outcome.replay(response)
+
+        try:
+            try:
+                result = await work()
+            except HTTPException as exc:
+                outcome = Outcome(request_fingerprint, error=(exc.status_code, exc.detail, exc.headers))
+                if exc.status_code < 500 and exc.status_code not in TRANSIENT_STATUSES:
+                    self._outcomes.set(cache_key, outcome)
+                future.set_result(outcome)
+                raise
+            outcome = Outcome(request_fingerprint, result=result)
+            self._outcomes.set(cache_key, outcome)
+            future.set_result(outcome)
+            return result
+        except BaseException as exc:
+            if not future.done():
+                if isinstance(exc, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(exc)
+                    # Waiters see the error; nobody else needs to retrieve it
+                    future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(cache_key, None)
+
+    @staticmethod
+    def _check_fingerprint(stored: str, received: str):
+        if stored != received:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different request",
+            )
+
+    def stats(self) -> dict:
+        return {**self._outcomes.stats(), "in_flight": len(self._in_flight), "coalesced": self.coalesced}
+
+
+# Shared store for purchase, checkout and restock
+stock_requests = IdempotencyStore()
@@ -0,0 +1,267 @@
+"""Background jobs for side effects of purchases and restocks.
+
+Receipts and low-stock alerts don't have to be done before a purchase is
+acknowledged, and a slow or failing webhook must not slow purchases down.
+Endpoints insert a row into the jobs table in the same transaction as the
+stock change (so a job exists if and only if the change was committed) and
+return straight away. A pool of JOBS_WORKERS tasks then claims due jobs and
+runs their handlers, retrying failures with exponential backoff until
+JOBS_MAX_ATTEMPTS, after which a job is left in the table as 'failed'.
+
+A claimed job is leased for JOBS_LEASE_SECONDS: if its worker dies, the job
+becomes due again when the lease runs out, so a restart (or another worker
+process) picks it up. Handlers may therefore run more than once and should
+tolerate that.
+
+Deliveries go to JOBS_WEBHOOK_URL as JSON POSTs when it is set, and to the
+log otherwise.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import urllib.request
+from datetime import timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import ledger, models
+from .database import SessionLocal
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2")) # 0 leaves jobs for another process
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_BACKOFF_SECONDS = float(os.getenv("JOBS_BACKOFF_SECONDS", "2.0")) # Doubles per attempt
+JOBS_BACKOFF_MAX_SECONDS = float(os.getenv("JOBS_BACKOFF_MAX_SECONDS", "300"))
+JOBS_LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", "60"))
+JOBS_TIMEOUT_SECONDS = float(os.getenv("JOBS_TIMEOUT_SECONDS", "10"))
+# Idle workers look for jobs from other processes or retries this often
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1.0"))
+JOBS_WEBHOOK_URL = os.getenv("JOBS_WEBHOOK_URL", "") # e.g. http://127.0.0.1:9000/hooks; empty logs instead
+
+logger = logging.getLogger(__name__)
+
+jobs_table = models.Job.__table__
+
+# Executed with a list of job() dicts, in the transaction of the change behind them
+INSERT_JOBS = insert(jobs_table)
+
+
+class JobFailed(Exception):
+    """Raised by a handler for a failure worth retrying."""
+
+
+def job(kind: str, payload: dict) -> dict:
+    """Builds one row for INSERT_JOBS."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind!r}")
+    return {"kind": kind, "payload": json.dumps(payload, default=str, separators=(",", ":"))}
+
+
+def receipt(user_id: int, products: list[dict], quantities: dict[int, int]) -> dict:
+    """A receipt job for the products (rows with id, name and price) a user just bought."""
+    lines = [
+        {"product_id": product["id"], "name": product["name"], "quantity": quantities[product["id"]], "unit_price": product["price"]}
+        for product in products
+    ]
+    total = sum(line["unit_price"] * line["quantity"] for line in lines)
+    return job("purchase_receipt", {"user_id": user_id, "lines": lines, "total": total})
+
+
+def low_stock_alerts(products: list[dict], sold: dict[int, int]) -> list[dict]:
+    """Alert jobs for the products a sale took down to their threshold.
+
+    Stock means what is available, quantity - reserved (rows without
+    `reserved` are already available counts, like the flash-sale counters).
+    Only the sale that crosses the threshold alerts, not every sale below it;
+    after a restock above it, the next crossing alerts again.
+    """
+    alerts = []
+    for product in products:
+        threshold = product.get("low_stock_threshold")
+        after = product["quantity"] - product.get("reserved", 0)
+        if threshold is not None and after + sold[product["id"]] > threshold >= after:
+            alerts.append(job("low_stock_alert", {
+                "product_id": product["id"], "name": product["name"], "quantity": after, "threshold": threshold,
+            }))
+    return alerts
+
+
+# --- Handlers ---
+
+def _post_webhook(event: str, payload: dict):
+    body = json.dumps({"event": event, **payload}).encode()
+    request = urllib.request.Request(
+        JOBS_WEBHOOK_URL, data=body, method="POST", headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=JOBS_TIMEOUT_SECONDS) as response:
+            response.read()
+    except OSError as exc: # URLError, HTTPError and timeouts
+        raise JobFailed(f"Webhook {event} failed: {exc}") from exc
+
+
+async def deliver(event: str, payload: dict):
+    if not JOBS_WEBHOOK_URL:
+        logger.info("%s: %s", event, payload)
+        return
+    await run_in_threadpool(_post_webhook, event, payload)
+
+
+async def send_receipt(payload: dict):
+    await deliver("purchase_receipt", payload)
+
+
+async def alert_sellers(payload: dict):
+    logger.warning(
+        "Low stock: %s (#%s) is down to %s (threshold %s)",
+        payload["name"], payload["product_id"], payload["quantity"], payload["threshold"],
+    )
+    await deliver("low_stock_alert", payload)
+
+
+# kind -> async handler(payload)
+HANDLERS = {
+    "purchase_receipt": send_receipt,
+    "low_stock_alert": alert_sellers,
+}
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry number `attempts`, jittered so failures don't retry in lockstep."""
+    delay = min(JOBS_BACKOFF_MAX_SECONDS, JOBS_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# --- Claiming and finishing jobs (sync, run in the threadpool) ---
+
+def claim(db: Session) -> dict | None:
+    """Leases the oldest due job, if any, and returns it."""
+    now = ledger.utcnow()
+    due = (jobs_table.c.status.in_(("pending", "running"))) & (jobs_table.c.run_after <= now)
+    oldest = select(jobs_table.c.id).where(due).order_by(jobs_table.c.run_after).limit(1).scalar_subquery()
+    row = db.execute(
+        update(jobs_table)
+        # Repeating the condition makes the claim atomic against other workers
+        .where(jobs_table.c.id == oldest, due)
+        .values(
+            status="running",
+            attempts=jobs_table.c.attempts + 1,
+            run_after=now + timedelta(seconds=JOBS_LEASE_SECONDS),
+        )
+        .returning(jobs_table.c.id, jobs_table.c.kind, jobs_table.c.payload, jobs_table.c.attempts)
+    ).mappings().first()
+    db.commit()
+    return dict(row) if row is not None else None
+
+
+def finish(db: Session, job_id: int, error: str | None, attempts: int) -> str:
+    """Records a run: deletes a job that succeeded, reschedules or fails one that didn't."""
+    if error is None:
+        db.execute(delete(jobs_table).where(jobs_table.c.id == job_id))
+        outcome = "done"
+    elif attempts >= JOBS_MAX_ATTEMPTS:
+        db.execute(update(jobs_table).where(jobs_table.c.id == job_id).values(status="failed", last_error=error))
+        outcome = "failed"
+    else:
+        db.execute(update(jobs_table).where(jobs_table.c.id == job_id).values(
+            status="pending",
+            last_error=error,
+            run_after=ledger.utcnow() + timedelta(seconds=backoff(attempts)),
+        ))
+        outcome = "retry"
+    db.commit()
+    return outcome
+
+
+def _in_session(fn, *args):
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+
+class JobRunner:
+    """A pool of worker tasks running jobs from the jobs table."""
+
+    def __init__(self, workers: int = JOBS_WORKERS):
+        self.workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._wake: asyncio.Event | None = None
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        # An interrupted job keeps its lease and runs again after a restart
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Call after committing new jobs, so idle workers don't wait for the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run_one(self) -> bool:
+        """Claims and runs one due job; False if none was due."""
+        claimed = await run_in_threadpool(_in_session, claim)
+        if claimed is None:
+            return False
+        error = None
+        try:
+            payload = json.loads(claimed["payload"])
+            await asyncio.wait_for(HANDLERS[claimed["kind"]](payload), JOBS_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            logger.warning("Job %s (%s) failed on attempt %s: %s", claimed["id"], claimed["kind"], claimed["attempts"], error)
+        outcome = await run_in_threadpool(_in_session, finish, claimed["id"], error, claimed["attempts"])
+        if outcome == "done":
+            self.done += 1
+        elif outcome == "retry":
+            self.retried += 1
+        else:
+            self.failed += 1
+        return True
+
+    async def drain(self) -> int:
+        """Runs jobs until none is due; returns how many ran."""
+        ran = 0
+        while await self.run_one():
+            ran += 1
+        return ran
+
+    async def _work(self):
+        while True:
+            # Cleared before looking, so a wake() during the claim isn't lost
+            self._wake.clear()
+            try:
+                if await self.run_one():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error")
+            try:
+                await asyncio.wait_for(self._wake.wait(), JOBS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+# Shared worker pool, started by the app's lifespan
+runner = JobRunner()
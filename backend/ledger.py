@@ -0,0 +1,234 @@
+"""Append-only inventory ledger.
+
+Every change to Product.quantity also appends a row to inventory_events, in
+the same transaction, so the ledger and the stock column can never disagree.
+A periodic compaction folds new events into inventory_snapshots (one row per
+product that changed). Stock at any point in time is then the latest snapshot
+taken before that moment plus the few events after it, instead of a replay of
+the whole history.
+
+Reports read only the ledger, so they never touch (or lock) the hot rows in
+the products table that purchases update.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import and_, func, insert, literal, select, type_coerce
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models, money
+
+# Seconds between background compactions; 0 turns them off (e.g. when a cron
+# job runs compact() instead)
+LEDGER_COMPACT_INTERVAL_SECONDS = int(os.getenv("LEDGER_COMPACT_INTERVAL_SECONDS", "300"))
+
+REASONS = ("opening", "create", "purchase", "restock", "adjust", "import", "delete")
+# Reasons that start a product's history. SQLite can hand a deleted product's
+# id to a new one, so replays never look back past the latest of these.
+START_REASONS = ("opening", "create")
+
+events_table = models.InventoryEvent.__table__
+snapshots_table = models.InventorySnapshot.__table__
+
+# Executed with a list of entry() dicts, so one statement covers a whole cart
+INSERT_EVENTS = insert(events_table)
+
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp, the form the ledger stores."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def as_utc(moment: datetime) -> datetime:
+    """Converts an aware datetime to naive UTC; naive values are taken as UTC."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def entry(
+    product_id: int,
+    delta: int,
+    reason: str,
+    *,
+    user_id: int | None = None,
+    unit_price: Decimal | None = None,
+) -> dict:
+    """Builds one row for INSERT_EVENTS."""
+    if reason not in REASONS:
+        raise ValueError(f"Unknown ledger reason: {reason!r}")
+    return {
+        "product_id": product_id,
+        "delta": delta,
+        "reason": reason,
+        "unit_price": unit_price,
+        "user_id": user_id,
+        "created_at": utcnow(),
+    }
+
+
+# --- Compaction ---
+
+def record_opening_balances(db: Session) -> int:
+    """Gives products that predate the ledger an 'opening' event for their stock."""
+    products = models.Product.__table__
+    has_events = select(events_table.c.id).where(events_table.c.product_id == products.c.id).exists()
+    result = db.execute(
+        insert(events_table).from_select(
+            ["product_id", "delta", "reason", "created_at"],
+            select(products.c.id, func.coalesce(products.c.quantity, 0), literal("opening"), literal(utcnow()))
+            .where(~has_events),
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def compact(db: Session) -> int:
+    """Folds events since the last compaction into new snapshots.
+
+    Returns the number of snapshots written. Safe to run from several workers:
+    a run that loses the race on the unique index just writes nothing.
+    """
+    # 1. The range of events not yet covered by any snapshot
+    last = db.scalar(select(func.max(snapshots_table.c.event_id))) or 0
+    upto = db.scalar(select(func.max(events_table.c.id)))
+    if upto is None or upto <= last:
+        return 0
+
+    # 2. Net change per product over that range, counted from the latest
+    # start event if the product (re)started within it. A product with no
+    # new events keeps its older snapshot, which is still current.
+    in_range = and_(events_table.c.id > last, events_table.c.id <= upto)
+    starts = dict(db.execute(
+        select(events_table.c.product_id, func.max(events_table.c.id))
+        .where(in_range, events_table.c.reason.in_(START_REASONS))
+        .group_by(events_table.c.product_id)
+    ).all())
+    deltas: dict[int, int] = {}
+    for product_id, event_id, delta in db.execute(
+        select(events_table.c.product_id, events_table.c.id, events_table.c.delta).where(in_range)
+    ):
+        if event_id >= starts.get(product_id, 0):
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+
+    # 3. Add each net change to the product's latest snapshot
+    latest = (
+        select(snapshots_table.c.product_id, func.max(snapshots_table.c.event_id).label("event_id"))
+        .where(snapshots_table.c.product_id.in_(list(deltas)))
+        .group_by(snapshots_table.c.product_id)
+        .subquery()
+    )
+    previous = dict(db.execute(
+        select(snapshots_table.c.product_id, snapshots_table.c.quantity).join(
+            latest,
+            and_(
+                snapshots_table.c.product_id == latest.c.product_id,
+                snapshots_table.c.event_id == latest.c.event_id,
+            ),
+        )
+    ).all())
+
+    taken_at = utcnow()
+    rows = [
+        {
+            "product_id": product_id,
+            "event_id": upto,
+            "quantity": delta if product_id in starts else previous.get(product_id, 0) + delta,
+            "taken_at": taken_at,
+        }
+        for product_id, delta in deltas.items()
+    ]
+    try:
+        db.execute(insert(snapshots_table), rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return 0
+    return len(rows)
+
+
+# --- Queries ---
+
+def stock_at(db: Session, product_id: int, at: datetime | None = None) -> int | None:
+    """Stock of a product at a moment (now by default), rebuilt from the ledger.
+
+    Returns None if the ledger has no record of the product by then.
+    """
+    at = utcnow() if at is None else as_utc(at)
+
+    # 1. Where the product's current history starts
+    start = db.scalar(
+        select(func.max(events_table.c.id)).where(
+            events_table.c.product_id == product_id,
+            events_table.c.reason.in_(START_REASONS),
+            events_table.c.created_at <= at,
+        )
+    ) or 0
+
+    # 2. Latest snapshot taken by then, unless it predates that start
+    snapshot = db.execute(
+        select(snapshots_table.c.event_id, snapshots_table.c.quantity)
+        .where(
+            snapshots_table.c.product_id == product_id,
+            snapshots_table.c.event_id >= start,
+            snapshots_table.c.taken_at <= at,
+        )
+        .order_by(snapshots_table.c.event_id.desc())
+        .limit(1)
+    ).first()
+    after_event, quantity = snapshot if snapshot else (start - 1, None)
+
+    # 3. Replay only the events since then
+    count, delta = db.execute(
+        select(func.count(), func.coalesce(func.sum(events_table.c.delta), 0))
+        .where(
+            events_table.c.product_id == product_id,
+            events_table.c.id > after_event,
+            events_table.c.created_at <= at,
+        )
+    ).one()
+    if quantity is None and not count:
+        return None
+    return (quantity or 0) + delta
+
+
+def sales_report(db: Session, start: datetime, end: datetime, seller_id: int | None = None) -> list[dict]:
+    """Units sold and revenue per product in [start, end), best sellers first.
+
+    With `seller_id`, only that seller's current products are reported.
+    """
+    units = func.sum(-events_table.c.delta)
+    stmt = (
+        select(
+            events_table.c.product_id,
+            models.Product.name,
+            units.label("units_sold"),
+            # Summed in minor units, read back as a Decimal
+            type_coerce(func.sum(-events_table.c.delta * events_table.c.unit_price), money.Money()).label("revenue"),
+            func.count().label("sales"),
+        )
+        # Outer join: sales of since-deleted products still count
+        .outerjoin(models.Product, models.Product.id == events_table.c.product_id)
+        .where(
+            events_table.c.reason == "purchase",
+            events_table.c.created_at >= as_utc(start),
+            events_table.c.created_at < as_utc(end),
+        )
+        .group_by(events_table.c.product_id, models.Product.name)
+        .order_by(units.desc(), events_table.c.product_id)
+    )
+    if seller_id is not None:
+        stmt = stmt.where(models.Product.seller_id == seller_id)
+    return [
+        dict(row, revenue=row["revenue"] or money.ZERO)
+        for row in db.execute(stmt).mappings()
+    ]
+
+
+def default_report_window(end: datetime | None = None) -> tuple[datetime, datetime]:
+    """The last 24 hours up to `end` (now by default)."""
+    end = utcnow() if end is None else as_utc(end)
+    return end - timedelta(days=1), end
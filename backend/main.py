@@ -1,27 +1,123 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Literal
+from urllib.parse import urlencode
+from pydantic import TypeAdapter
+import asyncio
+import io
+import logging
+import tempfile
 
-from backend.database import SessionLocal, engine
-from backend import models, schemas, auth
+from backend.database import SessionLocal, get_db, get_read_db
+from backend import database
+from backend import models, schemas, auth, search, catalogue, bulk, response_cache, events, ledger, analytics, metrics, ratelimit, idempotency, fastjson, pricing, flashsale, reservations, jobs, orders, sellers
 
 from backend.auth import check_role # Import the role checker
 
+logger = logging.getLogger(__name__)
+
+def run_with_session(fn):
+    """Runs fn(db) with a short-lived sync session (call it in the threadpool)."""
+    with SessionLocal() as db:
+        return fn(db)
+
+async def run_periodically(interval: int, fn, description: str):
+    """Runs fn(db) every `interval` seconds in the threadpool."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(run_with_session, fn)
+        except Exception:
+            # Try again on the next tick; the ledger itself is intact
+            logger.exception("%s failed", description)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if database.AUTO_MIGRATE:
+        # Products created before the ledger existed need an opening balance
+        await run_in_threadpool(run_with_session, ledger.record_opening_balances)
+        # ...and products created before seller ownership their seller
+        await run_in_threadpool(run_with_session, sellers.assign_owners)
+    if flashsale.FLASH_SALE_ENABLED:
+        # Commit flash-sale purchases that were acknowledged but not yet written
+        await run_in_threadpool(run_with_session, flashsale.hot_stock.recover)
+    # Sales aggregates are in-memory: rebuild them from the ledger's purchases
+    await run_in_threadpool(run_with_session, analytics.sales.load)
+    # Holds expire by timing wheel, not by table scans: schedule the existing ones
+    await run_in_threadpool(run_with_session, reservations.holds.load)
+    background = [asyncio.create_task(reservations.holds.run_expiry())]
+    # Receipts and alerts left by the last run (or not yet leased) are picked up too
+    jobs.runner.start()
+    if flashsale.FLASH_SALE_ENABLED:
+        background.append(asyncio.create_task(flashsale.hot_stock.run_flusher()))
+    if ledger.LEDGER_COMPACT_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(run_periodically(
+            ledger.LEDGER_COMPACT_INTERVAL_SECONDS, ledger.compact, "Inventory ledger compaction"
+        )))
+    if search.SEARCH_RELOAD_SECONDS > 0:
+        background.append(asyncio.create_task(run_periodically(
+            search.SEARCH_RELOAD_SECONDS, search.product_index.reload, "Search index reload"
+        )))
+    if analytics.ANALYTICS_TAIL_SECONDS > 0:
+        background.append(asyncio.create_task(run_periodically(
+            analytics.ANALYTICS_TAIL_SECONDS, analytics.sales.catch_up, "Sales analytics catch-up"
+        )))
+    yield
+    for task in background:
+        task.cancel()
+    await jobs.runner.stop()
+    if flashsale.FLASH_SALE_ENABLED:
+        # Write the last flash-sale purchases behind before the engine goes away
+        await flashsale.hot_stock.flush()
+        flashsale.hot_stock.close()
+    # Let in-flight password hashes finish, then stop the worker processes
+    auth.shutdown_hash_pool()
+    # Close pooled connections cleanly (lets SQLite checkpoint its WAL)
+    await database.async_engine.dispose()
+    if database.read_async_engine is not database.async_engine:
+        await database.read_async_engine.dispose()
+
 # Initialize the application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-# Create all tables in the database
-models.Base.metadata.create_all(bind=engine)
-# --- NEW: Product Initialization Function ---
+# Per-route latency and DB tallies for GET /metrics
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.register_cache("principal", auth.principal_cache.stats)
+    metrics.register_cache("catalogue_response", response_cache.catalogue_cache.stats)
+    metrics.register_cache("idempotency", idempotency.stock_requests.stats)
+    metrics.register_cache("compressed_response", fastjson.compressor.stats)
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Create all tables in the database (deployments migrate once up front instead)
+if database.AUTO_MIGRATE:
+    database.create_db_and_tables()
+
+# Columns returned by the stock-changing UPDATE statements
+PRODUCT_COLUMNS = tuple(catalogue.PRODUCT_FIELDS.values())
+
+# Serializer for product listings, built once instead of per request
+PRODUCT_LIST_ADAPTER = TypeAdapter(list[schemas.Product])
+
+def encode_products(rows: list[dict]) -> bytes:
+    """JSON for product rows from a Core select() of PRODUCT_COLUMNS."""
+    if fastjson.FAST_JSON:
+        return fastjson.dumps(rows)
+    return PRODUCT_LIST_ADAPTER.dump_json(PRODUCT_LIST_ADAPTER.validate_python(rows))
+
+def encode_product(row: dict) -> bytes:
+    if fastjson.FAST_JSON:
+        return fastjson.dumps(row)
+    return schemas.Product.model_validate(row).model_dump_json().encode()
+
+# Uploads larger than this are spooled to a temporary file during import
+IMPORT_SPOOL_MAX_BYTES = 4 * 1024 * 1024
 
 # Define the required role: only 'seller' can create, update, or delete a product
 seller_dependency = check_role("seller")
@@ -29,17 +125,26 @@ seller_dependency = check_role("seller")
 # --- Auth Endpoints ---
 
 @app.post("/register", response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Check if user already exists
-    db_user = db.query(models.User).filter(
-        (models.User.username == user.username) | (models.User.email == user.email)
-    ).first()
+async def register_user(
+    user: schemas.UserCreate,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+):
+    # Check if user already exists (on a read connection, so the writer isn't
+    # held while the password is hashed)
+    db_user = (await read_db.execute(
+        select(models.User).where(
+            (models.User.username == user.username) | (models.User.email == user.email)
+        )
+    )).scalars().first()
+    # Give the connection back to the pool before the slow hashing step
+    await read_db.close()
     
     if db_user:
         raise HTTPException(status_code=400, detail="Username or email already registered")
 
-    # Hash the password and create the user
-    hashed_password = auth.get_password_hash(user.password)
+    # Hash the password (in the hashing process pool) and create the user
+    hashed_password = await auth.hash_password_async(user.password)
     
     db_user = models.User(
         username=user.username,
@@ -49,23 +154,46 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Someone registered the same name or email while we were hashing
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username or email already registered")
+    await db.refresh(db_user)
     return db_user
 
 # Function to authenticate user (needed for login endpoint)
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def authenticate_user(db: AsyncSession, read_db: AsyncSession, username: str, password: str):
+    user = (await read_db.execute(
+        select(models.User).where(models.User.username == username)
+    )).scalars().first()
+    # Give the connection back to the pool before the slow verify step
+    await read_db.close()
     if not user:
         return False
-    if not auth.verify_password(password, user.hashed_password):
+    verified, new_hash = await auth.verify_and_update_password_async(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # The stored hash uses an old scheme or cost: upgrade it now that we
+        # know the plain password
+        users_table = models.User.__table__
+        await db.execute(
+            update(users_table).where(users_table.c.id == user.id).values(hashed_password=new_hash)
+        )
+        await db.commit()
     return user
 
 # The Working Login Endpoint (to make test_login_user_success pass)
-@app.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+# Rate limited per IP and username, and admission controlled, before the KDF runs
+@app.post("/token", dependencies=[Depends(ratelimit.login_guard)])
+async def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+):
+    user = await authenticate_user(db, read_db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,13 +211,17 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 # --- Product Endpoints ---
 
 @app.post("/products", response_model=schemas.Product, status_code=status.HTTP_201_CREATED)
-def create_product(
+async def create_product(
     product: schemas.ProductCreate, 
-    db: Session = Depends(get_db),
-    current_seller: models.User = Depends(seller_dependency) 
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency) 
 ):
-    # 1. Check for product name uniqueness (Good practice)
-    db_product = db.query(models.Product).filter(models.Product.name == product.name).first()
+    # 1. Check the name is unique in this seller's catalogue
+    db_product = (await db.execute(
+        select(models.Product.id).where(
+            models.Product.seller_id == current_seller.id, models.Product.name == product.name
+        )
+    )).first()
     if db_product:
         raise HTTPException(status_code=400, detail="Product name already exists")
 
@@ -98,156 +230,996 @@ def create_product(
         name=product.name,
         description=product.description,
         price=product.price,
-        quantity=product.quantity
+        quantity=product.quantity,
+        low_stock_threshold=product.low_stock_threshold,
+        seller_id=current_seller.id,
     )
     
-    # 3. Add, commit, and refresh the product
+    # 3. Add the product and its opening stock entry, then commit both
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await db.flush()
+    await db.execute(ledger.INSERT_EVENTS, [
+        ledger.entry(db_product.id, db_product.quantity, "create", user_id=current_seller.id)
+    ])
+    await db.commit()
+    await db.refresh(db_product)
+    search.product_index.upsert(db_product.id, db_product.name, db_product.description)
+    analytics.sales.forget(db_product.id, current_seller.id)
+    response_cache.catalogue_cache.bump_version()
+    events.product_changed(schemas.Product.model_validate(db_product).model_dump(mode="json"), "created")
     
     return db_product
 
+# --- Bulk Import/Export Endpoints ---
+# Declared before /products/{product_id} so "export" is not parsed as an id
+@app.post("/products/import", response_model=schemas.ImportSummary)
+async def bulk_import_products(
+    request: Request,
+    format: Literal["csv", "ndjson"] | None = None,
+    chunk_size: int = Query(bulk.DEFAULT_CHUNK_SIZE, ge=1, le=10000),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """
+    Upsert products from a CSV (with header) or NDJSON request body into the
+    seller's catalogue, matching their existing products by name. The format
+    defaults from the Content-Type.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv"
+
+    # Spool the upload (to disk once it gets large) instead of buffering it in memory
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+
+    # Parsing and validating thousands of rows is CPU work, so the import runs
+    # in the threadpool with a sync session rather than on the event loop
+    hot = flashsale.hot_stock
+    def run_import():
+        with SessionLocal() as db, io.TextIOWrapper(spool, encoding="utf-8", newline="") as lines:
+            # Products in a flash sale are refused row by row
+            return bulk.import_products(db, lines, format, chunk_size, current_seller.id, on_sale=hot.is_hot)
+
+    # No sale may start on a product while the import could be overwriting it
+    with hot.bulk_write():
+        report = await run_in_threadpool(run_import)
+    if report.inserted or report.updated:
+        response_cache.catalogue_cache.bump_version()
+        events.catalogue_reloaded()
+    return report.as_dict()
+
+@app.get("/products/export")
+def bulk_export_products(
+    format: Literal["csv", "ndjson"] = "csv",
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Stream the seller's products as CSV or NDJSON without loading them into memory."""
+    def stream():
+        # The stream outlives the request dependencies, so it owns its session
+        db = SessionLocal()
+        try:
+            yield from bulk.export_products(db, format, seller_id=current_seller.id)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+# --- Bulk Repricing Endpoint ---
+@app.post("/products/reprice", response_model=schemas.RepriceSummary)
+async def reprice_products(
+    rule: schemas.RepriceRule,
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """
+    Change the price of every one of the seller's products matching the rule's
+    filters (all of them if none are given) by a percentage or an amount, or
+    set a new price. Runs as a single UPDATE; prices never drop below 0.01.
+    """
+    try:
+        stmt = pricing.reprice_statement(rule, current_seller.id)
+    except pricing.RepricingError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    result = await db.execute(stmt)
+    await db.commit()
+    hot = flashsale.hot_stock
+    if result.rowcount and hot.products:
+        # Flash-sale purchases are priced from the cached rows
+        hot.refresh((await db.execute(
+            select(*PRODUCT_COLUMNS).where(models.Product.id.in_(list(hot.products)))
+        )).mappings().all())
+    if result.rowcount:
+        response_cache.catalogue_cache.bump_version()
+        events.catalogue_reloaded()
+    return {"updated": result.rowcount}
+
+# --- Live Catalogue Changes ---
+# Declared before /products/{product_id} so "events" is not parsed as an id
+@app.get("/products/events")
+async def stream_product_events():
+    """
+    Server-Sent Events stream of catalogue deltas (public endpoint).
+    Event types: stock {id, quantity}; created/product (full product);
+    deleted {id}; reload {} when clients should refetch everything.
+    """
+    try:
+        subscriber = events.stock_events.subscribe()
+    except events.HubFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many live connections, please poll instead",
+            headers={"Retry-After": "30"},
+        )
+    return StreamingResponse(
+        events.stream(events.stock_events, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Product Search Endpoint ---
+# Declared before /products/{product_id} so "search" is not parsed as an id
+@app.get("/products/search", response_model=list[schemas.Product])
+async def search_products(
+    query: str = "", # Optional query parameter
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Ranked search over sweet names and descriptions, served from the in-process
+    index. Supports prefix and single-typo matches. Pass the X-Next-Cursor header
+    of a response back as `cursor` to get the next page.
+    """
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not query.strip():
+        # No search terms: page through the whole catalogue in id order
+        products = (await db.execute(
+            select(*PRODUCT_COLUMNS)
+            .order_by(models.Product.id)
+            .offset(offset)
+            .limit(limit + 1)
+        )).mappings().all()
+        has_more = len(products) > limit
+        products = [dict(row) for row in products[:limit]]
+    else:
+        await db.run_sync(search.product_index.ensure_loaded)
+        ranked_ids = search.product_index.search(query)
+        page_ids = ranked_ids[offset:offset + limit]
+        has_more = len(ranked_ids) > offset + limit
+
+        # One query for the page, then restore the ranking order
+        rows = (await db.execute(
+            select(*PRODUCT_COLUMNS).where(models.Product.id.in_(page_ids))
+        )).mappings().all()
+        by_id = {row["id"]: dict(row) for row in rows}
+        products = [by_id[pid] for pid in page_ids if pid in by_id]
+
+    headers = {"X-Next-Cursor": str(offset + limit)} if has_more else None
+    return Response(content=encode_products(products), media_type="application/json", headers=headers)
+
 # --- Product Read Endpoints ---
 
+def cached_json_response(request: Request, entry: response_cache.CachedResponse) -> Response:
+    """Sends a cached body, or a bodyless 304 if the client already has it.
+
+    Large bodies are compressed when the client accepts it; the ETag stays
+    that of the uncompressed body, so revalidation works either way.
+    """
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    compressor = fastjson.compressor
+    if compressor.codings:
+        headers["Vary"] = "Accept-Encoding"
+    if response_cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = entry.body
+    coding = compressor.choose(body, request.headers.get("accept-encoding"))
+    if coding:
+        body = compressor.compress(body, coding, entry.etag)
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/products", response_model=list[schemas.Product])
-def read_products(db: Session = Depends(get_db)):
-    """Retrieve a list of all products (public endpoint)."""
-    products = db.query(models.Product).all()
-    return products
+async def read_products(
+    request: Request,
+    limit: int = Query(catalogue.DEFAULT_PAGE_SIZE, ge=1, le=catalogue.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    sort: str = "id",
+    min_price: float | None = Query(None, ge=0),
+    max_price: float | None = Query(None, ge=0),
+    in_stock: bool | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Retrieve one page of products (public endpoint).
+
+    Pages are keyset-paginated: pass the X-Next-Cursor header of a response back
+    as `cursor`. `sort` is id, name or price (prefix with "-" for descending).
+    `fields` is an optional comma-separated list of columns to return.
+    Responses are cached until the catalogue changes and carry an ETag.
+    """
+    cache = response_cache.catalogue_cache
+    # Read the version before querying, so a write that lands mid-request
+    # can only orphan this entry, never leave stale data under the new version
+    cache_key = cache.key(cache.version(), "products?" + urlencode(sorted(request.query_params.multi_items())))
+    entry = cache.get(cache_key)
+    if entry is None:
+        try:
+            field_names = catalogue.parse_fields(fields)
+            products, next_cursor = await db.run_sync(
+                catalogue.fetch_product_page,
+                fields=field_names,
+                limit=limit,
+                cursor=cursor,
+                sort=sort,
+                min_price=min_price,
+                max_price=max_price,
+                in_stock=in_stock,
+            )
+        except catalogue.CatalogueQueryError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+        if fields:
+            # Partial rows don't fit schemas.Product, so they are sent as-is
+            body = fastjson.dumps(products)
+        else:
+            body = encode_products(products)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        entry = cache.set(cache_key, body, headers)
+
+    return cached_json_response(request, entry)
 
 @app.get("/products/{product_id}", response_model=schemas.Product)
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    """Retrieve a single product by ID (public endpoint)."""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
+async def read_product(request: Request, product_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Retrieve a single product by ID (public endpoint, cached with an ETag)."""
+    cache = response_cache.catalogue_cache
+    cache_key = cache.key(cache.version(), f"product:{product_id}")
+    entry = cache.get(cache_key)
+    if entry is None:
+        row = (await db.execute(
+            select(*PRODUCT_COLUMNS).where(models.Product.id == product_id)
+        )).mappings().first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        entry = cache.set(cache_key, encode_product(dict(row)))
+    return cached_json_response(request, entry)
 
 # --- Product Update Endpoint ---
-@app.put("/products/{product_id}", response_model=schemas.Product)
-def update_product(
+@app.put(
+    "/products/{product_id}",
+    response_model=schemas.Product,
+    dependencies=[Depends(flashsale.product_edit_guard)],
+)
+async def update_product(
     product_id: int, 
     product: schemas.ProductCreate,
-    db: Session = Depends(get_db),
-    current_seller: models.User = Depends(seller_dependency) 
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency) 
 ):
-    # 1. Find the product
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    # 1. Find the product; another seller's product is not found either
+    db_product = (await db.execute(
+        select(models.Product).where(sellers.owned(product_id, current_seller.id))
+    )).scalar_one_or_none()
     
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     # --- UNIQUE NAME CHECK ---
     if db_product.name != product.name:
-        # Check if the NEW name is already used by any OTHER product
-        existing_product = db.query(models.Product).filter(
-            models.Product.name == product.name
-        ).first()
+        # Check if the NEW name is already used by another of the seller's products
+        existing_product = (await db.execute(
+            select(models.Product.id).where(
+                models.Product.seller_id == current_seller.id, models.Product.name == product.name
+            )
+        )).first()
 
         if existing_product:
             raise HTTPException(status_code=400, detail="Product name already exists")
     # -------------------------
         
-    # 2. Update all fields
+    # 2. Update all fields, recording any change in stock in the ledger
+    if product.quantity != db_product.quantity:
+        await db.execute(ledger.INSERT_EVENTS, [
+            ledger.entry(product_id, product.quantity - db_product.quantity, "adjust", user_id=current_seller.id)
+        ])
     db_product.name = product.name
     db_product.description = product.description
     db_product.price = product.price
     db_product.quantity = product.quantity
+    db_product.low_stock_threshold = product.low_stock_threshold
     
     # 3. Commit the changes
     # The IntegrityError should now be prevented by the check above
-    db.commit()
-    db.refresh(db_product)
+    await db.commit()
+    search.product_index.upsert(db_product.id, db_product.name, db_product.description)
+    response_cache.catalogue_cache.bump_version()
+    events.product_changed(schemas.Product.model_validate(db_product).model_dump(mode="json"))
     
     return db_product
 
 # --- Product Delete Endpoint ---
-@app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(
+@app.delete(
+    "/products/{product_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(flashsale.product_edit_guard)],
+)
+async def delete_product(
     product_id: int, 
-    db: Session = Depends(get_db),
-    current_seller: models.User = Depends(seller_dependency) 
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency) 
 ):
-    # 1. Find the product
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    # 1. Find the product; another seller's product is not found either
+    db_product = (await db.execute(
+        select(models.Product).where(sellers.owned(product_id, current_seller.id))
+    )).scalar_one_or_none()
     
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
         
-    # 2. Delete the product
-    db.delete(db_product)
-    db.commit()
+    # 2. Delete the product and its holds; the ledger closes its stock out to zero
+    if db_product.quantity:
+        await db.execute(ledger.INSERT_EVENTS, [
+            ledger.entry(product_id, -db_product.quantity, "delete", user_id=current_seller.id)
+        ])
+    hold_ids = await db.run_sync(reservations.delete_product_holds, product_id)
+    await db.delete(db_product)
+    await db.commit()
+    for hold_id in hold_ids:
+        reservations.holds.forget(hold_id)
+    search.product_index.remove(product_id)
+    response_cache.catalogue_cache.bump_version()
+    events.product_deleted(product_id)
     
     # HTTP 204 No Content is returned automatically
-@app.post("/products/{product_id}/purchase", response_model=schemas.Product)
-def purchase_sweet(
+@app.post(
+    "/products/{product_id}/purchase",
+    response_model=schemas.Product,
+    dependencies=[Depends(ratelimit.purchase_guard)],
+)
+async def purchase_sweet(
     product_id: int,
     purchase: schemas.PurchaseSweet, # Expects {'quantity': int}
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     # Any logged-in user (customer or seller) can purchase
-    current_user: models.User = Depends(auth.get_current_user) 
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    idempotency_key: str | None = Header(None)
 ):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    async def work():
+        hot = flashsale.hot_stock
+        await hot.settle([product_id])
+        if hot.is_hot(product_id):
+            # Flash sale: sold from the in-memory counter, committed by the flusher
+            product = hot.purchase(product_id, purchase.quantity, current_user.id)
+            if product is None:
+                available = hot.products[product_id]["quantity"]
+                raise HTTPException(status_code=400, detail=f"Insufficient stock. Only {available} available.")
+            events.stock_changed(product_id, product["quantity"])
+            return product
 
-    if db_product is None:
-        raise HTTPException(status_code=404, detail="Sweet not found")
+        with hot.db_write([product_id]):
+            # Check and deduct stock in one conditional UPDATE, so concurrent purchases
+            # can never both pass the check and oversell (no lost update, no lock).
+            # Units held by cart reservations are not for sale.
+            row = (await db.execute(
+                update(models.Product)
+                .where(
+                    models.Product.id == product_id,
+                    reservations.AVAILABLE >= purchase.quantity,
+                )
+                .values(quantity=models.Product.quantity - purchase.quantity)
+                .returning(*PRODUCT_COLUMNS, models.Product.reserved, models.Product.low_stock_threshold)
+            )).mappings().first()
 
-    if db_product.quantity < purchase.quantity:
-        raise HTTPException(status_code=400, detail=f"Insufficient stock. Only {db_product.quantity} available.")
+            if row is None:
+                await db.rollback()
+                # Nothing was updated: find out whether the sweet is missing or short
+                available = await db.scalar(
+                    select(reservations.AVAILABLE).where(models.Product.id == product_id)
+                )
+                if available is None:
+                    raise HTTPException(status_code=404, detail="Sweet not found")
+                raise HTTPException(status_code=400, detail=f"Insufficient stock. Only {available} available.")
 
-    # Deduct stock
-    db_product.quantity -= purchase.quantity
-    
-    db.commit()
-    db.refresh(db_product)
-    
-    return db_product
+            sales = [
+                ledger.entry(product_id, -purchase.quantity, "purchase", user_id=current_user.id, unit_price=row["price"])
+            ]
+            await db.execute(ledger.INSERT_EVENTS, sales)
+            sold = {product_id: purchase.quantity}
+            await db.run_sync(orders.record, current_user.id, [row], sold)
+            # Receipts and alerts run after the response, but are committed with the sale
+            await db.execute(jobs.INSERT_JOBS, [
+                jobs.receipt(current_user.id, [row], sold), *jobs.low_stock_alerts([row], sold)
+            ])
+            await db.commit()
+            jobs.runner.wake()
+            analytics.sales.record_entries(sales)
+            response_cache.catalogue_cache.bump_version()
+            events.stock_changed(row["id"], row["quantity"])
+            return dict(row)
+
+    # A retry with the same Idempotency-Key replays the first outcome
+    return await idempotency.stock_requests.run(
+        idempotency_key,
+        f"user:{current_user.id}",
+        idempotency.fingerprint("purchase", product_id, purchase.model_dump()),
+        response,
+        work,
+    )
 
-@app.post("/products/{product_id}/restock", response_model=schemas.Product)
-def restock_sweet(
+@app.post(
+    "/products/{product_id}/restock",
+    response_model=schemas.Product,
+    dependencies=[Depends(flashsale.stock_write_guard)],
+)
+async def restock_sweet(
     product_id: int,
     restock: schemas.RestockSweet, # Expects {'quantity': int}
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     # Only the 'seller' (admin) role can restock
-    current_seller: models.User = Depends(seller_dependency) 
+    current_seller: auth.Principal = Depends(seller_dependency),
+    idempotency_key: str | None = Header(None)
 ):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    async def work():
+        # Add stock in SQL so concurrent restocks don't overwrite each other;
+        # only the product's seller matches
+        row = (await db.execute(
+            update(models.Product)
+            .where(sellers.owned(product_id, current_seller.id))
+            .values(quantity=models.Product.quantity + restock.quantity)
+            .returning(*PRODUCT_COLUMNS)
+        )).mappings().first()
 
-    if db_product is None:
+        if row is None:
+            raise HTTPException(status_code=404, detail="Sweet not found")
+
+        await db.execute(ledger.INSERT_EVENTS, [
+            ledger.entry(product_id, restock.quantity, "restock", user_id=current_seller.id)
+        ])
+        await db.commit()
+        row = dict(row)
+        hot = flashsale.hot_stock
+        if hot.is_hot(product_id):
+            # The row still counts unflushed flash-sale purchases; the counter doesn't
+            hot.add(product_id, restock.quantity)
+            row["quantity"] = hot.products[product_id]["quantity"]
+        response_cache.catalogue_cache.bump_version()
+        events.stock_changed(row["id"], row["quantity"])
+        return row
+
+    return await idempotency.stock_requests.run(
+        idempotency_key,
+        f"user:{current_seller.id}",
+        idempotency.fingerprint("restock", product_id, restock.model_dump()),
+        response,
+        work,
+    )
+
+# --- Batch Checkout Endpoint ---
+@app.post("/checkout", response_model=list[schemas.Product], dependencies=[Depends(ratelimit.purchase_guard)])
+async def checkout(
+    cart: schemas.Checkout, # Expects {'items': [{'product_id': int, 'quantity': int}, ...]}
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    idempotency_key: str | None = Header(None)
+):
+    """
+    Purchase every item in the cart in one transaction (all-or-nothing).
+    Returns the updated products in the order they first appear in the cart.
+    """
+    async def work():
+        # 1. Merge repeated lines for the same product
+        wanted: dict[int, int] = {}
+        for item in cart.items:
+            wanted[item.product_id] = wanted.get(item.product_id, 0) + item.quantity
+        product_ids = list(wanted)
+
+        # Flash-sale products are checked against their counters, and reserved
+        # there before anything awaits. Their rows are decremented below like
+        # the rest, which keeps counter = available stock - pending sales.
+        hot = flashsale.hot_stock
+        await hot.settle(product_ids)
+        hot_wanted = {pid: n for pid, n in wanted.items() if hot.is_hot(pid)}
+        short = hot.take(hot_wanted)
+        if short:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for sweets: {short}")
+        committed = False
+        try:
+            with hot.db_write(product_ids):
+                products, sales = await apply(wanted, product_ids, hot_wanted)
+                committed = True
+        finally:
+            if not committed:
+                hot.give_back(hot_wanted)
+
+        jobs.runner.wake()
+        analytics.sales.record_entries(sales)
+        response_cache.catalogue_cache.bump_version()
+        for product in products:
+            events.stock_changed(product["id"], product["quantity"])
+
+        by_id = {product["id"]: product for product in products}
+        return [by_id[pid] for pid in product_ids]
+
+    async def apply(wanted: dict[int, int], product_ids: list[int], hot_wanted: dict[int, int]):
+        # 2. Validate all stock with a single query
+        stock = dict((await db.execute(
+            select(models.Product.id, reservations.AVAILABLE)
+            .where(models.Product.id.in_(product_ids))
+        )).all())
+        missing = [pid for pid in product_ids if pid not in stock]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Sweets not found: {missing}")
+        short = [pid for pid in product_ids if pid not in hot_wanted and stock[pid] < wanted[pid]]
+        if short:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for sweets: {short}")
+
+        # 3. Apply every decrement as one executemany of the conditional UPDATE.
+        # If another checkout took the stock since step 2, fewer rows match and
+        # the whole cart is rolled back.
+        products_table = models.Product.__table__
+        result = await db.execute(
+            update(products_table)
+            .where(
+                products_table.c.id == bindparam("pid"),
+                products_table.c.quantity - products_table.c.reserved >= bindparam("n"),
+            )
+            .values(quantity=products_table.c.quantity - bindparam("n")),
+            [{"pid": pid, "n": n} for pid, n in wanted.items()],
+        )
+        if result.rowcount != len(wanted):
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Stock changed during checkout, please retry")
+
+        # 4. Read back the updated rows, record the sales, then commit once for the whole cart
+        rows = (await db.execute(
+            select(*PRODUCT_COLUMNS, models.Product.reserved, models.Product.low_stock_threshold)
+            .where(models.Product.id.in_(product_ids))
+        )).mappings().all()
+        products = [dict(row) for row in rows]
+        for product in products:
+            counter = flashsale.hot_stock.products.get(product["id"])
+            if product["id"] in hot_wanted and counter is not None:
+                # The row still counts the sale's unflushed purchases; the
+                # counter doesn't, and already leaves out the reserved units
+                product["quantity"] = counter["quantity"]
+                product["reserved"] = 0
+        sales = [
+            ledger.entry(row["id"], -wanted[row["id"]], "purchase", user_id=current_user.id, unit_price=row["price"])
+            for row in rows
+        ]
+        await db.execute(ledger.INSERT_EVENTS, sales)
+        await db.run_sync(orders.record, current_user.id, products, wanted)
+        await db.execute(jobs.INSERT_JOBS, [
+            jobs.receipt(current_user.id, products, wanted), *jobs.low_stock_alerts(products, wanted)
+        ])
+        await db.commit()
+        return products, sales
+
+    return await idempotency.stock_requests.run(
+        idempotency_key,
+        f"user:{current_user.id}",
+        idempotency.fingerprint("checkout", cart.model_dump()),
+        response,
+        work,
+    )
+
+# --- Cart Reservation Endpoints ---
+
+@app.get("/products/{product_id}/availability", response_model=schemas.Availability)
+async def read_availability(product_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Stock of a sweet not held by reservations (public endpoint)."""
+    row = (await db.execute(
+        select(models.Product.quantity, models.Product.reserved).where(models.Product.id == product_id)
+    )).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Sweet not found")
+    return {"product_id": product_id, "quantity": row.quantity, "reserved": row.reserved, "available": row.quantity - row.reserved}
 
-    # Add stock
-    db_product.quantity += restock.quantity
-    
-    db.commit()
-    db.refresh(db_product)
-    
-    return db_product
+@app.post(
+    "/products/{product_id}/reserve",
+    response_model=schemas.Reservation,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(ratelimit.purchase_guard)],
+)
+async def reserve_sweet(
+    product_id: int,
+    hold: schemas.ReserveSweet, # Expects {'quantity': int, 'ttl_seconds': int (optional)}
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    idempotency_key: str | None = Header(None)
+):
+    """
+    Hold stock for the current user until the reservation is confirmed,
+    released or expires (after ttl_seconds, default RESERVATION_TTL_SECONDS).
+    """
+    async def work():
+        hot = flashsale.hot_stock
+        await hot.settle([product_id])
+        if hot.is_hot(product_id):
+            raise HTTPException(status_code=409, detail="Sweet is in a flash sale; buy it directly")
 
-# --- NEW: Product Search Endpoint ---
-@app.get("/products/search", response_model=list[schemas.Product])
-def search_products(
-    query: str = "", # Optional query parameter
-    db: Session = Depends(get_db)
+        with hot.db_write([product_id]):
+            held = (await db.execute(reservations.reserve_statement(product_id, hold.quantity))).first()
+            if held is None:
+                await db.rollback()
+                available = await db.scalar(
+                    select(reservations.AVAILABLE).where(models.Product.id == product_id)
+                )
+                if available is None:
+                    raise HTTPException(status_code=404, detail="Sweet not found")
+                raise HTTPException(status_code=400, detail=f"Insufficient stock. Only {available} available.")
+
+            expires_at = reservations.hold_expiry(hold.ttl_seconds)
+            hold_id = (await db.execute(
+                insert(reservations.holds_table)
+                .values(product_id=product_id, user_id=current_user.id, quantity=hold.quantity, expires_at=expires_at)
+                .returning(reservations.holds_table.c.id)
+            )).scalar_one()
+            await db.commit()
+
+        reservations.holds.track(hold_id, product_id, expires_at)
+        reservations.holds.created += 1
+        return {"id": hold_id, "product_id": product_id, "quantity": hold.quantity, "expires_at": expires_at}
+
+    return await idempotency.stock_requests.run(
+        idempotency_key,
+        f"user:{current_user.id}",
+        idempotency.fingerprint("reserve", product_id, hold.model_dump()),
+        response,
+        work,
+    )
+
+@app.post("/reservations/{reservation_id}/confirm", response_model=schemas.Product)
+async def confirm_reservation(
+    reservation_id: int,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    idempotency_key: str | None = Header(None)
+):
+    """Buy the units held by one of the current user's reservations."""
+    async def work():
+        holds_table = reservations.holds_table
+        hold = (await db.execute(
+            select(holds_table.c.product_id, holds_table.c.quantity)
+            .where(holds_table.c.id == reservation_id, holds_table.c.user_id == current_user.id)
+        )).first()
+        await db.rollback() # Don't hold a read transaction open across the wait below
+        if hold is None:
+            raise HTTPException(status_code=404, detail="Reservation not found")
+
+        hot = flashsale.hot_stock
+        await hot.settle([hold.product_id])
+        with hot.db_write([hold.product_id]):
+            # Deleting the hold first means a concurrent confirm, release or expiry finds nothing
+            taken = (await db.execute(
+                delete(holds_table)
+                .where(holds_table.c.id == reservation_id, holds_table.c.expires_at > ledger.utcnow())
+                .returning(holds_table.c.id)
+            )).first()
+            if taken is None:
+                await db.rollback()
+                raise HTTPException(status_code=410, detail="Reservation has expired")
+
+            # The held units leave the stock and the reservation together, so
+            # the available stock (and any flash-sale counter) doesn't move
+            row = (await db.execute(
+                update(models.Product)
+                .where(
+                    models.Product.id == hold.product_id,
+                    models.Product.quantity >= hold.quantity,
+                    models.Product.reserved >= hold.quantity,
+                )
+                .values(
+                    quantity=models.Product.quantity - hold.quantity,
+                    reserved=models.Product.reserved - hold.quantity,
+                )
+                .returning(*PRODUCT_COLUMNS, models.Product.reserved, models.Product.low_stock_threshold)
+            )).mappings().first()
+            if row is None:
+                await db.rollback()
+                exists = await db.scalar(select(models.Product.id).where(models.Product.id == hold.product_id))
+                if exists is None:
+                    raise HTTPException(status_code=404, detail="Sweet not found")
+                # A seller set the stock below what was held; the hold is kept
+                raise HTTPException(status_code=409, detail="Not enough stock left for this reservation")
+
+            sales = [
+                ledger.entry(hold.product_id, -hold.quantity, "purchase", user_id=current_user.id, unit_price=row["price"])
+            ]
+            await db.execute(ledger.INSERT_EVENTS, sales)
+            sold = {hold.product_id: hold.quantity}
+            await db.run_sync(orders.record, current_user.id, [row], sold)
+            await db.execute(jobs.INSERT_JOBS, [
+                jobs.receipt(current_user.id, [row], sold), *jobs.low_stock_alerts([row], sold)
+            ])
+            await db.commit()
+
+        jobs.runner.wake()
+        reservations.holds.forget(reservation_id)
+        reservations.holds.confirmed += 1
+        analytics.sales.record_entries(sales)
+        response_cache.catalogue_cache.bump_version()
+        events.stock_changed(row["id"], row["quantity"])
+        return dict(row)
+
+    return await idempotency.stock_requests.run(
+        idempotency_key,
+        f"user:{current_user.id}",
+        idempotency.fingerprint("confirm", reservation_id),
+        response,
+        work,
+    )
+
+@app.delete("/reservations/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def release_reservation(
+    reservation_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    """Hand back the units held by one of the current user's reservations."""
+    released = await reservations.holds.release([reservation_id], user_id=current_user.id, db=db)
+    if not released:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    reservations.holds.released += 1
+
+# --- Order History Endpoints ---
+
+@app.get("/orders", response_model=list[schemas.Order])
+async def read_orders(
+    response: Response,
+    limit: int = Query(orders.DEFAULT_PAGE_SIZE, ge=1, le=orders.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     """
-    Search for sweets by name or description (case-insensitive partial match).
+    The current user's orders, newest first. Pages are keyset-paginated: pass
+    the X-Next-Cursor header of a response back as `cursor`.
     """
-    search_pattern = f"%{query}%"
-    
-    # Use OR to search in both name and description
-    products = db.query(models.Product).filter(
-        or_(
-            models.Product.name.ilike(search_pattern),
-            models.Product.description.ilike(search_pattern)
+    try:
+        page, next_cursor = await db.run_sync(
+            orders.fetch_order_page, current_user.id, limit=limit, cursor=cursor
         )
-    ).all()
-    
+    except catalogue.CatalogueQueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return page
+
+@app.get("/orders/{order_id}", response_model=schemas.Order)
+async def read_order(
+    order_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    """One of the current user's orders."""
+    order = await db.run_sync(orders.fetch_order, current_user.id, order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+# --- Inventory Ledger Endpoints ---
+
+async def require_owned(db: AsyncSession, product_id: int, seller_id: int):
+    """404s unless the seller owns the sweet, so other sellers' sweets look missing."""
+    owned = (await db.execute(select(models.Product.id).where(sellers.owned(product_id, seller_id)))).first()
+    if owned is None:
+        raise HTTPException(status_code=404, detail="Sweet not found")
+
+@app.get("/products/{product_id}/stock", response_model=schemas.StockLevel)
+async def read_stock_at(
+    product_id: int,
+    at: datetime | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Stock of one of the seller's sweets at a past moment (default: now), rebuilt from the ledger."""
+    await require_owned(db, product_id, current_seller.id)
+    at = ledger.utcnow() if at is None else ledger.as_utc(at)
+    quantity = await db.run_sync(ledger.stock_at, product_id, at)
+    if quantity is None:
+        raise HTTPException(status_code=404, detail="No stock history for this sweet")
+    return {"product_id": product_id, "at": at, "quantity": quantity}
+
+@app.get("/reports/sales", response_model=list[schemas.SalesReportLine])
+async def read_sales_report(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Units sold and revenue per sweet of the seller's in [start, end); defaults to the last 24 hours."""
+    default_start, end = ledger.default_report_window(end)
+    start = default_start if start is None else start
+    return await db.run_sync(ledger.sales_report, start, end, current_seller.id)
+
+@app.post("/admin/ledger/compact")
+async def compact_ledger(current_seller: auth.Principal = Depends(seller_dependency)):
+    """Run a ledger compaction now instead of waiting for the next scheduled one."""
+    snapshots = await run_in_threadpool(run_with_session, ledger.compact)
+    return {"snapshots": snapshots}
+
+# --- Sales Analytics Endpoints ---
+# Served from the in-memory aggregates, so they cost the same however much
+# has been sold and never touch the database that checkout writes to. Each
+# seller's series has a ring of its own; ownership checks are a primary-key
+# read and bestsellers read the seller's own index range
+
+@app.get("/analytics/products/{product_id}", response_model=schemas.SalesTotals)
+async def read_product_sales(
+    product_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Lifetime units sold, revenue and number of sales of one of the seller's sweets."""
+    await require_owned(db, product_id, current_seller.id)
+    return analytics.sales.totals(product_id)
+
+@app.get("/analytics/sales", response_model=list[schemas.SalesBucket])
+async def read_sales_series(
+    bucket: Literal["hour", "day"] = "hour",
+    periods: int = Query(24, ge=1),
+    product_id: int | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """
+    Units sold and revenue per hour or day, oldest first, ending with the
+    current bucket. Covers the seller's sweets, or one of them if product_id is given.
+    """
+    limit = analytics.sales.hourly_buckets if bucket == "hour" else analytics.sales.daily_buckets
+    if periods > limit:
+        raise HTTPException(status_code=400, detail=f"At most {limit} {bucket} buckets are kept")
+    if product_id is not None:
+        await require_owned(db, product_id, current_seller.id)
+        return analytics.sales.series(bucket, periods, product_id)
+    return analytics.sales.series(bucket, periods, seller_id=current_seller.id)
+
+@app.get("/analytics/bestsellers", response_model=list[schemas.SalesReportLine])
+async def read_bestsellers(
+    limit: int = Query(10, ge=1, le=100),
+    by: Literal["units_sold", "revenue"] = "units_sold",
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """The seller's top `limit` sweets of all time by units sold or revenue."""
+    # One pass over the seller's index range gives both the candidates and their names
+    names = await db.run_sync(sellers.product_names, current_seller.id)
+    best = analytics.sales.top(limit, by, product_ids=names)
+    return [dict(line, name=names[line["product_id"]]) for line in best]
+
+# --- Flash Sale Endpoints ---
+
+@app.put("/admin/flash-sale/{product_id}", response_model=schemas.Product)
+async def start_flash_sale(
+    product_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """
+    Serve a sweet's purchases from memory and write them behind in batches
+    (needs FLASH_SALE_ENABLED=1). Edits and deletes are refused until the sale ends.
+    """
+    if not flashsale.FLASH_SALE_ENABLED:
+        raise HTTPException(status_code=404, detail="Flash sales are not enabled")
+
+    async def load():
+        row = (await db.execute(
+            select(*PRODUCT_COLUMNS, models.Product.reserved, models.Product.low_stock_threshold)
+            .where(sellers.owned(product_id, current_seller.id))
+        )).mappings().first()
+        if row is None:
+            return None
+        # The counter only sells what reservations don't hold
+        product = dict(row)
+        product["quantity"] -= product.pop("reserved")
+        return product
+
+    product = await flashsale.hot_stock.start(product_id, load)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Sweet not found")
+    return dict(product)
+
+@app.delete("/admin/flash-sale/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def end_flash_sale(
+    product_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Commit the sweet's pending sales and hand its stock back to the database."""
+    await require_owned(db, product_id, current_seller.id)
+    await flashsale.hot_stock.stop(product_id)
+
+# --- Seller Endpoints ---
+# Served through the (seller_id, ...) indexes: they cost what the seller's own
+# catalogue costs, not what the whole marketplace does
+
+@app.get("/sellers/me/products", response_model=list[schemas.Product])
+async def read_my_products(
+    response: Response,
+    limit: int = Query(catalogue.DEFAULT_PAGE_SIZE, ge=1, le=catalogue.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    sort: str = "id",
+    min_price: float | None = Query(None, ge=0),
+    max_price: float | None = Query(None, ge=0),
+    in_stock: bool | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """One keyset page of the seller's own products; paging and sorting as for GET /products."""
+    try:
+        products, next_cursor = await db.run_sync(
+            catalogue.fetch_product_page,
+            fields=list(catalogue.PRODUCT_FIELDS),
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock=in_stock,
+            seller_id=current_seller.id,
+        )
+    except catalogue.CatalogueQueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return products
 
+@app.get("/sellers/me/dashboard", response_model=schemas.SellerDashboard)
+async def read_my_dashboard(
+    db: AsyncSession = Depends(get_read_db),
+    current_seller: auth.Principal = Depends(seller_dependency)
+):
+    """Stock levels and lifetime sales across the seller's catalogue."""
+    return await db.run_sync(sellers.fetch_dashboard, current_seller.id)
+
+# --- Monitoring Endpoints ---
+
+@app.get("/admin/cache-stats")
+async def read_cache_stats(current_seller: auth.Principal = Depends(seller_dependency)):
+    """Hit/miss counters for the in-process caches."""
+    return {
+        "principal_cache": auth.principal_cache.stats(),
+        "response_cache": response_cache.catalogue_cache.stats(),
+        "event_hub": events.stock_events.stats(),
+        "sales_analytics": analytics.sales.stats(),
+        "rate_limiter": ratelimit.limiter.stats(),
+        "login_admission": ratelimit.login_admission.stats(),
+        "purchase_admission": ratelimit.purchase_admission.stats(),
+        "idempotency": idempotency.stock_requests.stats(),
+        "compressed_response": fastjson.compressor.stats(),
+        "flash_sale": flashsale.hot_stock.stats(),
+        "reservations": reservations.holds.stats(),
+        "jobs": jobs.runner.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Request, database, auth and cache metrics in Prometheus text format (for scrapers)."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # --- Root Endpoint ---
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the Sweet Shop API!"}
\ No newline at end of file
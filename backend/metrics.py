@@ -0,0 +1,358 @@
+"""Request-level performance metrics, exposed in Prometheus text format.
+
+MetricsMiddleware times every request by route template and keeps a
+per-request tally of database queries and time, fed by cursor events on the
+engines (see instrument_engine). Auth records KDF and JWT timings, and caches
+register their hit/miss counters, so GET /metrics shows where a request's
+time goes without an external agent.
+
+The metric types are a deliberately small, dependency-free subset of what
+prometheus_client offers: counters, histograms and gauges read at scrape
+time. Values are per process; with several workers, scrape each one.
+
+Per-request profiling is opt-in: when PROFILING_TOKEN is set, a request that
+sends the same value in an X-Profile header runs under cProfile and the stats
+are written to PROFILE_DIR (the file name comes back in X-Profile-File). One
+request is profiled at a time. The profiler sees everything on the event loop
+thread while it runs, so concurrent requests can show up in the trace, and
+work handed to the threadpool or the hashing processes does not.
+"""
+import cProfile
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "") # Empty disables profiling
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "sweet_shop_profiles"))
+
+# Latency buckets in seconds, from cache hits up to slow logins
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [count per bucket (not cumulative)..., sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, list(row)) for key, row in self._values.items()]
+        for key, row in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(row[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {row[-1]}"
+
+
+class CallbackGauge:
+    """Gauge whose values are read from a callback at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...], callback: Callable[[], dict]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.callback().items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "sweetshop_http_request_duration_seconds", "Request latency by route.", ("method", "route", "status")
+))
+REQUEST_DB_QUERIES = registry.register(Histogram(
+    "sweetshop_http_request_db_queries", "Database queries per request.", ("route",), QUERY_COUNT_BUCKETS
+))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "sweetshop_http_request_db_seconds", "Database time per request.", ("route",)
+))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "sweetshop_db_query_duration_seconds", "Latency of single statements.", ("engine",)
+))
+POOL_WAIT_SECONDS = registry.register(Histogram(
+    "sweetshop_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ("engine",)
+))
+KDF_SECONDS = registry.register(Histogram(
+    "sweetshop_password_kdf_seconds", "Password hashing and verification, including queueing.", ("operation",)
+))
+JWT_DECODE_SECONDS = registry.register(Histogram(
+    "sweetshop_jwt_decode_seconds", "Time to decode and verify an access token."
+))
+PROFILED_REQUESTS = registry.register(Counter(
+    "sweetshop_profiled_requests_total", "Requests captured by the opt-in profiler.", ("route",)
+))
+
+
+# --- Caches and pools (read at scrape time) ---
+
+_caches: dict[str, Callable[[], dict]] = {}
+_pools: dict[str, object] = {}
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Reports a cache whose stats() returns hits and misses."""
+    _caches[name] = stats
+
+
+def _cache_field(field: str) -> Callable[[], dict]:
+    return lambda: {(name,): stats()[field] for name, stats in list(_caches.items())}
+
+
+def _pool_checked_out() -> dict:
+    result = {}
+    for name, sync_engine in list(_pools.items()):
+        # Read the pool at scrape time, since engine.dispose() replaces it
+        checkedout = getattr(sync_engine.pool, "checkedout", None)
+        if checkedout is not None:
+            result[(name,)] = checkedout()
+    return result
+
+
+registry.register(CallbackGauge(
+    "sweetshop_cache_hits", "Cache hits since start.", ("cache",), _cache_field("hits")
+))
+registry.register(CallbackGauge(
+    "sweetshop_cache_misses", "Cache misses since start.", ("cache",), _cache_field("misses")
+))
+registry.register(CallbackGauge(
+    "sweetshop_cache_hit_ratio", "Cache hits over lookups since start.", ("cache",), _cache_field("hit_ratio")
+))
+registry.register(CallbackGauge(
+    "sweetshop_db_pool_checked_out", "Connections currently checked out.", ("engine",), _pool_checked_out
+))
+
+
+# --- Per-request database tally ---
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Holds a mutable object, so queries run in threadpool or greenlet copies of
+# the request's context still add to the same tally
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name: str):
+    """Times the statements and pool checkouts of a sync or async engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        DB_QUERY_SECONDS.observe(elapsed, engine=name)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    _pools[name] = sync_engine
+    _time_checkouts(sync_engine.pool, name)
+
+
+def _time_checkouts(pool, name: str):
+    # The pool has no "before checkout" event, so time its internal getter
+    do_get = getattr(pool, "_do_get", None)
+    if do_get is None or getattr(pool, "_metrics_timed", False):
+        return
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start, engine=name)
+
+    pool._do_get = timed_do_get
+    pool._metrics_timed = True
+
+
+def reinstrument_pools():
+    """Times checkouts of the pools engine.dispose() put in place (after a fork)."""
+    for name, sync_engine in list(_pools.items()):
+        _time_checkouts(sync_engine.pool, name)
+
+
+# --- ASGI middleware ---
+
+_profile_lock = threading.Lock()
+
+
+def _route_label(scope) -> str:
+    # Templates, not raw paths, so product ids don't explode the label set
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses pass through untouched.
+
+    Latency runs until the last body chunk, which for the SSE feed is the
+    lifetime of the connection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiler = None
+        profile_file = None
+        if PROFILING_TOKEN and self._wants_profile(scope) and _profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profile_file = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}.prof"
+
+        status_code = 500
+        stats = RequestStats()
+        token = current_request.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile_file:
+                    headers = [*message.get("headers", []), (b"x-profile-file", profile_file.encode())]
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+                self._save_profile(profiler, profile_file, scope)
+                _profile_lock.release()
+            current_request.reset(token)
+            route = _route_label(scope)
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status_code)
+            REQUEST_DB_QUERIES.observe(stats.queries, route=route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+
+    @staticmethod
+    def _wants_profile(scope) -> bool:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile":
+                return value.decode("latin-1") == PROFILING_TOKEN
+        return False
+
+    @staticmethod
+    def _save_profile(profiler: cProfile.Profile, filename: str, scope):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+        PROFILED_REQUESTS.inc(route=_route_label(scope))
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,49 @@
+"""Schema setup for deployments.
+
+Creates any missing tables, columns and indexes, converts float prices of
+older databases to integer minor units, gives products that predate the
+inventory ledger their opening balance and products that predate seller
+ownership their seller. The launcher in backend.serve runs this once,
+before any worker starts, and workers skip it (AUTO_MIGRATE=0), so N workers
+don't race to create the same tables on import.
+
+    python -m backend.migrate [--default-seller USERNAME]
+"""
+import argparse
+import json
+
+from sqlalchemy import select
+
+from . import database, ledger, models, sellers
+
+
+def migrate(default_seller: str | None = None) -> dict:
+    """`default_seller` (a username) gets the products the ledger can't attribute."""
+    upgraded = database.create_db_and_tables()
+    with database.SessionLocal() as db:
+        opened = ledger.record_opening_balances(db)
+        default_seller_id = None
+        if default_seller is not None:
+            default_seller_id = db.scalar(select(models.User.id).where(models.User.username == default_seller))
+            if default_seller_id is None:
+                raise SystemExit(f"No such user: {default_seller}")
+        owners = sellers.assign_owners(db, default_seller_id)
+    # Leave no pooled connection behind for a forked worker to inherit
+    database.engine.dispose()
+    return {
+        "tables_upgraded": upgraded,
+        "opening_balances": opened,
+        "products_attributed": owners["attributed"],
+        "products_unowned": owners["unowned"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m backend.migrate", description=__doc__.splitlines()[0])
+    parser.add_argument("--default-seller", help="Username to own products the ledger can't attribute")
+    args = parser.parse_args()
+    print(json.dumps(migrate(args.default_seller)))
+
+
+if __name__ == "__main__":
+    main()
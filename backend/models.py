@@ -1,9 +1,17 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, Text
 from sqlalchemy.orm import declarative_base
 
+from .money import Money
+
 # Base class which the models will inherit from
 Base = declarative_base()
 
+def _utcnow() -> datetime:
+    # Naive UTC, like every other timestamp in the database
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -26,11 +34,124 @@ class Product(Base):
     __tablename__ = "products"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True, nullable=False)
+    # Unique per seller (see __table_args__), not across the marketplace
+    name = Column(String, index=True, nullable=False)
     description = Column(String)
-    price = Column(Float, nullable=False) # Store price as a float/decimal
+    # Decimal in Python, whole minor units in the database (see money.py)
+    price = Column("price_minor", Money, key="price", nullable=False)
     quantity = Column(Integer, default=0) # Stock quantity
+    # Units held by unexpired cart reservations; available = quantity - reserved
+    reserved = Column(Integer, nullable=False, default=0, server_default="0")
+    # Sellers are alerted when a sale takes stock from above this to at or below it
+    low_stock_threshold = Column(Integer) # None: no alerts
+
+    # The seller who owns the product; None for products older than ownership
+    # that `python -m backend.migrate` could not attribute
+    seller_id = Column(Integer, ForeignKey("users.id"))
+
+    __table_args__ = (
+        # Serves price filters and keyset pages sorted by price
+        Index("ix_products_price_id", "price", "id"),
+        # A seller's own catalogue, paged by id, name or price
+        Index("ix_products_seller_id_id", "seller_id", "id"),
+        Index("ix_products_seller_id_name", "seller_id", "name", unique=True),
+        Index("ix_products_seller_id_price_id", "seller_id", "price", "id"),
+    )
+
+
+class InventoryEvent(Base):
+    """One stock change. Rows are only ever appended, never updated or deleted."""
+    __tablename__ = "inventory_events"
+
+    id = Column(Integer, primary_key=True)
+    # No foreign key: the history outlives deleted products
+    product_id = Column(Integer, nullable=False)
+    delta = Column(Integer, nullable=False) # Signed change in stock
+    reason = Column(String, nullable=False) # 'purchase', 'restock', 'create', ...
+    unit_price = Column("unit_price_minor", Money, key="unit_price") # Price at the time of a sale
+    user_id = Column(Integer) # Who made the change, if known
+    created_at = Column(DateTime, nullable=False) # UTC
+
+    __table_args__ = (
+        # Replays for one product after a snapshot
+        Index("ix_inventory_events_product_id_id", "product_id", "id"),
+        # Sales reports over a time range
+        Index("ix_inventory_events_reason_created_at", "reason", "created_at"),
+    )
+
+class InventorySnapshot(Base):
+    """Stock of one product after every ledger event up to event_id."""
+    __tablename__ = "inventory_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    event_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False) # UTC
+
+    __table_args__ = (
+        Index("ix_inventory_snapshots_product_id_event_id", "product_id", "event_id", unique=True),
+    )
+
+class WriteBehindCheckpoint(Base):
+    """Sequence number of the last write-behind record applied from a write-ahead file."""
+    __tablename__ = "write_behind_checkpoints"
+
+    stream = Column(String, primary_key=True) # Absolute path of the write-ahead file
+    sequence = Column(Integer, nullable=False)
+
+class StockHold(Base):
+    """Units of a product reserved for a customer until expires_at."""
+    __tablename__ = "stock_holds"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False) # UTC
+
+    # Startup reloads the unexpired holds into the expiry timing wheel
+    __table_args__ = (Index("ix_stock_holds_expires_at", "expires_at"),)
+
+class Job(Base):
+    """A side effect to run after the request that caused it (see jobs.py)."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False) # A key of jobs.HANDLERS
+    payload = Column(Text, nullable=False) # JSON
+    status = Column(String, nullable=False, default="pending") # 'pending', 'running' or 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    # UTC; when a pending job may next run, or when a running job's lease ends
+    run_after = Column(DateTime, nullable=False, default=_utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+
+    # Workers claim the oldest due job
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+class Order(Base):
+    """One purchase or checkout by a customer."""
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    total = Column("total_minor", Money, key="total", nullable=False)
+    created_at = Column(DateTime, nullable=False, default=_utcnow) # UTC
+
+    # A customer's order history, newest first, is one index range scan
+    __table_args__ = (Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),)
+
+class OrderLine(Base):
+    """One product in an order, at the name and price it was bought for."""
+    __tablename__ = "order_lines"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    # No foreign key: the history outlives deleted products
+    product_id = Column(Integer, nullable=False)
+    name = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column("unit_price_minor", Money, key="unit_price", nullable=False)
 
-    # This is optional but good: a foreign key linking to the seller
-    # seller_id = Column(Integer, ForeignKey("users.id")) 
-    # seller = relationship("User", back_populates="products")
\ No newline at end of file
+    __table_args__ = (Index("ix_order_lines_order_id", "order_id"),)
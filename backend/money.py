@@ -0,0 +1,41 @@
+"""Exact money amounts.
+
+Prices are Decimals in Python and whole numbers of minor units (hundredths)
+in the database, so sums and comparisons are exact in every backend instead
+of drifting the way float columns do. JSON still carries plain numbers.
+
+SQL arithmetic on a Money column works on the stored minor units; wrap such
+expressions in type_coerce(..., Money()) to read the result back as a Decimal.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+
+DECIMAL_PLACES = 2
+MINOR_UNITS = 10 ** DECIMAL_PLACES # Minor units per unit of currency
+ZERO = Decimal("0.00")
+
+
+def to_minor_units(amount) -> int:
+    """Rounds an amount (Decimal, int, float or numeric string) to whole minor units."""
+    if isinstance(amount, float):
+        # Go through the shortest repr, so 19.99 is 1999 and not 1998.99999...
+        amount = repr(amount)
+    return int((Decimal(amount) * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(units: int) -> Decimal:
+    return Decimal(int(units)).scaleb(-DECIMAL_PLACES)
+
+
+class Money(TypeDecorator):
+    """A Decimal amount stored as an integer number of minor units."""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_minor_units(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else from_minor_units(value)
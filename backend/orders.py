@@ -0,0 +1,124 @@
+"""Customer orders and their keyset-paginated history.
+
+Every purchase path records an order (and its lines, with the name and price
+paid) in the same transaction as the stock decrement, so an order exists if
+and only if the sale does. History pages seek on (created_at, id) over the
+(user_id, created_at, id) index, so the hundredth page of a customer with
+thousands of orders costs the same as the first.
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.orm import Session
+
+from . import catalogue, ledger, models
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+orders_table = models.Order.__table__
+lines_table = models.OrderLine.__table__
+
+# Money columns are stored as *_minor; label them with their attribute names
+ORDER_COLUMNS = (orders_table.c.id, orders_table.c.total.label("total"), orders_table.c.created_at)
+LINE_COLUMNS = (
+    lines_table.c.order_id,
+    lines_table.c.product_id,
+    lines_table.c.name,
+    lines_table.c.quantity,
+    lines_table.c.unit_price.label("unit_price"),
+)
+
+
+def record_many(db: Session, orders: list[tuple[int, datetime, list[dict]]]) -> list[int]:
+    """Inserts orders given as (user_id, created_at, lines); returns their ids.
+
+    Lines are dicts with product_id, name, quantity and unit_price. Nothing
+    is committed: the caller commits with the stock change.
+    """
+    if not orders:
+        return []
+    ids = db.execute(
+        insert(orders_table).returning(orders_table.c.id, sort_by_parameter_order=True),
+        [
+            {
+                "user_id": user_id,
+                "created_at": created_at,
+                "total": sum(line["unit_price"] * line["quantity"] for line in lines),
+            }
+            for user_id, created_at, lines in orders
+        ],
+    ).scalars().all()
+    db.execute(insert(lines_table), [
+        dict(line, order_id=order_id) for order_id, (_, _, lines) in zip(ids, orders) for line in lines
+    ])
+    return ids
+
+
+def record(db: Session, user_id: int, products: list[dict], quantities: dict[int, int]) -> int:
+    """Inserts one order for `products` (rows with id, name and price); returns its id."""
+    lines = [
+        {"product_id": product["id"], "name": product["name"], "quantity": quantities[product["id"]], "unit_price": product["price"]}
+        for product in products
+    ]
+    return record_many(db, [(user_id, ledger.utcnow(), lines)])[0]
+
+
+def _with_lines(db: Session, orders: list[dict]) -> list[dict]:
+    """Attaches the lines of every order with one query."""
+    by_id = {order["id"]: dict(order, lines=[]) for order in orders}
+    if by_id:
+        lines = db.execute(
+            select(*LINE_COLUMNS).where(lines_table.c.order_id.in_(list(by_id))).order_by(lines_table.c.id)
+        ).mappings()
+        for line in lines:
+            line = dict(line)
+            by_id[line.pop("order_id")]["lines"].append(line)
+    return list(by_id.values())
+
+
+def fetch_order_page(
+    db: Session,
+    user_id: int,
+    *,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """One page of a customer's orders, newest first, plus the next cursor.
+
+    Cursors are the catalogue's opaque (value, id) tokens; raises
+    catalogue.CatalogueQueryError for a bad one.
+    """
+    stmt = select(*ORDER_COLUMNS).where(orders_table.c.user_id == user_id)
+    if cursor:
+        last_created, last_id = catalogue.decode_cursor(cursor)
+        try:
+            last_created = datetime.fromisoformat(last_created)
+        except (TypeError, ValueError):
+            raise catalogue.CatalogueQueryError("Invalid cursor")
+        stmt = stmt.where(
+            # Redundant with the OR, but lets SQLite seek the index instead of scanning the user's orders
+            orders_table.c.created_at <= last_created,
+            or_(
+                orders_table.c.created_at < last_created,
+                and_(orders_table.c.created_at == last_created, orders_table.c.id < last_id),
+            ),
+        )
+    # Fetch one extra row to learn whether another page exists
+    rows = db.execute(
+        stmt.order_by(orders_table.c.created_at.desc(), orders_table.c.id.desc()).limit(limit + 1)
+    ).mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = catalogue.encode_cursor(rows[-1]["created_at"].isoformat(), rows[-1]["id"])
+    return _with_lines(db, rows), next_cursor
+
+
+def fetch_order(db: Session, user_id: int, order_id: int) -> dict | None:
+    """One of a customer's orders; None if it doesn't exist or is someone else's."""
+    row = db.execute(
+        select(*ORDER_COLUMNS).where(orders_table.c.id == order_id, orders_table.c.user_id == user_id)
+    ).mappings().first()
+    return _with_lines(db, [row])[0] if row is not None else None
@@ -0,0 +1,66 @@
+"""Bulk repricing for sellers.
+
+A rule (a percentage change, a fixed change or a new price) applies to every
+product matching its filters (name pattern, price band, stock level) in one
+set-based UPDATE. The arithmetic runs in the database on the stored integer
+minor units, so the whole catalogue is repriced by a single statement, with
+the same rounding as money.to_minor_units and no float drift.
+"""
+from sqlalchemy import Integer, case, literal, type_coerce, update
+
+from . import models, money, schemas
+
+BASIS_POINTS = 10000 # 100% in hundredths of a percent
+
+
+class RepricingError(ValueError):
+    """Raised for a rule that would not leave every price positive."""
+
+
+def _filters(rule: schemas.RepriceRule) -> list:
+    product = models.Product
+    filters = []
+    if rule.name_like is not None:
+        filters.append(product.name.ilike(rule.name_like))
+    if rule.min_price is not None:
+        filters.append(product.price >= rule.min_price)
+    if rule.max_price is not None:
+        filters.append(product.price <= rule.max_price)
+    if rule.min_quantity is not None:
+        filters.append(product.quantity >= rule.min_quantity)
+    if rule.max_quantity is not None:
+        filters.append(product.quantity <= rule.max_quantity)
+    return filters
+
+
+def new_price_expression(rule: schemas.RepriceRule):
+    """The repriced amount of each row, in minor units, as a SQL expression."""
+    # The stored minor units, not the Decimal the Money type would make of them
+    minor = type_coerce(models.Product.price, Integer)
+    if rule.mode == "set":
+        if rule.value <= 0:
+            raise RepricingError("A new price must be greater than zero")
+        return literal(money.to_minor_units(rule.value), Integer)
+    if rule.mode == "percent":
+        if rule.value <= -100:
+            raise RepricingError("A percentage cut must be less than 100")
+        basis_points = int(rule.value * 100) # Two decimal places at most
+        # Integer division of a non-negative value, so + half rounds half up
+        new = (minor * (BASIS_POINTS + basis_points) + BASIS_POINTS // 2) // BASIS_POINTS
+    else:
+        new = minor + money.to_minor_units(rule.value)
+    # Never price anything at or below zero; 0.01 is the floor
+    return case((new < 1, 1), else_=new)
+
+
+def reprice_statement(rule: schemas.RepriceRule, seller_id: int | None = None):
+    """One UPDATE applying `rule` to every matching product (of `seller_id`, if given)."""
+    filters = _filters(rule)
+    if seller_id is not None:
+        filters.append(models.Product.seller_id == seller_id)
+    return (
+        update(models.Product)
+        .where(*filters)
+        .values(price=new_price_expression(rule))
+        .execution_options(synchronize_session=False)
+    )
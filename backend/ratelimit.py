@@ -0,0 +1,291 @@
+"""Rate limiting and admission control for the expensive endpoints.
+
+Two layers protect /token (a full password KDF per attempt) and the purchase
+endpoints (write locks on products):
+
+* Token buckets, keyed by client IP and username for logins and by user for
+  purchases, cap what any one client can ask for. Over budget gets a 429.
+* Admission controllers cap how much work runs in this process at once.
+  Requests beyond the concurrency limit wait in a bounded queue; once the
+  queue is full, or the recent p99 latency passes its threshold, new arrivals
+  are shed with a 503 until things recover. Both responses carry Retry-After.
+
+Buckets live in a pluggable store. MemoryStore keeps them in process;
+RedisStore keeps them in Redis (one atomic script per request), so several
+workers share one budget per client. Admission control is deliberately per
+process: it protects the process it runs in.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Protocol
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from . import auth, metrics
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory") # "memory", "redis" or "off"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/1")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")) # Memory store only
+# Only trust X-Forwarded-For behind a proxy that sets it
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+
+# Budgets are "<requests>/<seconds>": that many requests at once, refilled
+# evenly over the period
+RATE_LIMIT_LOGIN_IP = os.getenv("RATE_LIMIT_LOGIN_IP", "30/60")
+RATE_LIMIT_LOGIN_USER = os.getenv("RATE_LIMIT_LOGIN_USER", "10/60")
+RATE_LIMIT_PURCHASE = os.getenv("RATE_LIMIT_PURCHASE", "20/10")
+
+# Admission control: concurrent requests, extra requests allowed to wait, and
+# the p99 latency (seconds, 0 = off) above which new requests are shed
+ADMISSION_LOGIN_CONCURRENCY = int(os.getenv("ADMISSION_LOGIN_CONCURRENCY", "16"))
+ADMISSION_LOGIN_QUEUE = int(os.getenv("ADMISSION_LOGIN_QUEUE", "64"))
+ADMISSION_LOGIN_P99_SECONDS = float(os.getenv("ADMISSION_LOGIN_P99_SECONDS", "5.0"))
+ADMISSION_PURCHASE_CONCURRENCY = int(os.getenv("ADMISSION_PURCHASE_CONCURRENCY", "64"))
+ADMISSION_PURCHASE_QUEUE = int(os.getenv("ADMISSION_PURCHASE_QUEUE", "256"))
+ADMISSION_PURCHASE_P99_SECONDS = float(os.getenv("ADMISSION_PURCHASE_P99_SECONDS", "1.0"))
+
+REJECTED = metrics.registry.register(metrics.Counter(
+    "sweetshop_requests_rejected_total", "Requests refused by rate limits or admission control.", ("guard", "reason")
+))
+
+
+@dataclass(frozen=True)
+class Budget:
+    rate: float # Tokens added per second
+    burst: float # Bucket size
+
+    @classmethod
+    def parse(cls, spec: str) -> "Budget":
+        requests, _, seconds = spec.partition("/")
+        return cls(rate=float(requests) / float(seconds or 1), burst=float(requests))
+
+
+class RateLimitStore(Protocol):
+    def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        """Takes `cost` tokens from the key's bucket.
+
+        Returns 0 if they were available, otherwise the seconds until they
+        will be (and takes nothing).
+        """
+        ...
+
+
+class MemoryStore:
+    """In-process token buckets, least recently used dropped past max_keys."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, timer=time.monotonic):
+        self.max_keys = max_keys
+        self._timer = timer
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict() # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        now = self._timer()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (budget.burst, now))
+            tokens = min(budget.burst, tokens + (now - updated) * budget.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / budget.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                # A forgotten bucket comes back full, which only errs towards allowing
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Refill, take and save in one round trip, atomically across workers
+_TOKEN_BUCKET_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisStore:
+    """Token buckets in Redis, for any client with redis-py's eval method."""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self._client = client
+        self.prefix = prefix
+
+    def take(self, key: str, budget: Budget, cost: float = 1.0) -> float:
+        wait = self._client.eval(
+            _TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, budget.rate, budget.burst, cost, time.time()
+        )
+        return float(wait)
+
+
+class RateLimiter:
+    def __init__(self, store: RateLimitStore | None):
+        self.store = store
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, guard: str, key: str, budget: Budget):
+        """Raises 429 if `key` has used up its budget for this guard."""
+        if self.store is None:
+            return
+        wait = self.store.take(f"{guard}:{key}", budget)
+        if wait <= 0:
+            self.allowed += 1
+            return
+        self.limited += 1
+        REJECTED.inc(guard=guard, reason="rate_limit")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.store).__name__ if self.store else None,
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queue: int,
+        p99_threshold: float = 0.0,
+        window: float = 30.0,
+        refresh: float = 1.0,
+        timer=time.monotonic,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.p99_threshold = p99_threshold
+        self.window = window
+        self.refresh = refresh
+        self._timer = timer
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+        # (finished at, seconds) for recent requests; old ones age out, so a
+        # shedding controller starts admitting again once the window passes
+        self._latencies: deque[tuple[float, float]] = deque(maxlen=2000)
+        self._p99 = 0.0
+        self._p99_at = float("-inf")
+
+    def p99(self) -> float:
+        """Recent p99 latency, recomputed at most every `refresh` seconds."""
+        now = self._timer()
+        if now - self._p99_at >= self.refresh:
+            while self._latencies and self._latencies[0][0] < now - self.window:
+                self._latencies.popleft()
+            values = sorted(seconds for _, seconds in self._latencies)
+            self._p99 = values[min(len(values) - 1, int(len(values) * 0.99))] if values else 0.0
+            self._p99_at = now
+        return self._p99
+
+    def _reject(self, reason: str, retry_after: int):
+        self.shed += 1
+        REJECTED.inc(guard=self.name, reason=reason)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """Runs the body once a slot is free, or raises 503 if it shouldn't wait."""
+        if self.p99_threshold and self.p99() > self.p99_threshold:
+            self._reject("latency", max(1, math.ceil(self.p99())))
+        if self.in_flight >= self.max_concurrent and self.queued >= self.max_queue:
+            self._reject("queue", 1)
+
+        started = self._timer()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            finished = self._timer()
+            self._latencies.append((finished, finished - started))
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "shed": self.shed,
+            "p99_seconds": round(self.p99(), 4),
+        }
+
+
+def build_store() -> RateLimitStore | None:
+    if RATE_LIMIT_BACKEND == "off":
+        return None
+    if RATE_LIMIT_BACKEND == "redis":
+        import redis # Optional dependency, only needed for this backend
+
+        return RedisStore(redis.Redis.from_url(RATE_LIMIT_REDIS_URL))
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND!r}")
+
+
+limiter = RateLimiter(build_store())
+login_budgets = {"ip": Budget.parse(RATE_LIMIT_LOGIN_IP), "user": Budget.parse(RATE_LIMIT_LOGIN_USER)}
+purchase_budget = Budget.parse(RATE_LIMIT_PURCHASE)
+login_admission = AdmissionController(
+    "login", ADMISSION_LOGIN_CONCURRENCY, ADMISSION_LOGIN_QUEUE, ADMISSION_LOGIN_P99_SECONDS
+)
+purchase_admission = AdmissionController(
+    "purchase", ADMISSION_PURCHASE_CONCURRENCY, ADMISSION_PURCHASE_QUEUE, ADMISSION_PURCHASE_P99_SECONDS
+)
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+# --- Route dependencies ---
+
+async def login_guard(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """Limits login attempts per client IP and per username before any KDF work."""
+    limiter.check("login_ip", client_ip(request), login_budgets["ip"])
+    limiter.check("login_user", form_data.username.lower(), login_budgets["user"])
+    async with login_admission.slot():
+        yield
+
+
+async def purchase_guard(current_user: auth.Principal = Depends(auth.get_current_user)):
+    """Limits purchases per user and the number running at once."""
+    limiter.check("purchase", str(current_user.id), purchase_budget)
+    async with purchase_admission.slot():
+        yield
@@ -0,0 +1,259 @@
+"""Cart reservations: stock held for a customer until it is bought or expires.
+
+A hold moves units from a product's available stock into its `reserved`
+column (available = quantity - reserved, so checking it is one primary-key
+read however many holds exist) and records the hold in stock_holds.
+Confirming the hold buys the units; releasing it, or letting it expire,
+hands them back. Every change to `reserved` is a conditional UPDATE, so
+holds, purchases and checkouts can't promise the same unit twice.
+
+Expiry is driven by a hashed timing wheel rather than by scanning the table:
+each hold sits in the slot of the tick it expires on, and every tick only
+the holds in that one slot are looked at. Holds are reloaded into the wheel
+on startup, and whichever worker's wheel reaches a hold first releases it.
+"""
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import flashsale, ledger, models
+from .database import SessionLocal
+
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+RESERVATION_MAX_TTL_SECONDS = int(os.getenv("RESERVATION_MAX_TTL_SECONDS", "3600"))
+RESERVATION_TICK_SECONDS = float(os.getenv("RESERVATION_TICK_SECONDS", "1.0"))
+# One lap of the wheel covers the longest hold, so entries never wait out a lap
+WHEEL_SLOTS = max(1, math.ceil(RESERVATION_MAX_TTL_SECONDS / RESERVATION_TICK_SECONDS) + 1)
+
+logger = logging.getLogger(__name__)
+
+products_table = models.Product.__table__
+holds_table = models.StockHold.__table__
+
+# Stock nobody holds
+AVAILABLE = models.Product.quantity - models.Product.reserved
+
+# Executed with a list of {"pid", "n"}, so one statement releases a whole batch.
+# Never takes `reserved` below zero, whatever product now has the id.
+_RELEASE = (
+    update(products_table)
+    .where(products_table.c.id == bindparam("pid"), products_table.c.reserved >= bindparam("n"))
+    .values(reserved=products_table.c.reserved - bindparam("n"))
+)
+
+
+class TimingWheel:
+    """Hashed timing wheel: schedule, cancel and expire in O(1) per entry.
+
+    Times are seconds on any clock (the holds use Unix time). An entry due
+    more than one lap ahead stays in its slot until the lap it is due on.
+    """
+
+    def __init__(self, tick: float = RESERVATION_TICK_SECONDS, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots: list[dict] = [{} for _ in range(slots)] # key -> due tick
+        self._slot_of: dict = {}
+        self.current: int | None = None # Last tick advanced to
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key, when: float):
+        self.cancel(key)
+        # The first tick at or after `when`, so nothing is expired early
+        due = math.ceil(when / self.tick)
+        if self.current is not None and due <= self.current:
+            due = self.current + 1 # Already due: expire on the next advance
+        slot = due % len(self.slots)
+        self.slots[slot][key] = due
+        self._slot_of[key] = slot
+
+    def cancel(self, key) -> bool:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del self.slots[slot][key]
+        return True
+
+    def advance(self, now: float) -> list:
+        """Removes and returns every key due at or before `now`."""
+        target = math.floor(now / self.tick)
+        if self.current is None:
+            self.current = target - 1
+        if target <= self.current:
+            return []
+        # Past a whole lap, every slot is visited once
+        ticks = range(self.current + 1, target + 1)[-len(self.slots):]
+        expired = []
+        for tick in ticks:
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, due_tick in slot.items() if due_tick <= target]
+            for key in due:
+                del slot[key]
+                del self._slot_of[key]
+            expired.extend(due)
+        self.current = target
+        return expired
+
+
+def unix_time(moment: datetime) -> float:
+    """Seconds since the epoch of a naive UTC timestamp (as the ledger stores them)."""
+    return ledger.as_utc(moment).replace(tzinfo=timezone.utc).timestamp()
+
+
+def reserve_statement(product_id: int, quantity: int):
+    """Moves `quantity` units into `reserved` if that many are available."""
+    return (
+        update(products_table)
+        .where(products_table.c.id == product_id, AVAILABLE >= quantity)
+        .values(reserved=products_table.c.reserved + quantity)
+        .returning(products_table.c.id)
+    )
+
+
+def release_holds(
+    db: Session,
+    hold_ids: list[int],
+    expired_before: datetime | None = None,
+    user_id: int | None = None,
+) -> dict[int, int]:
+    """Deletes holds and hands their units back (uncommitted); returns {product_id: units}.
+
+    Only holds expired by `expired_before`, or owned by `user_id`, if given.
+    Holds already confirmed or released (by this or another worker) are
+    skipped, so releasing the same hold twice is harmless.
+    """
+    stmt = delete(holds_table).where(holds_table.c.id.in_(hold_ids))
+    if expired_before is not None:
+        stmt = stmt.where(holds_table.c.expires_at <= expired_before)
+    if user_id is not None:
+        stmt = stmt.where(holds_table.c.user_id == user_id)
+    released: dict[int, int] = {}
+    for product_id, quantity in db.execute(stmt.returning(holds_table.c.product_id, holds_table.c.quantity)):
+        released[product_id] = released.get(product_id, 0) + quantity
+    if released:
+        db.execute(_RELEASE, [{"pid": pid, "n": n} for pid, n in released.items()])
+    return released
+
+
+def delete_product_holds(db: Session, product_id: int) -> list[int]:
+    """Deletes a product's holds along with it (uncommitted); returns their ids.
+
+    SQLite hands a deleted product's id to the next one, which must not
+    have the old holds released against its stock.
+    """
+    return list(db.scalars(
+        delete(holds_table).where(holds_table.c.product_id == product_id).returning(holds_table.c.id)
+    ))
+
+
+class Reservations:
+    """Expiry schedule for the holds, plus counters for /admin/cache-stats."""
+
+    def __init__(self, tick: float = RESERVATION_TICK_SECONDS):
+        self.wheel = TimingWheel(tick)
+        self.product_of: dict[int, int] = {} # hold id -> product id
+        self.created = 0
+        self.confirmed = 0
+        self.released = 0
+        self.expired = 0
+
+    def load(self, db: Session) -> int:
+        """Schedules every hold in the table; call on startup."""
+        holds = db.execute(select(holds_table.c.id, holds_table.c.product_id, holds_table.c.expires_at)).all()
+        for hold_id, product_id, expires_at in holds:
+            self.track(hold_id, product_id, expires_at)
+        return len(holds)
+
+    def track(self, hold_id: int, product_id: int, expires_at: datetime):
+        self.product_of[hold_id] = product_id
+        self.wheel.schedule(hold_id, unix_time(expires_at))
+
+    def forget(self, hold_id: int):
+        self.product_of.pop(hold_id, None)
+        self.wheel.cancel(hold_id)
+
+    async def release(
+        self,
+        hold_ids: list[int],
+        expired_before: datetime | None = None,
+        user_id: int | None = None,
+        db: AsyncSession | None = None,
+    ) -> dict[int, int]:
+        """Hands the holds' units back, keeping any flash-sale counters in step.
+
+        Runs on `db` when given, otherwise on a session of its own.
+        """
+        hot = flashsale.hot_stock
+        product_ids = {self.product_of[hold_id] for hold_id in hold_ids if hold_id in self.product_of}
+        await hot.settle(product_ids)
+        with hot.db_write(product_ids):
+            if db is not None:
+                released = await db.run_sync(release_holds, hold_ids, expired_before, user_id)
+                await db.commit()
+            else:
+                released = await run_in_threadpool(self._release, hold_ids, expired_before, user_id)
+            for product_id, quantity in released.items():
+                hot.add(product_id, quantity)
+        # Someone else's hold stays scheduled
+        if released or user_id is None:
+            for hold_id in hold_ids:
+                self.forget(hold_id)
+        return released
+
+    def _release(self, hold_ids: list[int], expired_before: datetime | None, user_id: int | None) -> dict[int, int]:
+        with SessionLocal() as db:
+            released = release_holds(db, hold_ids, expired_before, user_id)
+            db.commit()
+            return released
+
+    async def expire_due(self, now: datetime | None = None) -> int:
+        """Releases the holds whose tick has come; returns the units handed back."""
+        now = ledger.utcnow() if now is None else now
+        due = self.wheel.advance(unix_time(now))
+        if not due:
+            return 0
+        try:
+            released = await self.release(due, expired_before=now)
+        except Exception:
+            # Still tracked: try them again on the next tick
+            for hold_id in due:
+                self.wheel.schedule(hold_id, unix_time(now) + self.wheel.tick)
+            raise
+        self.expired += len(due)
+        return sum(released.values())
+
+    async def run_expiry(self):
+        """Background task: advances the wheel every tick."""
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                await self.expire_due()
+            except Exception:
+                # Rescheduled by expire_due(); the holds are still in the table
+                logger.exception("Reservation expiry failed")
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self.wheel),
+            "created": self.created,
+            "confirmed": self.confirmed,
+            "released": self.released,
+            "expired": self.expired,
+        }
+
+
+def hold_expiry(ttl_seconds: int | None) -> datetime:
+    ttl = RESERVATION_TTL_SECONDS if ttl_seconds is None else min(ttl_seconds, RESERVATION_MAX_TTL_SECONDS)
+    return ledger.utcnow() + timedelta(seconds=ttl)
+
+
+# Shared schedule for the reservation endpoints
+holds = Reservations()
@@ -0,0 +1,171 @@
+"""Response cache for the public catalogue endpoints.
+
+Cached bodies are keyed by a catalogue version counter. Every write that
+changes a product bumps the counter, which orphans all earlier entries at
+once; nothing has to be deleted explicitly and stale entries age out of the
+LRU. Responses carry a strong ETag so clients can revalidate with
+If-None-Match and get a 304 without a body.
+
+The storage backend is pluggable. MemoryBackend keeps everything in-process;
+RedisBackend uses any client with redis-py's get/set/incr methods, so several
+workers can share one cache and one version counter.
+"""
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Protocol
+
+from .cache import TTLCache
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory") # "memory", "redis" or "off"
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+VERSION_KEY = "catalogue:version"
+
+
+class CacheBackend(Protocol):
+    """The subset of the Redis command set the response cache relies on."""
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes, ex: int | None = None): ...
+
+    def incr(self, key: str) -> int: ...
+
+
+class MemoryBackend:
+    """In-process LRU backend."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL_SECONDS):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        if key in self._counters:
+            return str(self._counters[key]).encode()
+        return self._entries.get(key)
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        self._entries.set(key, value, ttl=ex)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """Adapter for a redis-py style client (redis.Redis or a compatible fake)."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, key: str) -> bytes | None:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        self._client.set(key, value, ex=ex)
+
+    def incr(self, key: str) -> int:
+        return self._client.incr(key)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    headers: dict[str, str]
+
+    def encode(self) -> bytes:
+        meta = json.dumps({"etag": self.etag, "headers": self.headers}).encode()
+        return meta + b"\n" + self.body
+
+    @classmethod
+    def decode(cls, raw: bytes) -> "CachedResponse":
+        meta, body = raw.split(b"\n", 1)
+        fields = json.loads(meta)
+        return cls(body=body, etag=fields["etag"], headers=fields["headers"])
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/"x" matches "x"."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend | None, ttl: int = RESPONSE_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def version(self) -> int:
+        raw = self.backend.get(VERSION_KEY) if self.backend else None
+        return int(raw) if raw else 0
+
+    def bump_version(self):
+        """Invalidates every cached response; call after each catalogue write."""
+        if self.backend:
+            self.backend.incr(VERSION_KEY)
+
+    def key(self, version: int, name: str) -> str:
+        return f"catalogue:{version}:{name}"
+
+    def get(self, key: str) -> CachedResponse | None:
+        raw = self.backend.get(key) if self.backend else None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedResponse.decode(raw)
+
+    def set(self, key: str, body: bytes, headers: dict[str, str] | None = None) -> CachedResponse:
+        entry = CachedResponse(body=body, etag=make_etag(body), headers=headers or {})
+        if self.backend:
+            self.backend.set(key, entry.encode(), ex=self.ttl)
+        return entry
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "version": self.version(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def build_response_cache() -> ResponseCache:
+    if RESPONSE_CACHE_BACKEND == "off":
+        return ResponseCache(None)
+    if RESPONSE_CACHE_BACKEND == "redis":
+        import redis # Optional dependency, only needed for this backend
+
+        return ResponseCache(RedisBackend(redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL)))
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return ResponseCache(MemoryBackend())
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {RESPONSE_CACHE_BACKEND!r}")
+
+
+# Shared cache for the catalogue endpoints
+catalogue_cache = build_response_cache()
@@ -1,5 +1,11 @@
-from pydantic import BaseModel,Field, ConfigDict
-from typing import Literal
+from pydantic import BaseModel,Field, ConfigDict, PlainSerializer
+from datetime import datetime
+from decimal import Decimal
+from typing import Annotated, Literal
+
+# Money is exact (Decimal) in Python and a plain number in JSON
+Amount = Annotated[Decimal, PlainSerializer(float, return_type=float, when_used="json")]
+Price = Annotated[Decimal, Field(gt=0, max_digits=12, decimal_places=2), PlainSerializer(float, return_type=float, when_used="json")]
 
 # User Schemas
 class UserBase(BaseModel):
@@ -25,11 +31,12 @@ class Token(BaseModel):
 class ProductBase(BaseModel):
     name: str = Field(..., max_length=100)
     description: str | None = None
-    price: float = Field(..., gt=0.0) # Price must be greater than zero
+    price: Price # Greater than zero, at most two decimal places
     quantity: int = Field(..., ge=0) # Quantity must be zero or greater
 
 class ProductCreate(ProductBase):
-    pass # Inherits all fields from ProductBase
+    # Sellers are alerted when a sale takes stock down to this level (None: never)
+    low_stock_threshold: int | None = Field(None, ge=0)
 
 class Product(ProductBase):
     model_config = ConfigDict(from_attributes=True)
@@ -40,4 +47,99 @@ class PurchaseSweet(BaseModel):
     quantity: int = Field(gt=0, description="The quantity of the sweet to purchase.")
 
 class RestockSweet(BaseModel):
-    quantity: int = Field(gt=0, description="The quantity of the sweet to restock.")
\ No newline at end of file
+    quantity: int = Field(gt=0, description="The quantity of the sweet to restock.")
+
+class RepriceRule(BaseModel):
+    mode: Literal["percent", "amount", "set"]
+    # Percent change, an amount to add (negative to cut) or the new price
+    value: Decimal = Field(..., max_digits=12, decimal_places=2)
+    # Filters: a product is repriced if it matches every one given
+    name_like: str | None = Field(None, max_length=100) # Case-insensitive SQL LIKE, e.g. "%toffee%"
+    min_price: Price | None = None
+    max_price: Price | None = None
+    min_quantity: int | None = Field(None, ge=0)
+    max_quantity: int | None = Field(None, ge=0)
+
+class RepriceSummary(BaseModel):
+    updated: int
+
+class ReserveSweet(BaseModel):
+    quantity: int = Field(gt=0, description="The quantity of the sweet to hold.")
+    ttl_seconds: int | None = Field(None, gt=0) # Default RESERVATION_TTL_SECONDS, capped at the maximum
+
+class Reservation(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    expires_at: datetime # UTC
+
+class Availability(BaseModel):
+    product_id: int
+    quantity: int # In stock
+    reserved: int # Held by unexpired reservations
+    available: int # quantity - reserved
+
+class OrderLine(BaseModel):
+    product_id: int
+    name: str # As it was when bought
+    quantity: int
+    unit_price: Amount
+
+class Order(BaseModel):
+    id: int
+    created_at: datetime # UTC
+    total: Amount
+    lines: list[OrderLine]
+
+class CartItem(BaseModel):
+    product_id: int
+    quantity: int = Field(gt=0, description="The quantity of the sweet to purchase.")
+
+class Checkout(BaseModel):
+    items: list[CartItem] = Field(..., min_length=1, max_length=100)
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportSummary(BaseModel):
+    inserted: int
+    updated: int
+    failed: int
+    errors: list[ImportRowError] # Only the first 100 failures are listed
+
+
+class StockLevel(BaseModel):
+    product_id: int
+    at: datetime # UTC
+    quantity: int
+
+class SalesReportLine(BaseModel):
+    product_id: int
+    name: str | None # None once the product has been deleted
+    units_sold: int
+    revenue: Amount
+    sales: int # Number of purchase events
+
+class SalesTotals(BaseModel):
+    product_id: int
+    units_sold: int
+    revenue: Amount
+    sales: int # Number of purchase events
+
+class SellerDashboard(BaseModel):
+    products: int
+    units_in_stock: int
+    units_reserved: int # Held by cart reservations
+    out_of_stock: int # Products with nothing available
+    low_stock: int # Products available at or below their low_stock_threshold
+    units_sold: int
+    revenue: Amount
+    sales: int # Number of purchase events
+
+class SalesBucket(BaseModel):
+    start: datetime # UTC start of the hour or day
+    units_sold: int
+    revenue: Amount
+    sales: int
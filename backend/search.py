@@ -0,0 +1,253 @@
+import math
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Matches are weighted so exact words outrank prefixes, which outrank typos
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.7
+FUZZY_WEIGHT = 0.5
+
+# A word in the name counts for more than the same word in the description
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Shortest query term that may match with one typo (shorter words match too much)
+MIN_FUZZY_LENGTH = 4
+
+# Rebuild the index from the table this often (0 = never), so a worker picks
+# up products created or renamed through the other workers
+SEARCH_RELOAD_SECONDS = int(os.getenv("SEARCH_RELOAD_SECONDS", "0"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Lower-cases the text and splits it into alphanumeric words."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _deletes(term: str) -> set[str]:
+    """All strings one deletion away from the term (SymSpell neighbourhood)."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if a and b differ by one insert, delete, substitute or transpose."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diffs = [i for i in range(la) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        # Adjacent transposition, e.g. "cnady" -> "candy"
+        return (
+            len(diffs) == 2
+            and diffs[1] == diffs[0] + 1
+            and a[diffs[0]] == b[diffs[1]]
+            and a[diffs[1]] == b[diffs[0]]
+        )
+    if la > lb:
+        a, b = b, a
+    # b is one character longer than a: skipping one char of b must give a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """In-process inverted index over product names and descriptions.
+
+    Postings map each word to {product_id: weighted term frequency}. A sorted
+    vocabulary answers prefix lookups with a binary search, and a deletion
+    neighbourhood map answers one-typo lookups without scanning the vocabulary.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self._doc_terms: dict[int, set[str]] = {}
+        self._vocabulary: list[str] = []
+        self._vocabulary_dirty = False
+        self._deletion_map: dict[str, set[str]] = defaultdict(set)
+
+    # --- Maintenance ---
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self, db: Session):
+        """Builds the index from the products table the first time it is needed."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = db.execute(
+                select(models.Product.id, models.Product.name, models.Product.description)
+            )
+            for product_id, name, description in rows:
+                self._add(product_id, name, description)
+            self._loaded = True
+
+    def reload(self, db: Session):
+        """Rebuilds a loaded index from the products table, then swaps it in.
+
+        Searches keep using the old index while the new one is built. A local
+        write landing during the build shows up again on the next reload.
+        """
+        if not self._loaded:
+            return # The first search loads the current table anyway
+        fresh = SearchIndex()
+        fresh.ensure_loaded(db)
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._vocabulary = fresh._vocabulary
+            self._vocabulary_dirty = fresh._vocabulary_dirty
+            self._deletion_map = fresh._deletion_map
+
+    def upsert(self, product_id: int, name: str, description: str | None):
+        """Adds a product, replacing whatever was indexed for it before."""
+        with self._lock:
+            if not self._loaded:
+                # The first search will load this product from the database
+                return
+            self._remove(product_id)
+            self._add(product_id, name, description)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+
+    def clear(self):
+        """Drops everything so the next search rebuilds from the database."""
+        with self._lock:
+            self._reset()
+
+    def _add(self, product_id: int, name: str, description: str | None):
+        weights: dict[str, float] = defaultdict(float)
+        for term in tokenize(name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._vocabulary_dirty = True
+                for variant in _deletes(term):
+                    self._deletion_map[variant].add(term)
+            self._postings[term][product_id] = weight
+        self._doc_terms[product_id] = set(weights)
+
+    def _remove(self, product_id: int):
+        for term in self._doc_terms.pop(product_id, ()):
+            docs = self._postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(product_id, None)
+            if not docs:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+                for variant in _deletes(term):
+                    self._deletion_map[variant].discard(term)
+
+    # --- Lookup ---
+
+    def _sorted_vocabulary(self) -> list[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        return self._vocabulary
+
+    def _prefix_matches(self, prefix: str) -> list[str]:
+        vocabulary = self._sorted_vocabulary()
+        start = bisect_left(vocabulary, prefix)
+        matches = []
+        for term in vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def _fuzzy_matches(self, term: str) -> set[str]:
+        if len(term) < MIN_FUZZY_LENGTH:
+            return set()
+        candidates = set(self._deletion_map.get(term, ()))
+        for variant in _deletes(term):
+            if variant in self._postings:
+                candidates.add(variant)
+            candidates.update(self._deletion_map.get(variant, ()))
+        return {c for c in candidates if _within_one_edit(term, c)}
+
+    def _expand(self, term: str, is_prefix: bool) -> dict[str, float]:
+        """Maps each indexed word that matches a query term to its match weight."""
+        matches: dict[str, float] = {}
+        for candidate in self._fuzzy_matches(term):
+            matches[candidate] = FUZZY_WEIGHT
+        if is_prefix:
+            for candidate in self._prefix_matches(term):
+                matches[candidate] = max(matches.get(candidate, 0.0), PREFIX_WEIGHT)
+        if term in self._postings:
+            matches[term] = EXACT_WEIGHT
+        return matches
+
+    def search(self, query: str) -> list[int]:
+        """Returns ids of products matching every query word, best match first.
+
+        The last word is treated as a prefix so results update while the user
+        is still typing. Each word may also match with a single typo.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            total_docs = max(len(self._doc_terms), 1)
+            scores: dict[int, float] | None = None
+            for position, term in enumerate(terms):
+                is_prefix = position == len(terms) - 1
+                term_scores: dict[int, float] = {}
+                for candidate, match_weight in self._expand(term, is_prefix).items():
+                    docs = self._postings[candidate]
+                    idf = math.log(1 + total_docs / len(docs))
+                    for product_id, tf in docs.items():
+                        score = match_weight * idf * tf
+                        if score > term_scores.get(product_id, 0.0):
+                            term_scores[product_id] = score
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    # Every query word must match (AND semantics)
+                    scores = {
+                        pid: s + term_scores[pid]
+                        for pid, s in scores.items()
+                        if pid in term_scores
+                    }
+                if not scores:
+                    return []
+
+        return sorted(scores, key=lambda pid: (-scores[pid], pid))
+
+
+# Shared index used by the API endpoints
+product_index = SearchIndex()
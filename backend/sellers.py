@@ -0,0 +1,95 @@
+"""Seller-owned catalogues.
+
+Every product belongs to the seller who created it (products.seller_id), and
+names only have to be unique within one seller's catalogue. Seller writes
+fold the ownership check into the statement that finds the product
+(WHERE id = :id AND seller_id = :seller), so another seller's product looks
+exactly like a missing one and costs no extra round trip. Seller views read
+through the (seller_id, ...) indexes, so they cost what the seller's own
+catalogue costs, however large the marketplace grows.
+"""
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from . import analytics, ledger, models, money
+
+products_table = models.Product.__table__
+
+
+def owned(product_id: int, seller_id: int):
+    """WHERE clause for one product, if `seller_id` owns it."""
+    return (models.Product.id == product_id) & (models.Product.seller_id == seller_id)
+
+
+def product_names(db: Session, seller_id: int) -> dict[int, str]:
+    """Ids and names of one seller's products, read from the seller's index range."""
+    return dict(db.execute(
+        select(products_table.c.id, products_table.c.name).where(products_table.c.seller_id == seller_id)
+    ).all())
+
+
+def assign_owners(db: Session, default_seller_id: int | None = None) -> dict:
+    """Gives products without a seller one, for databases older than ownership.
+
+    A product belongs to whoever its latest 'create' ledger event names (ids
+    can be reused, so an older one may be another product's); products the
+    ledger can't attribute go to `default_seller_id` if given. Returns how
+    many were attributed and how many are still unowned.
+    """
+    events = ledger.events_table
+    creator = (
+        select(events.c.user_id)
+        .where(events.c.product_id == products_table.c.id, events.c.reason == "create")
+        .order_by(events.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    unowned = select(func.count()).where(products_table.c.seller_id.is_(None))
+    before = db.scalar(unowned)
+    db.execute(update(products_table).where(products_table.c.seller_id.is_(None)).values(seller_id=creator))
+    if default_seller_id is not None:
+        db.execute(
+            update(products_table).where(products_table.c.seller_id.is_(None)).values(seller_id=default_seller_id)
+        )
+    db.commit()
+    after = db.scalar(unowned)
+    return {"attributed": before - after, "unowned": after}
+
+
+def fetch_dashboard(db: Session, seller_id: int) -> dict:
+    """Stock and lifetime sales across one seller's catalogue.
+
+    Stock comes from one pass over the seller's index range and sales from
+    the in-memory aggregates, so a seller with ten products pays for ten.
+    """
+    rows = db.execute(
+        select(
+            products_table.c.id,
+            products_table.c.quantity,
+            products_table.c.reserved,
+            products_table.c.low_stock_threshold,
+        ).where(products_table.c.seller_id == seller_id)
+    ).all()
+    dashboard = {
+        "products": len(rows),
+        "units_in_stock": 0,
+        "units_reserved": 0,
+        "out_of_stock": 0,
+        "low_stock": 0,
+        "units_sold": 0,
+        "revenue": money.ZERO,
+        "sales": 0,
+    }
+    for product_id, quantity, reserved, threshold in rows:
+        quantity = quantity or 0
+        available = quantity - reserved
+        dashboard["units_in_stock"] += quantity
+        dashboard["units_reserved"] += reserved
+        if available <= 0:
+            dashboard["out_of_stock"] += 1
+        elif threshold is not None and available <= threshold:
+            dashboard["low_stock"] += 1
+        totals = analytics.sales.totals(product_id)
+        for key in ("units_sold", "revenue", "sales"):
+            dashboard[key] += totals[key]
+    return dashboard
@@ -0,0 +1,169 @@
+"""Production launcher: migrate once, then serve the API from one or more workers.
+
+    python -m backend.serve --workers 4 --bind 0.0.0.0:8000 --redis-url redis://cache:6379/0
+
+Steps:
+1. Configure the workers through the environment before anything from the
+   backend is imported (modules read their settings at import time):
+   AUTO_MIGRATE=0, the SQLite production profile, ledger tailing for the
+   sales analytics, periodic search index reloads and, with --redis-url, the
+   Redis backends of the response cache and rate limiter, so workers share
+   one catalogue version and one budget per client (without it, several
+   workers run with the response cache off).
+2. Run backend.migrate once.
+3. Serve with gunicorn and uvicorn workers when gunicorn is installed
+   (`pip install .[deploy]`). The app is preloaded in the master, so imports
+   happen once and workers share those pages copy-on-write; each worker then
+   drops the pooled connections it inherited. Workers are recycled after
+   --max-requests to bound memory growth. Without gunicorn, uvicorn's own
+   process manager is used (no preloading).
+
+On SIGTERM, workers stop accepting connections and get --graceful-timeout
+seconds to finish in-flight requests. Live event streams are cut at that
+point; browsers reconnect on their own.
+
+One worker is the default. With more, some state is still per worker:
+
+* search sees other workers' writes only after its next reload
+  (SEARCH_RELOAD_SECONDS, 30 by default here);
+* a role change or deactivation reaches the other workers' principal caches
+  only when their entries expire (auth.PRINCIPAL_CACHE_TTL_SECONDS);
+* the live event stream (/products/events) only carries the changes made
+  through the worker the client is connected to;
+* idempotency outcomes are only replayed by the worker that stored them;
+* without --redis-url, the response cache is turned off (a worker's cached
+  pages would miss the others' writes), and each worker keeps its own rate
+  limit budgets, so a client gets up to N times the configured limits;
+* flash sales are refused (FLASH_SALE_ENABLED needs a single worker).
+
+Use more workers only if those lags are acceptable.
+"""
+import argparse
+import importlib.util
+import json
+import os
+
+# More workers trade the per-worker state listed above for throughput
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def worker_environment(args) -> dict[str, str]:
+    """Settings every worker needs, leaving anything already set alone."""
+    env = {
+        "AUTO_MIGRATE": "0",
+        "SQLITE_PROFILE": "production",
+    }
+    if args.workers > 1:
+        # A worker only sees its own purchases, so read everyone's from the ledger
+        env["ANALYTICS_TAIL_SECONDS"] = "5"
+        # ...and rebuild the search index for their new and renamed products
+        env["SEARCH_RELOAD_SECONDS"] = "30"
+        if not args.redis_url:
+            # A worker's cached catalogue pages would outlive writes made through the others
+            env["RESPONSE_CACHE_BACKEND"] = "off"
+    if args.redis_url:
+        env.update(
+            RESPONSE_CACHE_BACKEND="redis",
+            RESPONSE_CACHE_REDIS_URL=args.redis_url,
+            RATE_LIMIT_BACKEND="redis",
+            RATE_LIMIT_REDIS_URL=args.redis_url,
+        )
+    return {key: value for key, value in env.items() if key not in os.environ}
+
+
+def _post_fork(server, worker):
+    # Connections opened in the master must not be shared with the children
+    from backend import database, metrics
+
+    database.engine.dispose(close=False)
+    database.async_engine.sync_engine.dispose(close=False)
+    if database.read_async_engine is not database.async_engine:
+        database.read_async_engine.sync_engine.dispose(close=False)
+    # The disposed pools were the ones timed for the pool wait histogram
+    metrics.reinstrument_pools()
+
+
+def _uvicorn_worker_class() -> str:
+    # Newer uvicorn releases moved the gunicorn worker into its own package
+    if importlib.util.find_spec("uvicorn_worker"):
+        return "uvicorn_worker.UvicornWorker"
+    return "uvicorn.workers.UvicornWorker"
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication # Optional dependency (the "deploy" extra)
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": _uvicorn_worker_class(),
+        "preload_app": True,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.timeout,
+        "keepalive": 5,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests // 10,
+        "post_fork": _post_fork,
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from backend.main import app
+
+            return app
+
+    Application().run()
+
+
+def run_uvicorn(args):
+    import uvicorn
+
+    host, _, port = args.bind.rpartition(":")
+    uvicorn.run(
+        "backend.main:app",
+        host=host or "127.0.0.1",
+        port=int(port),
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=5,
+        limit_max_requests=args.max_requests or None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Sweet Shop API with several workers")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--server", choices=("auto", "gunicorn", "uvicorn"), default="auto")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL"), help="Share caches and rate limits through Redis")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to drain in-flight requests")
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds before a stuck worker is restarted")
+    parser.add_argument("--max-requests", type=int, default=10000, help="Recycle workers after this many requests (0 = never)")
+    parser.add_argument("--skip-migrate", action="store_true", help="Schema is managed elsewhere")
+    args = parser.parse_args()
+    if args.workers > 1 and os.getenv("FLASH_SALE_ENABLED", "0") == "1":
+        # Each worker would hold its own stock for the sale and append to the same write-ahead log
+        parser.error("FLASH_SALE_ENABLED=1 needs a single worker (--workers 1)")
+
+    os.environ.update(worker_environment(args))
+
+    if not args.skip_migrate:
+        from backend import migrate
+
+        print(json.dumps({"migrate": migrate.migrate()}), flush=True)
+
+    server = args.server
+    if server == "auto":
+        server = "gunicorn" if importlib.util.find_spec("gunicorn") and os.name != "nt" else "uvicorn"
+    if server == "gunicorn":
+        run_gunicorn(args)
+    else:
+        run_uvicorn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
+import argparse
+import asyncio
+import json
+import pstats
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from fastapi import HTTPException, Response
 from fastapi.testclient import TestClient 
 from sqlalchemy.orm import Session
 from backend.main import app 
 
 # Imports for database access and models
 from backend.database import SessionLocal 
-from backend import models
+from backend import models, auth, search, response_cache, events, ledger, analytics, metrics, ratelimit, idempotency, serve, fastjson, money, flashsale, reservations, jobs, sellers, catalogue
 
 # Initialize the TestClient with our app
 client = TestClient(app)
@@ -20,6 +28,15 @@ def db_session():
     finally:
         db.close()
 
+# --- Rate limits are off except in the tests that exercise them ---
+@pytest.fixture(autouse=True)
+def no_rate_limits(monkeypatch):
+    """The suite logs in and buys far faster than any real client would."""
+    monkeypatch.setattr(ratelimit.limiter, "store", None)
+    # A stress test's queueing must not get the next tests' purchases shed for latency
+    for controller in (ratelimit.login_admission, ratelimit.purchase_admission):
+        monkeypatch.setattr(controller, "p99_threshold", 0.0)
+
 # --- Cleanup Functions for TDD isolation ---
 
 def cleanup_test_user(db: Session):
@@ -47,6 +64,36 @@ def cleanup_products(db: Session):
         "Test Update New Name",
         "Product To Delete",  # For Delete Test
         "Product To Be Forbidden Deleted", # For Delete Test
+        "Zesty Lemon Drops",  # For Search Tests
+        "Lemon Sherbet Fizz",
+        "Minty Humbug",
+        "Purchase Test Toffee",  # For Purchase Tests
+        "Contended Caramel",
+        "Checkout Test Fudge",  # For Checkout Tests
+        "Bulk Test Nougat",  # For Bulk Import Tests
+        "Bulk Test Brittle",
+        "Cached Candy Cane",  # For Response Cache Tests
+        "Live Liquorice",  # For Event Stream Tests
+        "Ledger Lollipop",  # For Inventory Ledger Tests
+        "Analytics Aniseed",  # For Sales Analytics Tests
+        "Metered Marshmallow",  # For Metrics Tests
+        "Rationed Rhubarb",  # For Rate Limit Tests
+        "Retried Raspberry",  # For Idempotency Tests
+        "Tailed Treacle",  # For Multi-Worker Tests
+        "Squeezed Sherbet",  # For Serialization Tests
+        "Repriced Rock",  # For Repricing Tests
+        "Repriced Rock Candy",
+        "Flashy Fudge",  # For Flash Sale Tests
+        "Held Honeycomb",  # For Reservation Tests
+        "Low Stock Lozenge",  # For Background Job Tests
+        "Ordered Orange Cream",  # For Order History Tests
+        "Partitioned Praline",  # For Seller Catalogue Tests
+        "Dashboard Dragee",
+        "Dashboard Jelly",
+        "Dashboard Nougat",
+        "Private Pastille",  # For Seller Analytics Tests
+        "Doomed Divinity",  # For Delete While Held Tests
+        "Successor Sundae",
     ]
     
     # Delete all products whose names match the ones used in the tests
@@ -348,4 +395,1368 @@ def test_delete_product_forbidden_wrong_role(db_session: Session):
     )
 
     assert response.status_code == 403
-    assert "must have the role 'seller'" in response.json()["detail"]
\ No newline at end of file
+    assert "must have the role 'seller'" in response.json()["detail"]
+
+
+# =======================================================
+# --- Search Tests ---
+# =======================================================
+
+def create_search_products(db: Session):
+    """Creates a small catalogue for the search tests and returns the seller token."""
+    cleanup_products(db)
+    seller_username, seller_password = setup_seller_user(db)
+    token = get_auth_token(seller_username, seller_password)
+    headers = {"Authorization": f"Bearer {token}"}
+    for data in [
+        {"name": "Zesty Lemon Drops", "description": "Sour citrus candy", "price": 1.50, "quantity": 10},
+        {"name": "Lemon Sherbet Fizz", "description": "Fizzy sherbet", "price": 2.00, "quantity": 10},
+        {"name": "Minty Humbug", "description": "Striped mint with a hint of lemon", "price": 1.00, "quantity": 10},
+    ]:
+        client.post("/products", json=data, headers=headers)
+    return token
+
+
+# --- 14. Search Ranking Test ---
+def test_search_products_ranks_name_matches_first(db_session: Session):
+    """Tests that name matches outrank description matches."""
+    create_search_products(db_session)
+    response = client.get("/products/search", params={"query": "lemon"})
+    assert response.status_code == 200
+    names = [p["name"] for p in response.json()]
+    assert names.index("Minty Humbug") > names.index("Zesty Lemon Drops")
+    assert names.index("Minty Humbug") > names.index("Lemon Sherbet Fizz")
+
+
+# --- 15. Search Prefix and Typo Test ---
+def test_search_products_prefix_and_typo(db_session: Session):
+    """Tests autocomplete prefixes and single-typo matches."""
+    create_search_products(db_session)
+    response = client.get("/products/search", params={"query": "sherb"})
+    assert "Lemon Sherbet Fizz" in [p["name"] for p in response.json()]
+
+    response = client.get("/products/search", params={"query": "humbgu"})
+    assert [p["name"] for p in response.json()] == ["Minty Humbug"]
+
+
+# --- 16. Search Index Sync Test ---
+def test_search_index_follows_update_and_delete(db_session: Session):
+    """Tests that renamed and deleted products leave the search results."""
+    token = create_search_products(db_session)
+    headers = {"Authorization": f"Bearer {token}"}
+    product = client.get("/products/search", params={"query": "humbug"}).json()[0]
+
+    client.put(
+        f"/products/{product['id']}",
+        json={"name": "Test Update New Name", "description": "Plain", "price": 1.00, "quantity": 1},
+        headers=headers,
+    )
+    assert client.get("/products/search", params={"query": "humbug"}).json() == []
+
+    client.delete(f"/products/{product['id']}", headers=headers)
+    assert client.get("/products/search", params={"query": "plain"}).json() == []
+
+    # A product written through another worker shows up once the index reloads
+    db_session.add(models.Product(name="Test Product A", description="Pomegranate", price=1, quantity=1))
+    db_session.commit()
+    assert client.get("/products/search", params={"query": "pomegranate"}).json() == []
+    search.product_index.reload(db_session)
+    assert [p["name"] for p in client.get("/products/search", params={"query": "pomegranate"}).json()] == ["Test Product A"]
+
+
+# --- 17. Search Pagination Test ---
+def test_search_products_pagination(db_session: Session):
+    """Tests that the next-page cursor walks through every match once."""
+    create_search_products(db_session)
+    first = client.get("/products/search", params={"query": "lemon", "limit": 2})
+    assert len(first.json()) == 2
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get("/products/search", params={"query": "lemon", "limit": 2, "cursor": cursor})
+    assert "X-Next-Cursor" not in second.headers
+    ids = [p["id"] for p in first.json() + second.json()]
+    assert len(ids) == len(set(ids)) == 3
+
+
+
+# =======================================================
+# --- Catalogue Listing Tests ---
+# =======================================================
+
+# --- 18. Keyset Pagination Test ---
+def test_read_products_keyset_pagination(db_session: Session):
+    """Tests that following X-Next-Cursor visits every product exactly once."""
+    create_search_products(db_session)
+    expected = {p.id for p in db_session.query(models.Product.id)}
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "cursor": cursor} if cursor else {"limit": 2}
+        response = client.get("/products", params=params)
+        assert response.status_code == 200
+        seen += [p["id"] for p in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == sorted(expected)
+
+    # With no parameters, a catalogue larger than one page comes in default-sized pages
+    db_session.query(models.Product).filter(models.Product.name.like("Paged Pastille %")).delete(synchronize_session=False)
+    db_session.add_all([
+        models.Product(name=f"Paged Pastille {i}", description="Paging", price=1, quantity=1)
+        for i in range(catalogue.DEFAULT_PAGE_SIZE)
+    ])
+    db_session.commit()
+    response_cache.catalogue_cache.bump_version()
+    expected = {p.id for p in db_session.query(models.Product.id)}
+    response = client.get("/products")
+    assert len(response.json()) == catalogue.DEFAULT_PAGE_SIZE
+    seen = [p["id"] for p in response.json()]
+    while "x-next-cursor" in response.headers:
+        response = client.get("/products", params={"cursor": response.headers["x-next-cursor"]})
+        seen += [p["id"] for p in response.json()]
+    assert seen == sorted(expected)
+    db_session.query(models.Product).filter(models.Product.name.like("Paged Pastille %")).delete(synchronize_session=False)
+    db_session.commit()
+    response_cache.catalogue_cache.bump_version()
+
+
+# --- 19. Filter, Sort and Projection Test ---
+def test_read_products_filters_sort_and_fields(db_session: Session):
+    """Tests price filters, descending price sort and field projection."""
+    create_search_products(db_session)
+    response = client.get(
+        "/products",
+        params={"min_price": 1.25, "max_price": 2.00, "sort": "-price", "fields": "name,price"},
+    )
+    assert response.status_code == 200
+    rows = response.json()
+    assert all(set(row) == {"name", "price"} for row in rows)
+    prices = [row["price"] for row in rows]
+    assert prices == sorted(prices, reverse=True)
+    assert all(1.25 <= p <= 2.00 for p in prices)
+    assert {"Zesty Lemon Drops", "Lemon Sherbet Fizz"} <= {row["name"] for row in rows}
+
+
+# --- 20. Invalid Listing Parameters Test ---
+def test_read_products_rejects_unknown_fields_and_cursor():
+    """Tests that bad projections and cursors are rejected with 400."""
+    assert client.get("/products", params={"fields": "name,password"}).status_code == 400
+    assert client.get("/products", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/products", params={"sort": "quantity"}).status_code == 400
+
+
+
+# =======================================================
+# --- Purchase Tests ---
+# =======================================================
+
+def create_stocked_product(db: Session, name: str, quantity: int):
+    """Creates a product as the seller and returns (product_id, customer_token)."""
+    # Both setup helpers clean up products, so create the product last
+    customer_username, customer_password = setup_customer_user(db)
+    seller_username, seller_password = setup_seller_user(db)
+    seller_token = get_auth_token(seller_username, seller_password)
+    response = client.post(
+        "/products",
+        json={"name": name, "description": "Stock test", "price": 1.00, "quantity": quantity},
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    return response.json()["id"], get_auth_token(customer_username, customer_password)
+
+
+# --- 21. Purchase Success and Insufficient Stock Test ---
+def test_purchase_decrements_and_rejects_overselling(db_session: Session):
+    """Tests a purchase deducts stock and a too-large purchase is rejected."""
+    product_id, token = create_stocked_product(db_session, "Purchase Test Toffee", 5)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 2
+
+    response = client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient stock. Only 2 available."
+
+    response = client.post("/products/999999/purchase", json={"quantity": 1}, headers=headers)
+    assert response.status_code == 404
+
+
+# --- 22. Concurrent Purchase Stress Test ---
+def test_concurrent_purchases_never_oversell(db_session: Session):
+    """Hammers one product from many threads and checks stock is never oversold."""
+    stock, attempts = 30, 80
+    product_id, token = create_stocked_product(db_session, "Contended Caramel", stock)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # One client context = one server event loop shared by all threads, as in production
+    with TestClient(app) as shared_client:
+        def buy_one(_):
+            return shared_client.post(
+                f"/products/{product_id}/purchase", json={"quantity": 1}, headers=headers
+            ).status_code
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            statuses = list(pool.map(buy_one, range(attempts)))
+
+    assert statuses.count(200) == stock
+    assert statuses.count(400) == attempts - stock
+    db_session.expire_all()
+    remaining = db_session.query(models.Product.quantity).filter(models.Product.id == product_id).scalar()
+    assert remaining == 0
+
+
+
+# =======================================================
+# --- Checkout Tests ---
+# =======================================================
+
+# --- 23. Checkout Success Test ---
+def test_checkout_purchases_whole_cart(db_session: Session):
+    """Tests a cart with repeated lines is deducted in one request."""
+    fudge_id, token = create_stocked_product(db_session, "Checkout Test Fudge", 10)
+    headers = {"Authorization": f"Bearer {token}"}
+    cart = {"items": [
+        {"product_id": fudge_id, "quantity": 2},
+        {"product_id": fudge_id, "quantity": 3},
+    ]}
+
+    response = client.post("/checkout", json=cart, headers=headers)
+    assert response.status_code == 200
+    assert [(p["id"], p["quantity"]) for p in response.json()] == [(fudge_id, 5)]
+
+
+# --- 24. Checkout All-or-Nothing Test ---
+def test_checkout_rolls_back_whole_cart(db_session: Session):
+    """Tests that one short or missing line leaves every product untouched."""
+    fudge_id, token = create_stocked_product(db_session, "Checkout Test Fudge", 4)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    cart = {"items": [{"product_id": fudge_id, "quantity": 1}, {"product_id": 999999, "quantity": 1}]}
+    assert client.post("/checkout", json=cart, headers=headers).status_code == 404
+
+    cart = {"items": [{"product_id": fudge_id, "quantity": 5}]}
+    assert client.post("/checkout", json=cart, headers=headers).status_code == 400
+
+    assert client.get(f"/products/{fudge_id}").json()["quantity"] == 4
+
+
+
+# =======================================================
+# --- Bulk Import/Export Tests ---
+# =======================================================
+
+# --- 25. CSV Import Upsert Test ---
+def test_bulk_import_csv_inserts_updates_and_reports_errors(db_session: Session):
+    """Tests a CSV import inserts new names, updates existing ones and reports bad rows."""
+    cleanup_products(db_session)
+    seller_username, seller_password = setup_seller_user(db_session)
+    headers = {"Authorization": f"Bearer {get_auth_token(seller_username, seller_password)}"}
+    client.post(
+        "/products",
+        json={"name": "Bulk Test Nougat", "description": "Old", "price": 1.00, "quantity": 1},
+        headers=headers,
+    )
+
+    body = (
+        "name,description,price,quantity\n"
+        "Bulk Test Nougat,Honey nougat,3.25,40\n"
+        "Bulk Test Brittle,,2.00,15\n"
+        "Bulk Test Broken,Bad price,-1,5\n"
+    )
+    response = client.post(
+        "/products/import",
+        content=body,
+        params={"chunk_size": 2},
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["inserted"], summary["updated"], summary["failed"]) == (1, 1, 1)
+    assert summary["errors"][0]["line"] == 4
+
+    nougat = db_session.query(models.Product).filter(models.Product.name == "Bulk Test Nougat").one()
+    assert (nougat.description, nougat.price, nougat.quantity) == ("Honey nougat", 3.25, 40)
+
+
+# --- 26. NDJSON Export Round-Trip Test ---
+def test_bulk_import_ndjson_and_export(db_session: Session):
+    """Tests NDJSON import and that the streamed export contains the imported rows."""
+    cleanup_products(db_session)
+    seller_username, seller_password = setup_seller_user(db_session)
+    headers = {"Authorization": f"Bearer {get_auth_token(seller_username, seller_password)}"}
+
+    body = '{"name": "Bulk Test Brittle", "price": 2.5, "quantity": 7}\nnot json\n'
+    response = client.post(
+        "/products/import", content=body, headers={**headers, "Content-Type": "application/x-ndjson"}
+    )
+    assert response.json()["inserted"] == 1
+    assert response.json()["failed"] == 1
+
+    response = client.get("/products/export", params={"format": "ndjson"}, headers=headers)
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    brittle = next(row for row in exported if row["name"] == "Bulk Test Brittle")
+    assert (brittle["price"], brittle["quantity"]) == (2.5, 7)
+
+    response = client.get("/products/export", headers=headers)
+    assert response.text.splitlines()[0] == "id,name,description,price,quantity"
+
+
+
+# =======================================================
+# --- Principal Cache Tests ---
+# =======================================================
+
+# --- 27. Principal Cache Hit Test ---
+def test_authenticated_requests_hit_principal_cache(db_session: Session):
+    """Tests that repeated requests with one token are served from the cache."""
+    seller_username, seller_password = setup_seller_user(db_session)
+    headers = {"Authorization": f"Bearer {get_auth_token(seller_username, seller_password)}"}
+
+    before = client.get("/admin/cache-stats", headers=headers).json()["principal_cache"]
+    client.get("/admin/cache-stats", headers=headers)
+    after = client.get("/admin/cache-stats", headers=headers).json()["principal_cache"]
+    assert after["hits"] - before["hits"] == 2
+    assert after["misses"] == before["misses"]
+
+
+# --- 28. Principal Cache Invalidation Test ---
+def test_role_change_invalidates_principal_cache(db_session: Session):
+    """Tests that demoting a seller takes effect on the very next request."""
+    seller_username, seller_password = setup_seller_user(db_session)
+    headers = {"Authorization": f"Bearer {get_auth_token(seller_username, seller_password)}"}
+    assert client.get("/admin/cache-stats", headers=headers).status_code == 200
+
+    seller = db_session.query(models.User).filter(models.User.username == seller_username).one()
+    seller.role = "customer"
+    db_session.commit()
+
+    assert client.get("/admin/cache-stats", headers=headers).status_code == 403
+
+
+
+# =======================================================
+# --- Password Hashing Tests ---
+# =======================================================
+
+# --- 29. Rehash on Login Test ---
+def test_login_upgrades_legacy_password_hash(db_session: Session):
+    """Tests that a login with an outdated hash scheme stores a fresh hash."""
+    cleanup_login_test_user(db_session)
+    legacy_hash = auth.build_pwd_context(["sha256_crypt"], sha256_crypt_rounds=1000).hash("loginpass42")
+    db_session.add(models.User(
+        username="loginuser", email="login@example.com", hashed_password=legacy_hash, role="customer"
+    ))
+    db_session.commit()
+
+    response = client.post("/token", data={"username": "loginuser", "password": "loginpass42"})
+    assert response.status_code == 200
+
+    db_session.expire_all()
+    user = db_session.query(models.User).filter(models.User.username == "loginuser").one()
+    assert user.hashed_password != legacy_hash
+    assert not auth.pwd_context.needs_update(user.hashed_password)
+    assert auth.verify_password("loginpass42", user.hashed_password)
+
+
+
+# =======================================================
+# --- Response Cache Tests ---
+# =======================================================
+
+class FakeRedis:
+    """Minimal stand-in for redis.Redis, implementing get/set/incr."""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, b"0")) + 1).encode()
+        return int(self.data[key])
+
+
+# --- 30. ETag Revalidation Test ---
+def test_read_product_etag_and_304(db_session: Session):
+    """Tests If-None-Match gets a 304 until a purchase changes the product."""
+    product_id, token = create_stocked_product(db_session, "Cached Candy Cane", 5)
+
+    first = client.get(f"/products/{product_id}")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+
+    revalidated = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    client.post(
+        f"/products/{product_id}/purchase",
+        json={"quantity": 1},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    changed = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["quantity"] == 4
+    assert changed.headers["ETag"] != etag
+
+
+# --- 31. Listing Cache Invalidation Test ---
+def test_read_products_cache_invalidated_by_writes(db_session: Session):
+    """Tests that a cached listing is rebuilt after a product is created."""
+    cleanup_products(db_session)
+    seller_username, seller_password = setup_seller_user(db_session)
+    headers = {"Authorization": f"Bearer {get_auth_token(seller_username, seller_password)}"}
+
+    before = client.get("/products", params={"limit": 1000})
+    assert client.get("/products", params={"limit": 1000}).headers["ETag"] == before.headers["ETag"]
+
+    client.post(
+        "/products",
+        json={"name": "Cached Candy Cane", "description": "New", "price": 1.00, "quantity": 1},
+        headers=headers,
+    )
+    after = client.get("/products", params={"limit": 1000})
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert "Cached Candy Cane" in [p["name"] for p in after.json()]
+
+
+# --- 32. Redis-Compatible Backend Test ---
+def test_response_cache_with_redis_compatible_backend():
+    """Tests the cache works over a Redis-style client and versions out old entries."""
+    cache = response_cache.ResponseCache(response_cache.RedisBackend(FakeRedis()))
+    key = cache.key(cache.version(), "products?")
+    stored = cache.set(key, b'[{"id":1}]', {"X-Next-Cursor": "abc"})
+
+    assert cache.get(key) == stored
+    cache.bump_version()
+    assert cache.get(cache.key(cache.version(), "products?")) is None
+
+
+
+# =======================================================
+# --- Live Event Tests ---
+# =======================================================
+
+# --- 33. Purchase Publishes Stock Delta Test ---
+def test_purchase_publishes_stock_event(db_session: Session):
+    """Tests that a purchase pushes a compact stock delta to subscribers."""
+    product_id, token = create_stocked_product(db_session, "Live Liquorice", 5)
+
+    async def scenario():
+        subscriber = events.stock_events.subscribe()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, lambda: client.post(
+                f"/products/{product_id}/purchase",
+                json={"quantity": 2},
+                headers={"Authorization": f"Bearer {token}"},
+            ))
+            return await asyncio.wait_for(subscriber.queue.get(), timeout=5)
+        finally:
+            events.stock_events.unsubscribe(subscriber)
+
+    frame = asyncio.run(scenario()).decode()
+    assert "event: stock" in frame
+    data = json.loads(frame.split("data: ", 1)[1])
+    assert data == {"id": product_id, "quantity": 3}
+
+
+# --- 34. Slow Consumer Eviction Test ---
+def test_event_hub_evicts_slow_consumers():
+    """Tests that a subscriber whose queue fills up is dropped and its stream ends."""
+    hub = events.EventHub(queue_size=2)
+
+    async def scenario():
+        slow = hub.subscribe()
+        fast = hub.subscribe()
+        for quantity in range(3):
+            hub.publish("stock", {"id": 1, "quantity": quantity})
+            await fast.queue.get()
+        return slow, [frame async for frame in events.stream(hub, slow)]
+
+    slow, frames = asyncio.run(scenario())
+    assert slow.evicted
+    assert frames == [b"retry: 3000\n\n"]
+    assert hub.stats() == {"subscribers": 1, "published": 3, "evicted": 1}
+
+
+
+# =======================================================
+# --- Inventory Ledger Tests ---
+# =======================================================
+
+# --- 35. Point-in-Time Stock and Sales Report Test ---
+def test_ledger_rebuilds_past_stock_and_reports_sales(db_session: Session):
+    """Tests stock changes are ledgered, replayable at a past moment, and reported as sales."""
+    product_id, customer_token = create_stocked_product(db_session, "Ledger Lollipop", 10)
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    customer_headers = {"Authorization": f"Bearer {customer_token}"}
+    started = ledger.utcnow()
+
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=customer_headers)
+    after_purchase = ledger.utcnow()
+    # Snapshot halfway, so the later lookups combine a snapshot with a replay
+    assert client.post("/admin/ledger/compact", headers=seller_headers).json()["snapshots"] >= 1
+    client.post(f"/products/{product_id}/restock", json={"quantity": 5}, headers=seller_headers)
+    client.post("/checkout", json={"items": [{"product_id": product_id, "quantity": 2}]}, headers=customer_headers)
+
+    def stock(at):
+        response = client.get(f"/products/{product_id}/stock", params={"at": at.isoformat()}, headers=seller_headers)
+        return response.json()["quantity"]
+
+    assert stock(started) == 10
+    assert stock(after_purchase) == 7
+    assert stock(ledger.utcnow()) == 10
+    assert client.get(f"/products/{product_id}", headers=seller_headers).json()["quantity"] == 10
+
+    response = client.get("/reports/sales", params={"start": started.isoformat()}, headers=seller_headers)
+    assert response.status_code == 200
+    line = next(line for line in response.json() if line["product_id"] == product_id)
+    assert line == {"product_id": product_id, "name": "Ledger Lollipop", "units_sold": 5, "revenue": 5.0, "sales": 2}
+
+    # Reports and history are seller-only
+    assert client.get("/reports/sales", headers=customer_headers).status_code == 403
+
+
+
+# =======================================================
+# --- Sales Analytics Tests ---
+# =======================================================
+
+# --- 36. Analytics Endpoints Test ---
+def test_sales_analytics_follow_purchases(db_session: Session):
+    """Tests purchases feed per-product totals, hourly buckets and the bestseller list."""
+    product_id, customer_token = create_stocked_product(db_session, "Analytics Aniseed", 20)
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    customer_headers = {"Authorization": f"Bearer {customer_token}"}
+    hour_before = client.get("/analytics/sales", params={"periods": 1}, headers=seller_headers).json()[0]
+
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 4}, headers=customer_headers)
+    client.post("/checkout", json={"items": [{"product_id": product_id, "quantity": 6}]}, headers=customer_headers)
+
+    response = client.get(f"/analytics/products/{product_id}", headers=seller_headers)
+    assert response.json() == {"product_id": product_id, "units_sold": 10, "revenue": 10.0, "sales": 2}
+
+    series = client.get(
+        "/analytics/sales", params={"product_id": product_id, "periods": 3}, headers=seller_headers
+    ).json()
+    assert [bucket["units_sold"] for bucket in series][-1] == 10
+    hour_after = client.get("/analytics/sales", params={"periods": 1}, headers=seller_headers).json()[0]
+    if hour_after["start"] == hour_before["start"]:
+        assert hour_after["units_sold"] - hour_before["units_sold"] == 10
+
+    best = client.get("/analytics/bestsellers", params={"limit": 100}, headers=seller_headers).json()
+    assert {"product_id": product_id, "name": "Analytics Aniseed", "units_sold": 10, "revenue": 10.0, "sales": 2} in best
+
+    # Analytics are seller-only and bounded by what the rings keep
+    assert client.get("/analytics/bestsellers", headers=customer_headers).status_code == 403
+    assert client.get("/analytics/sales", params={"periods": 10000}, headers=seller_headers).status_code == 400
+
+# --- 37. Bucket Ring and Top-K Test ---
+def test_sales_aggregates_buckets_and_top_k():
+    """Tests old buckets expire from the ring and the top-K ranking breaks ties by id."""
+    aggregates = analytics.SalesAggregates(hourly_buckets=3, daily_buckets=2)
+    start = datetime(2024, 1, 1, 9, 30)
+    aggregates.record(1, 2, Decimal("1.50"), start)
+    aggregates.record(2, 5, Decimal("1.00"), start + timedelta(hours=1))
+    aggregates.record(3, 5, Decimal("2.00"), start + timedelta(hours=3))
+
+    hours = aggregates.series("hour", 3, now=start + timedelta(hours=3))
+    # 09:00 has been overwritten by 12:00 in the three-slot ring
+    assert [(bucket["start"].hour, bucket["units_sold"]) for bucket in hours] == [(10, 5), (11, 0), (12, 5)]
+    assert aggregates.series("day", 1, product_id=1, now=start)[0]["revenue"] == 3.0
+
+    assert [line["product_id"] for line in aggregates.top(2)] == [2, 3]
+    assert [line["product_id"] for line in aggregates.top(1, by="revenue")] == [3]
+
+    # A reused id starts from zero
+    aggregates.forget(3)
+    assert aggregates.totals(3) == {"product_id": 3, "units_sold": 0, "revenue": 0.0, "sales": 0}
+
+    # A seller's series is one ring of its own, however many products they sell
+    aggregates.forget(4, seller_id=7)
+    aggregates.forget(5, seller_id=7)
+    aggregates.record(4, 1, Decimal("1.00"), start + timedelta(hours=3))
+    aggregates.record(5, 2, Decimal("1.00"), start + timedelta(hours=3))
+    assert aggregates.series("hour", 1, seller_id=7, now=start + timedelta(hours=3))[0]["units_sold"] == 3
+    assert aggregates.series("hour", 1, seller_id=8, now=start + timedelta(hours=3))[0]["units_sold"] == 0
+
+
+
+# =======================================================
+# --- Metrics Tests ---
+# =======================================================
+
+# --- 38. Prometheus Metrics Test ---
+def test_metrics_report_route_latency_db_and_caches(db_session: Session):
+    """Tests requests show up in /metrics by route template, with DB and cache figures."""
+    product_id, token = create_stocked_product(db_session, "Metered Marshmallow", 5)
+    client.get(f"/products/{product_id}")
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 1}, headers={"Authorization": f"Bearer {token}"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    # Labelled by template, never by the concrete id
+    assert 'route="/products/{product_id}/purchase",status="200"' in body
+    assert f"/products/{product_id}" not in body
+    assert 'sweetshop_http_request_db_queries_count{route="/products/{product_id}/purchase"}' in body
+    assert 'sweetshop_db_query_duration_seconds_count{engine="write"}' in body
+    assert "sweetshop_jwt_decode_seconds_count" in body
+    assert 'sweetshop_password_kdf_seconds_count{operation="verify"}' in body
+    assert 'sweetshop_cache_hit_ratio{cache="principal"}' in body
+
+# --- 39. Opt-In Profiling Test ---
+def test_profiling_header_writes_profile(monkeypatch, tmp_path):
+    """Tests the X-Profile header captures a cProfile trace only with the right token."""
+    monkeypatch.setattr(metrics, "PROFILING_TOKEN", "let-me-profile")
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path))
+
+    response = client.get("/products", headers={"X-Profile": "wrong"})
+    assert "x-profile-file" not in response.headers
+
+    response = client.get("/products", headers={"X-Profile": "let-me-profile"})
+    assert response.status_code == 200
+    profile = tmp_path / response.headers["x-profile-file"]
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+
+
+# =======================================================
+# --- Rate Limiting and Admission Control Tests ---
+# =======================================================
+
+# --- 40. Login and Purchase Rate Limit Test ---
+def test_login_and_purchase_are_rate_limited(db_session: Session, monkeypatch):
+    """Tests token buckets refuse floods with 429 and Retry-After, per user."""
+    product_id, token = create_stocked_product(db_session, "Rationed Rhubarb", 50)
+    monkeypatch.setattr(ratelimit.limiter, "store", ratelimit.MemoryStore())
+    monkeypatch.setattr(ratelimit, "login_budgets", {
+        "ip": ratelimit.Budget.parse("100/60"),
+        "user": ratelimit.Budget.parse("2/60"),
+    })
+    monkeypatch.setattr(ratelimit, "purchase_budget", ratelimit.Budget.parse("3/60"))
+
+    wrong = {"username": "seller_user", "password": "not-the-password"}
+    assert [client.post("/token", data=wrong).status_code for _ in range(3)] == [401, 401, 429]
+    response = client.post("/token", data={"username": "seller_user", "password": "sellerpass42"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Another username has its own budget
+    assert client.post("/token", data={"username": "customer_user", "password": "customerpass42"}).status_code == 200
+
+    headers = {"Authorization": f"Bearer {token}"}
+    statuses = [
+        client.post(f"/products/{product_id}/purchase", json={"quantity": 1}, headers=headers).status_code
+        for _ in range(4)
+    ]
+    assert statuses == [200, 200, 200, 429]
+
+# --- 41. Token Bucket Refill Test ---
+def test_memory_store_refills_over_time():
+    """Tests a bucket refills at its rate and reports how long to wait."""
+    now = [0.0]
+    store = ratelimit.MemoryStore(timer=lambda: now[0])
+    budget = ratelimit.Budget.parse("2/10") # 2 at once, one more every 5s
+
+    assert [store.take("k", budget) for _ in range(2)] == [0.0, 0.0]
+    assert store.take("k", budget) == pytest.approx(5.0)
+    now[0] = 5.0
+    assert store.take("k", budget) == 0.0
+    assert store.take("other", budget) == 0.0
+
+# --- 42. Admission Control Test ---
+def test_admission_controller_sheds_on_queue_and_latency():
+    """Tests requests past the queue bound, or while p99 is too high, get 503."""
+    async def scenario():
+        controller = ratelimit.AdmissionController(
+            "test", max_concurrent=1, max_queue=1, p99_threshold=0.05, refresh=0
+        )
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        waiting = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert (controller.in_flight, controller.queued) == (1, 1)
+        with pytest.raises(HTTPException) as shed:
+            async with controller.slot():
+                pass
+        assert shed.value.status_code == 503 and shed.value.headers["Retry-After"] == "1"
+
+        # Both held requests were slow, so p99 now trips the latency guard
+        await asyncio.sleep(0.06)
+        release.set()
+        await asyncio.gather(running, waiting)
+        with pytest.raises(HTTPException) as shed:
+            async with controller.slot():
+                pass
+        assert shed.value.status_code == 503
+        assert controller.stats()["shed"] == 2
+
+    asyncio.run(scenario())
+
+
+
+# =======================================================
+# --- Idempotency Key Tests ---
+# =======================================================
+
+# --- 43. Purchase Replay Test ---
+def test_purchase_retry_with_idempotency_key_is_replayed(db_session: Session):
+    """Tests a retried purchase returns the first result without buying twice."""
+    product_id, token = create_stocked_product(db_session, "Retried Raspberry", 5)
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "order-123"}
+
+    first = client.post(f"/products/{product_id}/purchase", json={"quantity": 2}, headers=headers)
+    retry = client.post(f"/products/{product_id}/purchase", json={"quantity": 2}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json() == {**first.json(), "quantity": 3}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+    # Same key, different request
+    response = client.post(f"/products/{product_id}/purchase", json={"quantity": 1}, headers=headers)
+    assert response.status_code == 422
+
+    # Client errors are replayed too, without another stock check
+    headers["Idempotency-Key"] = "order-124"
+    assert client.post(f"/products/{product_id}/purchase", json={"quantity": 9}, headers=headers).status_code == 400
+    restock_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    client.post(f"/products/{product_id}/restock", json={"quantity": 10}, headers=restock_headers)
+    assert client.post(f"/products/{product_id}/purchase", json={"quantity": 9}, headers=headers).status_code == 400
+
+    db_session.expire_all()
+    remaining = db_session.query(models.Product.quantity).filter(models.Product.id == product_id).scalar()
+    assert remaining == 13
+
+# --- 44. Concurrent Duplicate Coalescing Test ---
+def test_idempotency_store_coalesces_concurrent_duplicates():
+    """Tests duplicates that arrive mid-flight wait for the first run instead of repeating it."""
+    async def scenario():
+        store = idempotency.IdempotencyStore()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"quantity": len(calls)}
+
+        responses = [Response() for _ in range(3)]
+        fingerprint = idempotency.fingerprint("purchase", 1, {"quantity": 1})
+        results = await asyncio.gather(*[
+            store.run("key", "user:1", fingerprint, response, work) for response in responses
+        ])
+        assert calls == [1]
+        assert results == [{"quantity": 1}] * 3
+        assert [r.headers.get("Idempotent-Replayed") for r in responses] == [None, "true", "true"]
+        assert store.stats()["coalesced"] == 2
+
+        # No key: every call runs
+        await store.run(None, "user:1", fingerprint, Response(), work)
+        assert calls == [1, 1]
+
+    asyncio.run(scenario())
+
+
+
+# =======================================================
+# --- Multi-Worker Deployment Tests ---
+# =======================================================
+
+# --- 45. Ledger Tailing Test ---
+def test_analytics_tailing_sees_other_workers_purchases(db_session: Session):
+    """Tests a tailing worker picks up purchases another worker made, via the ledger."""
+    product_id, token = create_stocked_product(db_session, "Tailed Treacle", 10)
+    other_worker = analytics.SalesAggregates(tailing=True)
+    other_worker.load(db_session)
+
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 4}, headers={"Authorization": f"Bearer {token}"})
+    # Tailing workers don't record their own traffic live: it arrives through the ledger
+    other_worker.record_entries([ledger.entry(product_id, -1, "purchase", unit_price=1.0)])
+    assert other_worker.totals(product_id)["units_sold"] == 0
+
+    db_session.expire_all()
+    assert other_worker.catch_up(db_session) >= 1
+    assert other_worker.totals(product_id) == {"product_id": product_id, "units_sold": 4, "revenue": 4.0, "sales": 1}
+    # Nothing new, nothing folded in twice
+    assert other_worker.catch_up(db_session) == 0
+
+# --- 46. Launcher Environment Test ---
+def test_serve_configures_workers_without_overriding(monkeypatch):
+    """Tests the launcher turns off per-worker migration and shares state through Redis."""
+    monkeypatch.delenv("AUTO_MIGRATE", raising=False)
+    monkeypatch.delenv("ANALYTICS_TAIL_SECONDS", raising=False)
+    monkeypatch.delenv("SEARCH_RELOAD_SECONDS", raising=False)
+    monkeypatch.setenv("SQLITE_PROFILE", "default")
+    args = argparse.Namespace(workers=4, redis_url="redis://cache:6379/0")
+
+    env = serve.worker_environment(args)
+    assert env["AUTO_MIGRATE"] == "0"
+    assert env["ANALYTICS_TAIL_SECONDS"] == "5"
+    assert env["SEARCH_RELOAD_SECONDS"] == "30"
+    assert env["RATE_LIMIT_BACKEND"] == env["RESPONSE_CACHE_BACKEND"] == "redis"
+    # Explicit settings win
+    assert "SQLITE_PROFILE" not in env
+
+    # Without Redis, a worker's cached pages would miss the others' writes
+    monkeypatch.delenv("RESPONSE_CACHE_BACKEND", raising=False)
+    env = serve.worker_environment(argparse.Namespace(workers=4, redis_url=None))
+    assert env["RESPONSE_CACHE_BACKEND"] == "off" and "RATE_LIMIT_BACKEND" not in env
+    assert "RESPONSE_CACHE_BACKEND" not in serve.worker_environment(argparse.Namespace(workers=1, redis_url=None))
+
+    # Flash sales keep their stock in one process
+    monkeypatch.setenv("FLASH_SALE_ENABLED", "1")
+    monkeypatch.setattr("sys.argv", ["serve", "--workers", "2"])
+    with pytest.raises(SystemExit):
+        serve.main()
+
+    # Pools a forked worker swaps in are still timed
+    serve._post_fork(None, None)
+    assert all(sync_engine.pool._metrics_timed for sync_engine in metrics._pools.values())
+    assert client.get("/products").status_code == 200
+
+
+# =======================================================
+# --- Serialization Tests ---
+# =======================================================
+
+# --- 47. Fast JSON Path Test ---
+def test_fast_json_matches_validated_output(db_session: Session, monkeypatch):
+    """Tests the unvalidated fast path sends the same products as the validated one."""
+    product_id, _ = create_stocked_product(db_session, "Squeezed Sherbet", 3)
+    cache = response_cache.catalogue_cache
+
+    validated = client.get(f"/products/{product_id}").json()
+    search_validated = client.get("/products/search", params={"query": "Squeezed"}).json()
+    monkeypatch.setattr(fastjson, "FAST_JSON", True)
+    cache.bump_version()
+    assert client.get(f"/products/{product_id}").json() == validated
+    assert client.get("/products/search", params={"query": "Squeezed"}).json() == search_validated
+    assert {"id": product_id, "name": "Squeezed Sherbet", "description": "Stock test", "price": 1.0, "quantity": 3} in search_validated
+
+# --- 48. Response Compression Test ---
+def test_large_catalogue_responses_are_compressed(db_session: Session, monkeypatch):
+    """Tests compression follows Accept-Encoding and keeps the uncompressed ETag."""
+    create_stocked_product(db_session, "Squeezed Sherbet", 3)
+    compressor = fastjson.Compressor(["gzip"], min_bytes=0)
+    monkeypatch.setattr(fastjson, "compressor", compressor)
+
+    plain = client.get("/products", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+
+    compressed = client.get("/products", headers={"Accept-Encoding": "gzip;q=0.5, br;q=0"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.json() == plain.json() # The client decompresses it
+    assert compressed.headers["ETag"] == plain.headers["ETag"]
+    # Compressed once per ETag, however often it is requested
+    client.get("/products", headers={"Accept-Encoding": "gzip"})
+    assert compressor.compressed == 1
+    assert fastjson.accepted_codings("gzip;q=0, br") == {"br"}
+
+
+# =======================================================
+# --- Pricing Tests ---
+# =======================================================
+
+# --- 49. Exact Price Arithmetic Test ---
+def test_prices_are_exact_and_limited_to_two_places(db_session: Session):
+    """Tests prices round-trip exactly and prices finer than 0.01 are rejected."""
+    assert money.to_minor_units(19.99) == 1999
+    assert money.from_minor_units(money.to_minor_units(0.1) + money.to_minor_units(0.2)) == Decimal("0.30")
+
+    seller_token = get_auth_token(*setup_seller_user(db_session))
+    response = client.post(
+        "/products",
+        json={"name": "Repriced Rock", "description": "Exact", "price": 1.005, "quantity": 10},
+        headers={"Authorization": f"Bearer {seller_token}"},
+    )
+    assert response.status_code == 422
+
+# --- 50. Bulk Repricing Test ---
+def test_bulk_reprice_filters_and_rounds(db_session: Session):
+    """Tests one repricing rule updates only matching products, rounding half up to 0.01."""
+    customer_token = get_auth_token(*setup_customer_user(db_session))
+    seller_token = get_auth_token(*setup_seller_user(db_session))
+    headers = {"Authorization": f"Bearer {seller_token}"}
+    for name, price, quantity in (("Repriced Rock", 1.00, 0), ("Repriced Rock Candy", 2.35, 5)):
+        client.post(
+            "/products",
+            json={"name": name, "description": "Stock test", "price": price, "quantity": quantity},
+            headers=headers,
+        )
+
+    def prices():
+        rows = client.get("/products/search", params={"query": "Repriced"}).json()
+        return {row["name"]: row["price"] for row in rows}
+
+    # Only the rock in stock: 2.35 * 1.125 = 2.64375, rounded to 2.64
+    response = client.post(
+        "/products/reprice",
+        json={"mode": "percent", "value": 12.5, "name_like": "repriced rock%", "min_quantity": 1},
+        headers=headers,
+    )
+    assert response.json() == {"updated": 1}
+    assert prices() == {"Repriced Rock": 1.0, "Repriced Rock Candy": 2.64}
+
+    # Cuts never go below 0.01, and customers can't reprice
+    client.post("/products/reprice", json={"mode": "amount", "value": -5, "name_like": "Repriced Rock%"}, headers=headers)
+    assert prices() == {"Repriced Rock": 0.01, "Repriced Rock Candy": 0.01}
+    forbidden = client.post(
+        "/products/reprice", json={"mode": "set", "value": 1}, headers={"Authorization": f"Bearer {customer_token}"}
+    )
+    assert forbidden.status_code == 403
+
+
+# =======================================================
+# --- Flash Sale Tests ---
+# =======================================================
+
+@pytest.fixture
+def hot_stock(db_session: Session, monkeypatch, tmp_path):
+    """A flash-sale state of its own, logging to a temporary write-ahead file."""
+    hot = flashsale.HotStock(str(tmp_path / "flash.wal"))
+    hot.recover(db_session)
+    monkeypatch.setattr(flashsale, "hot_stock", hot)
+    monkeypatch.setattr(flashsale, "FLASH_SALE_ENABLED", True)
+    yield hot
+    hot.close()
+
+def purchase_deltas(db: Session, product_id: int) -> list[int]:
+    """Purchases in the ledger since the product was created (SQLite reuses deleted ids)."""
+    db.expire_all()
+    events = models.InventoryEvent
+    created = db.query(events.id).filter(events.product_id == product_id, events.reason == "create").order_by(events.id.desc()).first()
+    return [
+        event.delta for event in db.query(events)
+        .filter(events.product_id == product_id, events.reason == "purchase", events.id > created.id)
+        .order_by(events.id)
+    ]
+
+# --- 51. Flash Sale Purchase and Write-Behind Test ---
+def test_flash_sale_sells_from_memory_and_writes_behind(db_session: Session, hot_stock):
+    """Tests hot purchases never oversell, reach the database on flush and block edits meanwhile."""
+    product_id, token = create_stocked_product(db_session, "Flashy Fudge", 5)
+    headers = {"Authorization": f"Bearer {token}"}
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+
+    response = client.put(f"/admin/flash-sale/{product_id}", headers=seller_headers)
+    assert response.status_code == 200
+    assert client.put(f"/admin/flash-sale/{product_id}", headers=headers).status_code == 403
+
+    response = client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 2
+    assert client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=headers).status_code == 400
+
+    # Acknowledged but not yet written behind
+    db_session.expire_all()
+    assert db_session.get(models.Product, product_id).quantity == 5
+    assert hot_stock.stats()["pending"] == 1
+
+    # Checkouts and restocks move the row and the counter together
+    response = client.post("/checkout", json={"items": [{"product_id": product_id, "quantity": 1}]}, headers=headers)
+    assert response.json()[0]["quantity"] == 1
+    response = client.post(f"/products/{product_id}/restock", json={"quantity": 4}, headers=seller_headers)
+    assert response.json()["quantity"] == 5
+
+    # Setting the quantity outright would lose the pending sales
+    update = client.put(
+        f"/products/{product_id}",
+        json={"name": "Flashy Fudge", "description": "Edited", "price": 1.00, "quantity": 50},
+        headers=seller_headers,
+    )
+    assert update.status_code == 409
+    # ...and so would an import, which is refused row by row
+    imported = client.post(
+        "/products/import",
+        content="name,description,price,quantity\nFlashy Fudge,Imported,1.00,0\n",
+        headers={**seller_headers, "Content-Type": "text/csv"},
+    ).json()
+    assert (imported["updated"], imported["failed"]) == (0, 1)
+    assert "flash sale" in imported["errors"][0]["error"]
+
+    # Ending the sale commits the pending purchase
+    assert client.delete(f"/admin/flash-sale/{product_id}", headers=seller_headers).status_code == 204
+    db_session.expire_all()
+    assert db_session.get(models.Product, product_id).quantity == 5
+    assert purchase_deltas(db_session, product_id) == [-1, -3]
+    assert hot_stock.stats()["pending"] == 0
+
+# --- 52. Flash Sale Crash Recovery Test ---
+def test_flash_sale_recovery_applies_logged_sales_once(db_session: Session, tmp_path):
+    """Tests sales left in the write-ahead file are committed on restart, exactly once."""
+    product_id, _ = create_stocked_product(db_session, "Flashy Fudge", 10)
+    user_id = db_session.query(models.User.id).filter(models.User.username == "customer_user").scalar()
+    wal_path = str(tmp_path / "crash.wal")
+    hot = flashsale.HotStock(wal_path)
+    hot.recover(db_session)
+    hot.products[product_id] = {"id": product_id, "name": "Flashy Fudge", "price": Decimal("1.00"), "quantity": 10}
+
+    assert hot.purchase(product_id, 2, user_id=user_id) is not None
+    assert hot.purchase(product_id, 3, user_id=user_id) is not None
+    # Crash after the batch committed but before the file was cleaned up...
+    flashsale.commit_sales(db_session, hot.stream, list(hot.pending))
+    # ...with one more sale acknowledged after it
+    assert hot.purchase(product_id, 4, user_id=user_id)["quantity"] == 1
+    hot.close()
+
+    restarted = flashsale.HotStock(wal_path)
+    assert restarted.recover(db_session) == 1
+    restarted.close()
+    db_session.expire_all()
+    assert db_session.get(models.Product, product_id).quantity == 1
+    assert purchase_deltas(db_session, product_id) == [-2, -3, -4]
+
+    # Nothing is left to replay
+    again = flashsale.HotStock(wal_path)
+    assert again.recover(db_session) == 0
+    again.close()
+
+
+# =======================================================
+# --- Cart Reservation Tests ---
+# =======================================================
+
+@pytest.fixture
+def holds(monkeypatch):
+    """An expiry schedule of its own, so tests can move its clock freely."""
+    schedule = reservations.Reservations(tick=1.0)
+    monkeypatch.setattr(reservations, "holds", schedule)
+    return schedule
+
+def availability(product_id: int) -> dict:
+    return client.get(f"/products/{product_id}/availability").json()
+
+# --- 53. Reserve, Confirm and Release Test ---
+def test_reservations_hold_stock_until_confirmed_or_released(db_session: Session, holds):
+    """Tests held units can't be bought by others, and confirm buys them while release hands them back."""
+    product_id, token = create_stocked_product(db_session, "Held Honeycomb", 5)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(f"/products/{product_id}/reserve", json={"quantity": 3}, headers=headers)
+    assert response.status_code == 201
+    first = response.json()
+    assert availability(product_id) == {"product_id": product_id, "quantity": 5, "reserved": 3, "available": 2}
+
+    # Purchases, checkouts and other holds only see the unheld stock
+    assert client.post(f"/products/{product_id}/purchase", json={"quantity": 3}, headers=headers).status_code == 400
+    checkout = client.post("/checkout", json={"items": [{"product_id": product_id, "quantity": 3}]}, headers=headers)
+    assert checkout.status_code == 400
+    assert client.post(f"/products/{product_id}/reserve", json={"quantity": 3}, headers=headers).status_code == 400
+    second = client.post(f"/products/{product_id}/reserve", json={"quantity": 2}, headers=headers).json()
+
+    response = client.post(f"/reservations/{first['id']}/confirm", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 2
+    assert client.post(f"/reservations/{first['id']}/confirm", headers=headers).status_code == 404
+
+    # Only the owner can release a hold
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    assert client.delete(f"/reservations/{second['id']}", headers=seller_headers).status_code == 404
+    assert client.delete(f"/reservations/{second['id']}", headers=headers).status_code == 204
+    assert availability(product_id) == {"product_id": product_id, "quantity": 2, "reserved": 0, "available": 2}
+    assert holds.stats() == {"scheduled": 0, "created": 2, "confirmed": 1, "released": 1, "expired": 0}
+
+# --- 54. Timing Wheel Expiry Test ---
+def test_expired_holds_are_released_by_the_timing_wheel(db_session: Session, holds):
+    """Tests holds expire on their tick, not before, and hand their units back."""
+    wheel = reservations.TimingWheel(tick=1.0, slots=8)
+    wheel.advance(100.0)
+    for key, when in (("soon", 101.5), ("later", 103.0), ("next lap", 111.0), ("cancelled", 102.0)):
+        wheel.schedule(key, when)
+    wheel.cancel("cancelled")
+    assert wheel.advance(101.9) == []
+    assert wheel.advance(103.0) == ["soon", "later"]
+    assert wheel.advance(110.0) == []
+    assert wheel.advance(200.0) == ["next lap"]
+    assert len(wheel) == 0
+
+    product_id, token = create_stocked_product(db_session, "Held Honeycomb", 5)
+    headers = {"Authorization": f"Bearer {token}"}
+    hold = client.post(f"/products/{product_id}/reserve", json={"quantity": 4, "ttl_seconds": 60}, headers=headers).json()
+    expires_at = datetime.fromisoformat(hold["expires_at"])
+
+    assert asyncio.run(holds.expire_due(expires_at - timedelta(seconds=2))) == 0
+    assert availability(product_id)["available"] == 1
+    assert asyncio.run(holds.expire_due(expires_at + timedelta(seconds=1))) == 4
+    assert availability(product_id)["available"] == 5
+    assert client.post(f"/reservations/{hold['id']}/confirm", headers=headers).status_code == 404
+
+
+# =======================================================
+# --- Background Job Tests ---
+# =======================================================
+
+def queued_jobs(db: Session, kind: str, since: datetime) -> list[dict]:
+    db.expire_all()
+    rows = db.query(models.Job).filter(models.Job.kind == kind, models.Job.created_at >= since).order_by(models.Job.id)
+    return [json.loads(row.payload) for row in rows]
+
+# --- 55. Low Stock Alert Test ---
+def test_low_stock_alert_fires_once_when_threshold_is_crossed(db_session: Session):
+    """Tests purchases queue receipts, and an alert only for the sale that crosses the threshold."""
+    since = ledger.utcnow()
+    product_id, token = create_stocked_product(db_session, "Low Stock Lozenge", 6)
+    headers = {"Authorization": f"Bearer {token}"}
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    client.put(
+        f"/products/{product_id}",
+        json={"name": "Low Stock Lozenge", "description": "Alerts", "price": 1.00, "quantity": 6, "low_stock_threshold": 2},
+        headers=seller_headers,
+    )
+
+    for quantity in (3, 1, 1):
+        assert client.post(f"/products/{product_id}/purchase", json={"quantity": quantity}, headers=headers).status_code == 200
+    alerts = [alert for alert in queued_jobs(db_session, "low_stock_alert", since) if alert["product_id"] == product_id]
+    assert alerts == [{"product_id": product_id, "name": "Low Stock Lozenge", "quantity": 2, "threshold": 2}]
+
+    # Restocking above the threshold re-arms it; a checkout can cross it too
+    client.post(f"/products/{product_id}/restock", json={"quantity": 4}, headers=seller_headers)
+    client.post("/checkout", json={"items": [{"product_id": product_id, "quantity": 4}]}, headers=headers)
+    alerts = [alert for alert in queued_jobs(db_session, "low_stock_alert", since) if alert["product_id"] == product_id]
+    assert [alert["quantity"] for alert in alerts] == [2, 1]
+
+    receipts = [r for r in queued_jobs(db_session, "purchase_receipt", since) if r["lines"][0]["product_id"] == product_id]
+    assert [r["lines"][0]["quantity"] for r in receipts] == [3, 1, 1, 4]
+    assert receipts[-1]["total"] == "4.00"
+
+    # Held units don't count as stock: the sale that takes the available units down alerts
+    client.post(f"/products/{product_id}/restock", json={"quantity": 9}, headers=seller_headers)
+    client.post(f"/products/{product_id}/reserve", json={"quantity": 6}, headers=headers)
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 2}, headers=headers)
+    alerts = [alert for alert in queued_jobs(db_session, "low_stock_alert", since) if alert["product_id"] == product_id]
+    assert [alert["quantity"] for alert in alerts] == [2, 1, 2]
+
+    # The worker pool runs them later, deleting each job that succeeds
+    runner = jobs.JobRunner(workers=0)
+    assert asyncio.run(runner.drain()) >= 6
+    assert queued_jobs(db_session, "low_stock_alert", since) == []
+
+# --- 56. Job Retry and Failure Test ---
+def test_failing_jobs_are_retried_then_kept_as_failed(db_session: Session, monkeypatch):
+    """Tests a failing handler is retried with backoff and the job is kept once attempts run out."""
+    runner = jobs.JobRunner(workers=0)
+    asyncio.run(runner.drain()) # Jobs queued by earlier tests
+
+    calls = []
+
+    async def flaky_receipt(payload):
+        calls.append(payload["user_id"])
+        raise jobs.JobFailed("Receipt service unavailable")
+
+    monkeypatch.setitem(jobs.HANDLERS, "purchase_receipt", flaky_receipt)
+    monkeypatch.setattr(jobs, "JOBS_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(jobs, "JOBS_BACKOFF_SECONDS", 0.0)
+    assert jobs.backoff(10) == 0.0
+
+    db_session.execute(jobs.INSERT_JOBS, [jobs.job("purchase_receipt", {"user_id": -56, "lines": [], "total": 0})])
+    db_session.commit()
+    asyncio.run(runner.drain())
+
+    assert calls == [-56, -56, -56]
+    assert runner.stats() == {"workers": 0, "done": 0, "retried": 2, "failed": 1}
+    db_session.expire_all()
+    failed = db_session.query(models.Job).filter(models.Job.status == "failed").order_by(models.Job.id.desc()).first()
+    assert failed.attempts == 3
+    assert failed.last_error == "JobFailed: Receipt service unavailable"
+    db_session.delete(failed)
+    db_session.commit()
+
+
+# =======================================================
+# --- Order History Tests ---
+# =======================================================
+
+def order_history(headers: dict, limit: int = 100) -> list[list[dict]]:
+    """Every page of the caller's orders."""
+    pages, params = [], {"limit": limit}
+    while True:
+        response = client.get("/orders", params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json())
+        if "x-next-cursor" not in response.headers:
+            return pages
+        params["cursor"] = response.headers["x-next-cursor"]
+
+# --- 57. Orders Recorded With Sales Test ---
+def test_purchases_and_checkouts_record_orders(db_session: Session):
+    """Tests each purchase path records an order with its lines, visible only to its customer."""
+    since = ledger.utcnow()
+    product_id, token = create_stocked_product(db_session, "Ordered Orange Cream", 10)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 2}, headers=headers)
+    cart = [{"product_id": product_id, "quantity": 1}, {"product_id": product_id, "quantity": 2}]
+    client.post("/checkout", json={"items": cart}, headers=headers)
+    hold = client.post(f"/products/{product_id}/reserve", json={"quantity": 4}, headers=headers).json()
+    client.post(f"/reservations/{hold['id']}/confirm", headers=headers)
+    # A failed purchase records nothing
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 5}, headers=headers)
+
+    mine = [
+        order for order in order_history(headers)[0]
+        if datetime.fromisoformat(order["created_at"]) >= since and order["lines"][0]["product_id"] == product_id
+    ]
+    assert [order["lines"] for order in mine] == [
+        [{"product_id": product_id, "name": "Ordered Orange Cream", "quantity": n, "unit_price": 1.0}] for n in (4, 3, 2)
+    ]
+    assert [order["total"] for order in mine] == [4.0, 3.0, 2.0]
+
+    order_id = mine[0]["id"]
+    assert client.get(f"/orders/{order_id}", headers=headers).json() == mine[0]
+    seller_headers = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    assert client.get(f"/orders/{order_id}", headers=seller_headers).status_code == 404
+    assert client.get("/orders").status_code == 401
+
+# --- 58. Order History Pagination Test ---
+def test_order_history_pages_are_keyset_paginated(db_session: Session):
+    """Tests paging through many orders returns each once, newest first."""
+    since = ledger.utcnow()
+    product_id, token = create_stocked_product(db_session, "Ordered Orange Cream", 100)
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(25):
+        client.post(f"/products/{product_id}/purchase", json={"quantity": 1}, headers=headers)
+
+    pages = order_history(headers, limit=10)
+    orders = [order for page in pages for order in page]
+    assert all(len(page) <= 10 for page in pages)
+    assert len({order["id"] for order in orders}) == len(orders)
+    keys = [(order["created_at"], order["id"]) for order in orders]
+    assert keys == sorted(keys, reverse=True)
+    recent = [order for order in orders if datetime.fromisoformat(order["created_at"]) >= since]
+    assert len(recent) == 25
+
+    assert client.get("/orders", params={"cursor": "not-a-cursor"}, headers=headers).status_code == 400
+
+
+# =======================================================
+# --- Seller Catalogue Tests ---
+# =======================================================
+
+def setup_other_seller(db: Session) -> dict:
+    """Registers a second seller with an empty catalogue; returns their auth headers."""
+    username, password = "other_seller", "otherpass42"
+    previous = db.query(models.User.id).filter(models.User.username == username).scalar()
+    if previous is not None:
+        db.query(models.Product).filter(models.Product.seller_id == previous).delete(synchronize_session=False)
+        db.query(models.User).filter(models.User.id == previous).delete()
+        db.commit()
+    client.post("/register", json={"username": username, "email": "other@example.com", "password": password, "role": "seller"})
+    return {"Authorization": f"Bearer {get_auth_token(username, password)}"}
+
+# --- 59. Seller Ownership Test ---
+def test_sellers_only_change_their_own_products(db_session: Session):
+    """Tests another seller's product looks missing to writes, and names are unique per seller."""
+    product_id, _ = create_stocked_product(db_session, "Partitioned Praline", 10)
+    owner = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    other = setup_other_seller(db_session)
+    praline = {"name": "Partitioned Praline", "description": "Theirs", "price": 2.0, "quantity": 3}
+
+    assert client.put(f"/products/{product_id}", json=praline, headers=other).status_code == 404
+    assert client.delete(f"/products/{product_id}", headers=other).status_code == 404
+    assert client.post(f"/products/{product_id}/restock", json={"quantity": 5}, headers=other).status_code == 404
+    assert client.post("/products/reprice", json={"mode": "set", "value": 9}, headers=other).json() == {"updated": 0}
+
+    # The same name is free in another catalogue, not in the owner's
+    response = client.post("/products", json=praline, headers=other)
+    assert response.status_code == 201 and response.json()["id"] != product_id
+    assert client.post("/products", json=praline, headers=owner).status_code == 400
+
+    db_session.expire_all()
+    product = db_session.get(models.Product, product_id)
+    owner_id = db_session.query(models.User.id).filter(models.User.username == "seller_user").scalar()
+    assert (product.quantity, product.price, product.seller_id) == (10, Decimal("1.00"), owner_id)
+
+    # Databases older than ownership get the seller from the product's create event
+    product.seller_id = None
+    db_session.commit()
+    assert sellers.assign_owners(db_session)["attributed"] >= 1
+    db_session.refresh(product)
+    assert product.seller_id == owner_id
+
+# --- 60. Seller Catalogue and Dashboard Test ---
+def test_seller_catalogue_pages_and_dashboard(db_session: Session):
+    """Tests a seller pages through and sums up their own products and nobody else's."""
+    _, customer_token = create_stocked_product(db_session, "Partitioned Praline", 10)
+    customer = {"Authorization": f"Bearer {customer_token}"}
+    other = setup_other_seller(db_session)
+    ids = {}
+    for name, quantity, threshold in (("Dashboard Dragee", 0, None), ("Dashboard Jelly", 8, 5), ("Dashboard Nougat", 20, None)):
+        product = {"name": name, "description": "Dashboard", "price": 2.0, "quantity": quantity, "low_stock_threshold": threshold}
+        ids[name] = client.post("/products", json=product, headers=other).json()["id"]
+    client.post(f"/products/{ids['Dashboard Jelly']}/purchase", json={"quantity": 3}, headers=customer)
+
+    first = client.get("/sellers/me/products", params={"limit": 2, "sort": "-name"}, headers=other)
+    assert [p["name"] for p in first.json()] == ["Dashboard Nougat", "Dashboard Jelly"]
+    rest = client.get(
+        "/sellers/me/products", params={"limit": 2, "sort": "-name", "cursor": first.headers["x-next-cursor"]}, headers=other
+    )
+    assert [p["name"] for p in rest.json()] == ["Dashboard Dragee"]
+    assert "x-next-cursor" not in rest.headers
+
+    assert client.get("/sellers/me/dashboard", headers=other).json() == {
+        "products": 3,
+        "units_in_stock": 25,
+        "units_reserved": 0,
+        "out_of_stock": 1,
+        "low_stock": 1,
+        "units_sold": 3,
+        "revenue": 6.0,
+        "sales": 1,
+    }
+    assert client.get("/sellers/me/dashboard", headers=customer).status_code == 403
+
+# --- 61. Seller-Scoped Analytics Test ---
+def test_sellers_only_see_their_own_sales(db_session: Session):
+    """Tests sales analytics, reports and stock history cover only the caller's own sweets."""
+    product_id, customer_token = create_stocked_product(db_session, "Private Pastille", 10)
+    owner = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    other = setup_other_seller(db_session)
+    started = ledger.utcnow()
+    client.post(f"/products/{product_id}/purchase", json={"quantity": 2}, headers={"Authorization": f"Bearer {customer_token}"})
+
+    # Another seller's sweet looks missing
+    assert client.get(f"/analytics/products/{product_id}", headers=other).status_code == 404
+    assert client.get("/analytics/sales", params={"product_id": product_id}, headers=other).status_code == 404
+    assert client.get(f"/products/{product_id}/stock", headers=other).status_code == 404
+    # And the aggregates leave it out
+    assert client.get("/analytics/bestsellers", headers=other).json() == []
+    assert client.get("/reports/sales", params={"start": started.isoformat()}, headers=other).json() == []
+    assert all(bucket["units_sold"] == 0 for bucket in client.get("/analytics/sales", headers=other).json())
+
+    assert client.get(f"/analytics/products/{product_id}", headers=owner).json()["units_sold"] == 2
+    assert product_id in [line["product_id"] for line in client.get("/analytics/bestsellers", params={"limit": 100}, headers=owner).json()]
+    assert sum(bucket["units_sold"] for bucket in client.get("/analytics/sales", params={"periods": 2}, headers=owner).json()) >= 2
+
+# --- 62. Delete While Held Test ---
+def test_deleting_a_held_product_drops_its_holds(db_session: Session, holds):
+    """Tests a deleted product's holds go with it, so a product reusing its id keeps its stock."""
+    product_id, token = create_stocked_product(db_session, "Doomed Divinity", 10)
+    seller = {"Authorization": f"Bearer {get_auth_token('seller_user', 'sellerpass42')}"}
+    hold = client.post(f"/products/{product_id}/reserve", json={"quantity": 5}, headers={"Authorization": f"Bearer {token}"}).json()
+
+    assert client.delete(f"/products/{product_id}", headers=seller).status_code == 204
+    assert holds.stats()["scheduled"] == 0
+    assert db_session.query(models.StockHold).filter(models.StockHold.id == hold["id"]).count() == 0
+
+    successor = {"name": "Successor Sundae", "description": "Stock test", "price": 1.0, "quantity": 3}
+    new_id = client.post("/products", json=successor, headers=seller).json()["id"]
+    assert asyncio.run(holds.expire_due(datetime.fromisoformat(hold["expires_at"]) + timedelta(seconds=1))) == 0
+    # A stray release can't take the reserved count below zero either
+    db_session.add(models.StockHold(product_id=new_id, user_id=1, quantity=5, expires_at=ledger.utcnow()))
+    db_session.commit()
+    stray = db_session.query(models.StockHold.id).filter(models.StockHold.product_id == new_id).scalar()
+    reservations.release_holds(db_session, [stray])
+    db_session.commit()
+    assert availability(new_id) == {"product_id": new_id, "quantity": 3, "reserved": 0, "available": 3}
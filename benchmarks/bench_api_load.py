@@ -0,0 +1,420 @@
+"""Mixed-workload load test for the whole API.
+
+Seeds a catalogue and a user base into a throwaway SQLite database (never
+sweet_shop.db), then drives a weighted mix of browse, product detail, search,
+login, purchase, hot-product purchase and restock requests from concurrent
+virtual users for a fixed duration. Each virtual user waits for its response
+before sending the next request (closed loop).
+
+The API is exercised either in-process through httpx's ASGI transport, which
+isolates the application from network and server overhead, or through a local
+uvicorn server, which measures what a client would see. The report is JSON
+with p50/p95/p99 latency and throughput per operation, plus the commit it ran
+against, so two runs can be compared. Rate limits and p99 load shedding are
+off unless --keep-limits is given; requests they refuse (429/503) are counted
+as "rejected", apart from errors and latency:
+
+    python -m benchmarks.bench_api_load --products 100000 --users 1000 --output before.json
+    python -m benchmarks.bench_api_load --target uvicorn --concurrency 64 --compare before.json
+
+Like bench_sqlite_wal, the measurement runs in a subprocess because
+backend.database reads its configuration from the environment at import time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TARGETS = ("asgi", "uvicorn")
+DEFAULT_MIX = "browse=40,detail=15,search=15,login=2,purchase=15,purchase_hot=8,restock=5"
+PASSWORD = "benchmark-password-42"
+SEARCH_TERMS = ("choc", "fudge", "lemon", "mint", "toffee", "caramel", "sherbet", "liquorice", "nougat", "truffle")
+SEED_CHUNK = 20000
+# Refusals by rate limiting and load shedding, counted apart from latency
+REJECTED_STATUSES = (429, 503)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Seeding ---
+
+def seed(products: int, users: int) -> None:
+    """Bulk-inserts the users and the catalogue, bypassing the API."""
+    from sqlalchemy import insert, select
+
+    from backend import auth, database, ledger, models
+
+    database.create_db_and_tables()
+    with database.SessionLocal() as db:
+        # One hash shared by every user: hashing each one would dominate seeding
+        hashed = auth.get_password_hash(PASSWORD)
+        db.execute(
+            insert(models.User.__table__),
+            [
+                {"username": "bench_seller", "email": "bench_seller@example.com", "hashed_password": hashed, "role": "seller"},
+                *(
+                    {"username": f"bench_user_{i}", "email": f"bench_user_{i}@example.com", "hashed_password": hashed, "role": "customer"}
+                    for i in range(users)
+                ),
+            ],
+        )
+        # Every product belongs to bench_seller, so its restocks pass the ownership check
+        seller_id = db.scalar(select(models.User.id).where(models.User.username == "bench_seller"))
+        for start in range(0, products, SEED_CHUNK):
+            db.execute(
+                insert(models.Product.__table__),
+                [
+                    {
+                        "name": f"Bench {SEARCH_TERMS[i % len(SEARCH_TERMS)]} sweet {i}",
+                        "description": f"Benchmark {SEARCH_TERMS[(i * 7) % len(SEARCH_TERMS)]} treat",
+                        "price": 1.0 + i % 50,
+                        # Enough stock that purchases never run out mid-run
+                        "quantity": 10**9,
+                        "seller_id": seller_id,
+                    }
+                    for i in range(start, min(products, start + SEED_CHUNK))
+                ],
+            )
+        db.commit()
+        ledger.record_opening_balances(db)
+
+
+# --- Operations ---
+# Each takes (client, state, rng) and returns the response
+
+async def op_browse(client, state, rng):
+    params = {"limit": 20}
+    cursor = state.random_cursor(rng)
+    if cursor:
+        params["cursor"] = cursor
+    return await client.get("/products", params=params)
+
+
+async def op_detail(client, state, rng):
+    return await client.get(f"/products/{rng.randint(1, state.products)}")
+
+
+async def op_search(client, state, rng):
+    return await client.get("/products/search", params={"query": rng.choice(SEARCH_TERMS), "limit": 20})
+
+
+async def op_login(client, state, rng):
+    username = f"bench_user_{rng.randrange(state.users)}"
+    return await client.post("/token", data={"username": username, "password": PASSWORD})
+
+
+async def op_purchase(client, state, rng):
+    return await client.post(
+        f"/products/{rng.randint(1, state.products)}/purchase",
+        json={"quantity": 1},
+        headers=state.customer_headers(rng),
+    )
+
+
+async def op_purchase_hot(client, state, rng):
+    # Every virtual user fights over the same few rows
+    return await client.post(
+        f"/products/{rng.randint(1, state.hot_products)}/purchase",
+        json={"quantity": 1},
+        headers=state.customer_headers(rng),
+    )
+
+
+async def op_restock(client, state, rng):
+    return await client.post(
+        f"/products/{rng.randint(1, state.products)}/restock",
+        json={"quantity": 5},
+        headers=state.seller_headers,
+    )
+
+
+OPERATIONS = {
+    "browse": op_browse,
+    "detail": op_detail,
+    "search": op_search,
+    "login": op_login,
+    "purchase": op_purchase,
+    "purchase_hot": op_purchase_hot,
+    "restock": op_restock,
+}
+
+
+class WorkloadState:
+    def __init__(self, products: int, users: int, hot_products: int):
+        self.products = products
+        self.users = users
+        self.hot_products = max(1, min(hot_products, products))
+        self.customer_tokens: list[str] = []
+        self.seller_headers: dict[str, str] = {}
+        # Keyset cursors are opaque, so browsing reuses ones seen earlier in the run
+        self.cursors: list[str] = []
+
+    def random_cursor(self, rng) -> str | None:
+        if self.cursors and rng.random() < 0.8:
+            return rng.choice(self.cursors)
+        return None
+
+    def customer_headers(self, rng) -> dict[str, str]:
+        return {"Authorization": f"Bearer {rng.choice(self.customer_tokens)}"}
+
+
+async def _login(client, username: str) -> str:
+    response = await client.post("/token", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def drive(client, args) -> dict:
+    state = WorkloadState(args.products, args.users, args.hot_products)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+
+    # Log the virtual users in up front, so "login" in the mix is the only KDF cost
+    state.seller_headers = {"Authorization": f"Bearer {await _login(client, 'bench_seller')}"}
+    state.customer_tokens = [
+        await _login(client, f"bench_user_{i}") for i in range(min(args.concurrency, args.users))
+    ]
+
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors: dict[str, int] = {name: 0 for name in names}
+    rejected: dict[str, int] = {name: 0 for name in names}
+
+    async def user(index: int, deadline: float, record: bool):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status_code = None
+            try:
+                response = await OPERATIONS[name](client, state, rng)
+                status_code = response.status_code
+                if name == "browse" and "x-next-cursor" in response.headers and len(state.cursors) < 10000:
+                    state.cursors.append(response.headers["x-next-cursor"])
+            except Exception:
+                pass
+            if record:
+                if status_code is not None and status_code < 400:
+                    latencies[name].append(time.perf_counter() - started)
+                elif status_code in REJECTED_STATUSES:
+                    rejected[name] += 1
+                else:
+                    errors[name] += 1
+
+    # Warm-up fills caches and the search index without being measured
+    if args.warmup > 0:
+        deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*[user(i, deadline, False) for i in range(args.concurrency)])
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*[user(i, deadline, True) for i in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    for name in names:
+        values = latencies[name]
+        operations[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "rejected": rejected[name],
+            "per_sec": round(len(values) / elapsed, 1),
+            "p50_ms": round(statistics.median(values) * 1000, 2) if values else None,
+            "p95_ms": round(_percentile(values, 95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 99) * 1000, 2),
+        }
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "seconds": round(elapsed, 2),
+        "requests": len(everything),
+        "errors": sum(errors.values()),
+        "rejected": sum(rejected.values()),
+        "per_sec": round(len(everything) / elapsed, 1),
+        "p50_ms": round(statistics.median(everything) * 1000, 2) if everything else None,
+        "p95_ms": round(_percentile(everything, 95) * 1000, 2),
+        "p99_ms": round(_percentile(everything, 99) * 1000, 2),
+        "operations": operations,
+    }
+
+
+# --- Targets ---
+
+async def run_asgi(args) -> dict:
+    import httpx
+
+    from backend.main import app
+
+    # httpx's ASGI transport doesn't send lifespan events, so run them here
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await drive(client, args)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(args) -> dict:
+    import httpx
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "backend.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(args.workers), "--log-level", "warning",
+        ],
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            for _ in range(300):
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            return await drive(client, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def child(args) -> dict:
+    started = time.perf_counter()
+    seed(args.products, args.users)
+    seed_seconds = time.perf_counter() - started
+    runner = run_asgi if args.target == "asgi" else run_uvicorn
+    result = asyncio.run(runner(args))
+    return {
+        "benchmark": "api_load",
+        "commit": git_commit(),
+        "target": args.target,
+        "python": platform.python_version(),
+        "config": {
+            "products": args.products,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "hot_products": args.hot_products,
+            "workers": args.workers if args.target == "uvicorn" else None,
+            "mix": parse_mix(args.mix),
+            "seed": args.seed,
+            "database": os.environ.get("DATABASE_URL"),
+            "sqlite_profile": os.environ.get("SQLITE_PROFILE", "default"),
+            "rate_limits": os.environ.get("RATE_LIMIT_BACKEND", "memory"),
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        **result,
+    }
+
+
+# --- Comparison ---
+
+def compare(baseline: dict, current: dict) -> list[str]:
+    """One line per operation with the change in p95 latency and throughput."""
+    lines = [f"baseline {baseline.get('commit')} -> current {current.get('commit')}"]
+    for name, now in current["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before["requests"] or not now["requests"]:
+            continue
+        p95 = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        rate = (now["per_sec"] - before["per_sec"]) / before["per_sec"] * 100 if before["per_sec"] else 0.0
+        lines.append(f"{name:>13}: p95 {before['p95_ms']} -> {now['p95_ms']} ms ({p95:+.1f}%), "
+                     f"{before['per_sec']} -> {now['per_sec']} req/s ({rate:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API with a mixed workload")
+    parser.add_argument("--target", choices=TARGETS, default="asgi")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted operations (default: {DEFAULT_MIX})")
+    parser.add_argument("--hot-products", type=int, default=5, help="Products hit by purchase_hot")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite-profile", default="production")
+    parser.add_argument(
+        "--keep-limits", action="store_true",
+        help="Leave rate limits and p99 load shedding on (off by default, so they don't skew latency)",
+    )
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--compare", help="A previous JSON report to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    parse_mix(args.mix) # Fail fast on a bad mix
+    if args.products < 1 or args.users < 1:
+        parser.error("--products and --users must be at least 1")
+
+    if args.child:
+        print(json.dumps(child(args)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            SQLITE_PROFILE=args.sqlite_profile,
+            # Don't leave compactions or profiles running in the background of a run
+            LEDGER_COMPACT_INTERVAL_SECONDS="0",
+            PROFILING_TOKEN="",
+        )
+        if not args.keep_limits:
+            # A few virtual users would use up the per-user budgets within seconds
+            env.update(RATE_LIMIT_BACKEND="off", ADMISSION_LOGIN_P99_SECONDS="0", ADMISSION_PURCHASE_P99_SECONDS="0")
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_api_load", "--child", *sys.argv[1:]],
+            env=env, stdout=subprocess.PIPE, text=True, check=True,
+        )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2), flush=True)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            print("\n".join(compare(json.load(baseline), report)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
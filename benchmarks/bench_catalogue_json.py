@@ -0,0 +1,173 @@
+"""Cost of turning a 10k-product catalogue into a response body.
+
+Two measurements:
+
+* encode: the serialization step alone, on 10k product rows, for each way
+  the API can do it - FastAPI's response_model path (validate ORM objects,
+  jsonable_encoder, stdlib json), the validated TypeAdapter path (default),
+  the FAST_JSON path (rows encoded as-is, with orjson if installed), and
+  gzip/brotli on the result.
+* listing: GET /products end to end through the ASGI app, paging through the
+  whole catalogue with the response cache off, once with FAST_JSON=0 and once
+  with FAST_JSON=1. Each setting runs in a fresh interpreter because the
+  backend reads its settings at import time.
+
+    python -m benchmarks.bench_catalogue_json --products 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+
+def _rows(count: int) -> list[dict]:
+    return [
+        {
+            "id": i,
+            "name": f"Benchmark Bonbon {i}",
+            "description": "A sweet made for measuring serializers, with a longer description than most.",
+            "price": Decimal(50 + (i % 400) * 5).scaleb(-2),
+            "quantity": i % 250,
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def _timed(fn, repeat: int) -> tuple[float, object]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def bench_encode(count: int, repeat: int) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from backend import fastjson, schemas
+
+    adapter = TypeAdapter(list[schemas.Product]) # As built by backend.main
+
+    rows = _rows(count)
+    orm_like = [SimpleNamespace(**row) for row in rows]
+
+    def response_model():
+        products = [schemas.Product.model_validate(obj) for obj in orm_like]
+        return fastjson.dumps_stdlib(jsonable_encoder(products))
+
+    strategies = {
+        "response_model": response_model,
+        "type_adapter": lambda: adapter.dump_json(adapter.validate_python(rows)),
+        "fast_json": lambda: fastjson.dumps(rows),
+    }
+    report = {"products": count, "encoder": "orjson" if fastjson.orjson else "stdlib", "encode": {}}
+    body = b""
+    for name, fn in strategies.items():
+        seconds, body = _timed(fn, repeat)
+        report["encode"][name] = {"median_ms": round(seconds * 1000, 2), "bytes": len(body)}
+    baseline = report["encode"]["response_model"]["median_ms"]
+    for result in report["encode"].values():
+        result["speedup"] = round(baseline / result["median_ms"], 1)
+
+    codings = {"gzip": fastjson._compress_gzip}
+    if fastjson.brotli is not None:
+        codings["br"] = fastjson._compress_brotli
+    report["compress"] = {}
+    for name, fn in codings.items():
+        seconds, compressed = _timed(lambda: fn(body), repeat)
+        report["compress"][name] = {
+            "median_ms": round(seconds * 1000, 2),
+            "bytes": len(compressed),
+            "ratio": round(len(compressed) / len(body), 3),
+        }
+    return report
+
+
+def _child(count: int, repeat: int) -> dict:
+    import httpx
+    from sqlalchemy import insert
+
+    from backend import models
+    from backend.database import engine
+    from backend.main import app
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [{k: v for k, v in row.items() if k != "id"} for row in _rows(count)])
+
+    async def listing(http) -> int:
+        received, cursor = 0, None
+        while True:
+            params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+            response = await http.get("/products", params=params)
+            response.raise_for_status()
+            received += len(response.content)
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                return received
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            await listing(http) # Warm up connections and statement caches
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                received = await listing(http)
+                timings.append(time.perf_counter() - started)
+        return {"median_ms": round(statistics.median(timings) * 1000, 2), "bytes": received}
+
+    return asyncio.run(run())
+
+
+def bench_listing(count: int, repeat: int) -> dict:
+    report = {}
+    for fast in ("0", "1"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                FAST_JSON=fast,
+                RESPONSE_CACHE_BACKEND="off",
+                RESPONSE_COMPRESSION="off",
+                METRICS_ENABLED="0",
+                LEDGER_COMPACT_INTERVAL_SECONDS="0",
+            )
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_catalogue_json", "--child",
+                 "--products", str(count), "--repeat", str(repeat)],
+                env=env, capture_output=True, text=True, check=True,
+            )
+        report["fast_json" if fast == "1" else "type_adapter"] = json.loads(child.stdout.strip().splitlines()[-1])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure catalogue serialization cost")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-listing", action="store_true", help="Only time the serializers")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.products, args.repeat)))
+        return
+
+    report = bench_encode(args.products, args.repeat)
+    if not args.skip_listing:
+        report["listing"] = bench_listing(args.products, args.repeat)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Purchases of a single hot product: row updates against flash-sale mode.
+
+Seeds one product into a throwaway SQLite database, then sends --purchases
+single-unit purchases for it from --concurrency concurrent clients through
+httpx's ASGI transport, first as ordinary purchases (one conditional UPDATE
+and commit each) and then with the product in a flash sale (in-memory
+counter, write-ahead file, group commits). Authentication is overridden with
+a fixed principal, so the run measures the stock path and not token checks.
+Each mode runs in its own child interpreter, because the backend reads its
+settings at import time.
+
+    python -m benchmarks.bench_flash_sale --purchases 20000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("rows", "flash_sale")
+
+
+async def _drive(args) -> dict:
+    import httpx
+    from sqlalchemy import insert
+
+    from backend import auth, database, flashsale, models
+    from backend.main import app
+
+    with database.SessionLocal() as db:
+        product_id = db.execute(insert(models.Product).values(
+            name="Flash Sale Fondant", description="Benchmark", price=1, quantity=args.purchases,
+        )).inserted_primary_key[0]
+        db.commit()
+
+    principal = auth.Principal(id=1, username="bench_seller", email="bench@example.com", role="seller", is_active=True)
+    app.dependency_overrides[auth.get_current_user] = lambda: principal
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            if args.mode == "flash_sale":
+                (await client.put(f"/admin/flash-sale/{product_id}")).raise_for_status()
+
+            remaining = iter(range(args.purchases))
+            failed = 0
+
+            async def buyer():
+                nonlocal failed
+                for _ in remaining:
+                    response = await client.post(f"/products/{product_id}/purchase", json={"quantity": 1})
+                    failed += response.status_code != 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*[buyer() for _ in range(args.concurrency)])
+            elapsed = time.perf_counter() - started
+
+            if args.mode == "flash_sale":
+                (await client.delete(f"/admin/flash-sale/{product_id}")).raise_for_status()
+            stats = flashsale.hot_stock.stats()
+
+    with database.SessionLocal() as db:
+        left = db.get(models.Product, product_id).quantity
+    return {
+        "purchases": args.purchases,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "per_sec": round((args.purchases - failed) / elapsed, 1),
+        "quantity_left": left,
+        "flushes": stats["flushes"],
+        "sales_per_flush": round(stats["sales_per_flush"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure purchases of one hot product")
+    parser.add_argument("--purchases", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--sqlite-profile", default="production")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_drive(args))))
+        return
+
+    report = {"concurrency": args.concurrency}
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                SQLITE_PROFILE=args.sqlite_profile,
+                FLASH_SALE_ENABLED="1",
+                FLASH_SALE_WAL_PATH=os.path.join(tmp, "flash.wal"),
+                # Measure the stock path, not the guards in front of it
+                RATE_LIMIT_BACKEND="off",
+                ADMISSION_PURCHASE_CONCURRENCY=str(args.concurrency),
+                ADMISSION_PURCHASE_QUEUE=str(args.purchases),
+                ADMISSION_PURCHASE_P99_SECONDS="60",
+                LEDGER_COMPACT_INTERVAL_SECONDS="0",
+                METRICS_ENABLED="0",
+            )
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_flash_sale", "--child", "--mode", mode,
+                 "--purchases", str(args.purchases), "--concurrency", str(args.concurrency)],
+                env=env, capture_output=True, text=True, check=True,
+            )
+        report[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+    if report["rows"]["per_sec"]:
+        report["speedup"] = round(report["flash_sale"]["per_sec"] / report["rows"]["per_sec"], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
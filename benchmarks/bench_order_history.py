@@ -0,0 +1,109 @@
+"""Order history of a customer with many orders: keyset pages against OFFSET.
+
+Seeds a throwaway SQLite database with --orders orders (one line each) for
+one customer, among --others orders of other customers, then times the first
+page and the page at --depth orders in, both through the keyset cursor
+orders.fetch_order_page() uses and with LIMIT/OFFSET.
+
+Runs in a child interpreter because the backend reads DATABASE_URL at
+import time.
+
+    python -m benchmarks.bench_order_history --orders 50000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+
+def _timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def _child(orders: int, others: int, depth: int, repeat: int) -> dict:
+    from sqlalchemy import insert, select
+
+    from backend import catalogue, ledger, models
+    from backend import orders as orders_module
+    from backend.database import SessionLocal, create_db_and_tables
+
+    create_db_and_tables()
+    start = ledger.utcnow() - timedelta(days=365)
+    line = {"product_id": 1, "name": "Archived Aniseed", "quantity": 1, "unit_price": 1}
+    with SessionLocal() as db:
+        db.execute(insert(models.User), [
+            {"id": user_id, "username": f"bench_{user_id}", "email": f"bench_{user_id}@example.com", "hashed_password": "x"}
+            for user_id in (1, 2)
+        ])
+        batch = 5000
+        for user_id, count in ((1, orders), (2, others)):
+            for first in range(0, count, batch):
+                orders_module.record_many(db, [
+                    (user_id, start + timedelta(seconds=i), [line]) for i in range(first, min(first + batch, count))
+                ])
+        db.commit()
+
+        page_size = orders_module.DEFAULT_PAGE_SIZE
+        table = orders_module.orders_table
+        # The cursor a client would hold after paging `depth` orders in
+        deep = db.execute(
+            select(table.c.id, table.c.created_at).where(table.c.user_id == 1)
+            .order_by(table.c.created_at.desc(), table.c.id.desc()).offset(depth - 1).limit(1)
+        ).one()
+        cursor = catalogue.encode_cursor(deep.created_at.isoformat(), deep.id)
+
+        def offset_page(offset: int):
+            rows = db.execute(
+                select(*orders_module.ORDER_COLUMNS).where(table.c.user_id == 1)
+                .order_by(table.c.created_at.desc(), table.c.id.desc()).offset(offset).limit(page_size)
+            ).mappings().all()
+            return orders_module._with_lines(db, rows)
+
+        keyset_first = _timed(lambda: orders_module.fetch_order_page(db, 1, limit=page_size), repeat)
+        keyset_deep = _timed(lambda: orders_module.fetch_order_page(db, 1, limit=page_size, cursor=cursor), repeat)
+        offset_first = _timed(lambda: offset_page(0), repeat)
+        offset_deep = _timed(lambda: offset_page(depth), repeat)
+
+    return {
+        "orders": orders,
+        "depth": depth,
+        "keyset_first_page_us": round(keyset_first * 1e6, 1),
+        "keyset_deep_page_us": round(keyset_deep * 1e6, 1),
+        "offset_first_page_us": round(offset_first * 1e6, 1),
+        "offset_deep_page_us": round(offset_deep * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure order-history pages for a customer with many orders")
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--others", type=int, default=50000)
+    parser.add_argument("--depth", type=int, default=40000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.orders, args.others, min(args.depth, args.orders - 1), args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", METRICS_ENABLED="0")
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_order_history", "--child",
+             "--orders", str(args.orders), "--others", str(args.others),
+             "--depth", str(args.depth), "--repeat", str(args.repeat)],
+            env=env, capture_output=True, text=True, check=True,
+        )
+    print(json.dumps(json.loads(child.stdout.strip().splitlines()[-1]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
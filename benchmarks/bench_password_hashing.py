@@ -0,0 +1,85 @@
+"""Logins/sec against password hashing cost.
+
+For each cost setting this hashes one password, then verifies it as many
+times as possible for a fixed duration in a process pool (the same way the
+API offloads /token). Results are printed as JSON, one object per cost.
+
+    python -m benchmarks.bench_password_hashing --scheme bcrypt --costs 10,11,12,13
+    python -m benchmarks.bench_password_hashing --scheme argon2 --costs 1,2,3 --workers 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from backend import auth
+
+PASSWORD = "benchmark-password-42"
+
+
+def _context(scheme: str, cost: int):
+    if scheme == "bcrypt":
+        return auth.build_pwd_context([scheme], bcrypt_rounds=cost)
+    if scheme == "argon2":
+        return auth.build_pwd_context([scheme], argon2_time_cost=cost)
+    if scheme == "sha256_crypt":
+        return auth.build_pwd_context([scheme], sha256_crypt_rounds=cost)
+    raise ValueError(f"Unsupported scheme: {scheme}")
+
+
+def _verify_batch(scheme: str, cost: int, hashed: str, count: int) -> int:
+    context = _context(scheme, cost)
+    for _ in range(count):
+        assert context.verify(PASSWORD, hashed)
+    return count
+
+
+def run(scheme: str, cost: int, workers: int, duration: float, batch: int) -> dict:
+    context = _context(scheme, cost)
+    started = time.perf_counter()
+    hashed = context.hash(PASSWORD)
+    hash_seconds = time.perf_counter() - started
+
+    completed = 0
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm the workers up so process start-up isn't measured
+        list(pool.map(_verify_batch, [scheme] * workers, [cost] * workers, [hashed] * workers, [1] * workers))
+
+        started = time.perf_counter()
+        pending = {pool.submit(_verify_batch, scheme, cost, hashed, batch) for _ in range(workers * 2)}
+        while pending:
+            done = next(iter(pending))
+            completed += done.result()
+            pending.remove(done)
+            if time.perf_counter() - started < duration:
+                pending.add(pool.submit(_verify_batch, scheme, cost, hashed, batch))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "scheme": scheme,
+        "cost": cost,
+        "workers": workers,
+        "single_hash_ms": round(hash_seconds * 1000, 2),
+        "logins": completed,
+        "seconds": round(elapsed, 3),
+        "logins_per_sec": round(completed / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logins/sec for password hashing cost settings")
+    parser.add_argument("--scheme", default="bcrypt", choices=["bcrypt", "argon2", "sha256_crypt"])
+    parser.add_argument("--costs", default="10,11,12", help="Comma-separated cost values")
+    parser.add_argument("--workers", type=int, default=auth.PASSWORD_HASH_WORKERS or os.cpu_count())
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per cost setting")
+    parser.add_argument("--batch", type=int, default=2, help="Verifications per submitted task")
+    args = parser.parse_args()
+
+    for cost in (int(c) for c in args.costs.split(",")):
+        print(json.dumps(run(args.scheme, cost, args.workers, args.duration, args.batch)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
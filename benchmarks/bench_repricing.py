@@ -0,0 +1,83 @@
+"""Repricing a large catalogue: one set-based UPDATE against one PUT per product.
+
+Seeds a throwaway SQLite database with --products rows, then times
+backend.pricing's single UPDATE over all of them and, for comparison, the
+per-product path (name check, update, commit for each product, as
+PUT /products/{id} does) on a --sample of rows, extrapolated to the whole
+catalogue. Runs in a child interpreter because the backend reads
+DATABASE_URL at import time.
+
+    python -m benchmarks.bench_repricing --products 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+
+def _child(count: int, sample: int) -> dict:
+    from sqlalchemy import insert, select
+
+    from backend import models, pricing, schemas
+    from backend.database import SessionLocal, create_db_and_tables, engine
+
+    create_db_and_tables()
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"name": f"Repricing Rhubarb {i}", "description": "Benchmark", "price": Decimal(100 + i % 900).scaleb(-2), "quantity": i % 50}
+            for i in range(count)
+        ])
+
+    rule = schemas.RepriceRule(mode="percent", value=Decimal("7.5"))
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        updated = db.execute(pricing.reprice_statement(rule)).rowcount
+        db.commit()
+        set_based = time.perf_counter() - started
+
+        ids = db.scalars(select(models.Product.id).order_by(models.Product.id).limit(sample)).all()
+        started = time.perf_counter()
+        for product_id in ids:
+            product = db.get(models.Product, product_id)
+            db.execute(select(models.Product.id).where(models.Product.name == product.name)).first()
+            product.price = (product.price * Decimal("1.075")).quantize(Decimal("0.01"))
+            db.commit()
+        per_row = (time.perf_counter() - started) / max(1, len(ids))
+
+    return {
+        "products": count,
+        "updated": updated,
+        "set_based_seconds": round(set_based, 3),
+        "per_product_seconds_extrapolated": round(per_row * count, 1),
+        "per_product_sample": len(ids),
+        "speedup": round(per_row * count / set_based, 1) if set_based else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bulk repricing")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=500, help="Products repriced one at a time for comparison")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.products, args.sample)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", METRICS_ENABLED="0")
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_repricing", "--child",
+             "--products", str(args.products), "--sample", str(args.sample)],
+            env=env, capture_output=True, text=True, check=True,
+        )
+    print(json.dumps(json.loads(child.stdout.strip().splitlines()[-1]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
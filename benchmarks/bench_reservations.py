@@ -0,0 +1,134 @@
+"""Cart reservations at scale: availability lookups and expiry ticks.
+
+Seeds a throwaway SQLite database with --products products and --holds
+outstanding holds spread over the next hour, then measures:
+
+* availability of one product from its reserved column (one primary-key
+  read) against summing its rows in stock_holds, as a design without the
+  column would;
+* loading every hold into the timing wheel, as startup does;
+* one expiry tick of the wheel, against the indexed table scan a periodic
+  sweeper would run each tick.
+
+Runs in a child interpreter because the backend reads DATABASE_URL at
+import time.
+
+    python -m benchmarks.bench_reservations --holds 200000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+
+def _timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def _child(products: int, holds: int, lookups: int) -> dict:
+    from sqlalchemy import bindparam, func, insert, select, update
+
+    from backend import ledger, models, reservations
+    from backend.database import SessionLocal, create_db_and_tables, engine
+
+    create_db_and_tables()
+    rng = random.Random(42)
+    now = ledger.utcnow()
+    held: dict[int, int] = {}
+    rows = []
+    for _ in range(holds):
+        product_id = rng.randint(1, products)
+        held[product_id] = held.get(product_id, 0) + 1
+        rows.append({
+            "product_id": product_id, "user_id": 1, "quantity": 1,
+            "expires_at": now + timedelta(seconds=rng.uniform(1, reservations.RESERVATION_MAX_TTL_SECONDS)),
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"name": f"Reserved Rosebud {i}", "description": "Benchmark", "price": 1, "quantity": 10**6}
+            for i in range(1, products + 1)
+        ])
+        conn.execute(insert(models.StockHold), rows)
+        products_table = models.Product.__table__
+        conn.execute(
+            update(products_table).where(products_table.c.id == bindparam("pid")).values(reserved=bindparam("n")),
+            [{"pid": product_id, "n": count} for product_id, count in held.items()],
+        )
+
+    holds_table = reservations.holds_table
+    with SessionLocal() as db:
+        ids = [rng.randint(1, products) for _ in range(lookups)]
+        lookup = iter(ids * 2)
+        column = _timed(lambda: db.execute(
+            select(reservations.AVAILABLE).where(models.Product.id == next(lookup))
+        ).scalar(), lookups)
+        summed = _timed(lambda: db.execute(
+            select(func.coalesce(func.sum(holds_table.c.quantity), 0)).where(holds_table.c.product_id == next(lookup))
+        ).scalar(), lookups)
+
+        schedule = reservations.Reservations()
+        started = time.perf_counter()
+        schedule.load(db)
+        load_seconds = time.perf_counter() - started
+
+        # One tick's worth of expiries, a minute from now
+        moment = reservations.unix_time(now + timedelta(seconds=60))
+        schedule.wheel.advance(moment - schedule.wheel.tick)
+        started = time.perf_counter()
+        due = schedule.wheel.advance(moment)
+        tick_seconds = time.perf_counter() - started
+
+        # A sweeper deletes what it finds, so each run only sees the last tick's expiries
+        cutoff = now + timedelta(seconds=60)
+        started = time.perf_counter()
+        swept = db.execute(select(holds_table.c.id).where(
+            holds_table.c.expires_at > cutoff - timedelta(seconds=schedule.wheel.tick),
+            holds_table.c.expires_at <= cutoff,
+        )).all()
+        sweep_seconds = time.perf_counter() - started
+
+    return {
+        "products": products,
+        "holds": holds,
+        "availability_column_us": round(column * 1e6, 1),
+        "availability_sum_us": round(summed * 1e6, 1),
+        "wheel_load_seconds": round(load_seconds, 3),
+        "wheel_tick_us": round(tick_seconds * 1e6, 1),
+        "wheel_tick_expired": len(due),
+        "table_sweep_us": round(sweep_seconds * 1e6, 1),
+        "table_sweep_rows": len(swept),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure reservation availability and expiry")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--holds", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.products, args.holds, args.lookups)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", METRICS_ENABLED="0")
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_reservations", "--child",
+             "--products", str(args.products), "--holds", str(args.holds), "--lookups", str(args.lookups)],
+            env=env, capture_output=True, text=True, check=True,
+        )
+    print(json.dumps(json.loads(child.stdout.strip().splitlines()[-1]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Seller views in a large marketplace: seller indexes against whole-table scans.
+
+Seeds a throwaway SQLite database with --products products spread over
+--sellers sellers plus one small seller with --own products, then times, for
+the small seller:
+
+* the first page of their products sorted by name, through
+  catalogue.fetch_product_page(seller_id=...), against the same page with the
+  (seller_id, ...) indexes hidden from the planner (NOT INDEXED);
+* their dashboard (sellers.fetch_dashboard), against the same query without
+  the indexes.
+
+Runs in a child interpreter because the backend reads DATABASE_URL at
+import time.
+
+    python -m benchmarks.bench_seller_catalogue --products 200000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def _child(products: int, seller_count: int, own: int, repeat: int) -> dict:
+    from sqlalchemy import insert, text
+
+    from backend import catalogue, models, sellers
+    from backend.database import SessionLocal, create_db_and_tables, engine
+
+    create_db_and_tables()
+    small = seller_count + 1
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i, "username": f"seller_{i}", "email": f"seller_{i}@example.com", "hashed_password": "x", "role": "seller"}
+            for i in range(1, small + 1)
+        ])
+        batch = 10000
+        for first in range(0, products, batch):
+            conn.execute(insert(models.Product), [
+                {"name": f"Bulk Bonbon {i}", "description": "Benchmark", "price": 1 + i % 50, "quantity": i % 20,
+                 "seller_id": 1 + i % seller_count}
+                for i in range(first, min(first + batch, products))
+            ])
+        conn.execute(insert(models.Product), [
+            {"name": f"Boutique Bonbon {i}", "description": "Benchmark", "price": 3, "quantity": i % 5, "seller_id": small}
+            for i in range(own)
+        ])
+
+    unindexed = text(
+        "SELECT id, name, description, price_minor, quantity FROM products NOT INDEXED "
+        "WHERE seller_id = :seller ORDER BY name, id LIMIT :limit"
+    )
+    unindexed_dashboard = text(
+        "SELECT id, quantity, reserved, low_stock_threshold FROM products NOT INDEXED WHERE seller_id = :seller"
+    )
+    with SessionLocal() as db:
+        page = _timed(lambda: catalogue.fetch_product_page(
+            db, fields=list(catalogue.PRODUCT_FIELDS), sort="name", limit=100, seller_id=small,
+        ), repeat)
+        page_scan = _timed(lambda: db.execute(unindexed, {"seller": small, "limit": 101}).all(), repeat)
+        dashboard = _timed(lambda: sellers.fetch_dashboard(db, small), repeat)
+        dashboard_scan = _timed(lambda: db.execute(unindexed_dashboard, {"seller": small}).all(), repeat)
+
+    return {
+        "products": products + own,
+        "own_products": own,
+        "page_indexed_us": round(page * 1e6, 1),
+        "page_table_scan_us": round(page_scan * 1e6, 1),
+        "dashboard_indexed_us": round(dashboard * 1e6, 1),
+        "dashboard_query_table_scan_us": round(dashboard_scan * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure seller catalogue pages and dashboards")
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--sellers", type=int, default=500)
+    parser.add_argument("--own", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.products, args.sellers, args.own, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", METRICS_ENABLED="0")
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_seller_catalogue", "--child",
+             "--products", str(args.products), "--sellers", str(args.sellers),
+             "--own", str(args.own), "--repeat", str(args.repeat)],
+            env=env, capture_output=True, text=True, check=True,
+        )
+    print(json.dumps(json.loads(child.stdout.strip().splitlines()[-1]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
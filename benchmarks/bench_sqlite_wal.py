@@ -0,0 +1,127 @@
+"""Mixed read/write throughput for the default and production SQLite profiles.
+
+Each profile runs in its own subprocess, because backend.database picks its
+engines up from the environment at import time. The child seeds a fresh
+database, then runs concurrent reader tasks (catalogue pages, like
+GET /products) against writer tasks (conditional stock decrements plus
+commit, like purchase_sweet) for a fixed duration.
+
+    python -m benchmarks.bench_sqlite_wal --products 10000 --readers 16 --writers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = ("default", "production")
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def _workload(args) -> dict:
+    from sqlalchemy import insert, select, update
+
+    from backend import database, models
+
+    database.create_db_and_tables()
+    with database.SessionLocal() as db:
+        db.execute(
+            insert(models.Product.__table__),
+            [
+                {"name": f"Bench Sweet {i}", "description": "Benchmark", "price": 1.0 + i % 50, "quantity": 10**9}
+                for i in range(args.products)
+            ],
+        )
+        db.commit()
+
+    deadline = time.perf_counter() + args.duration
+    read_latencies: list[float] = []
+    write_latencies: list[float] = []
+    errors = {"read": 0, "write": 0}
+
+    async def reader():
+        while time.perf_counter() < deadline:
+            start_id = random.randint(1, max(1, args.products - 100))
+            started = time.perf_counter()
+            try:
+                async with database.ReadSessionLocal() as db:
+                    stmt = select(models.Product).where(models.Product.id >= start_id).order_by(models.Product.id).limit(100)
+                    (await db.execute(stmt)).all()
+                read_latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors["read"] += 1
+
+    async def writer():
+        while time.perf_counter() < deadline:
+            product_id = random.randint(1, args.products)
+            started = time.perf_counter()
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(models.Product)
+                        .where(models.Product.id == product_id, models.Product.quantity >= 1)
+                        .values(quantity=models.Product.quantity - 1)
+                    )
+                    await db.commit()
+                write_latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors["write"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[reader() for _ in range(args.readers)], *[writer() for _ in range(args.writers)])
+    elapsed = time.perf_counter() - started
+
+    await database.async_engine.dispose()
+    await database.read_async_engine.dispose()
+    return {
+        "profile": os.environ["SQLITE_PROFILE"],
+        "seconds": round(elapsed, 2),
+        "reads_per_sec": round(len(read_latencies) / elapsed, 1),
+        "writes_per_sec": round(len(write_latencies) / elapsed, 1),
+        "read_p50_ms": round(statistics.median(read_latencies) * 1000, 2) if read_latencies else None,
+        "read_p99_ms": round(_percentile(read_latencies, 99) * 1000, 2),
+        "write_p99_ms": round(_percentile(write_latencies, 99) * 1000, 2),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SQLite profiles under a mixed read/write load")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--profile", choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(asyncio.run(_workload(args))))
+        return
+
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                SQLITE_PROFILE=profile,
+            )
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_sqlite_wal", "--profile", profile, *sys.argv[1:]],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            print(child.stdout.strip().splitlines()[-1], flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Cold-start time of the API, to catch regressions from import-time work.
+
+Each run is a fresh interpreter against a throwaway database. It reports how
+long `import backend.main` takes and how long the app's startup (lifespan)
+takes after that, as a worker would experience it. Runs use AUTO_MIGRATE=0
+after a single up-front migration, like workers started by backend.serve;
+--auto-migrate measures the development setup instead.
+
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --max-import-seconds 1.5   # exit 1 if slower (for CI)
+    python -m benchmarks.bench_startup --importtime               # slowest modules to import
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _child() -> dict:
+    started = time.perf_counter()
+    from backend.main import app
+
+    imported = time.perf_counter()
+
+    async def startup():
+        async with app.router.lifespan_context(app):
+            return time.perf_counter()
+
+    ready = asyncio.run(startup())
+    return {"import_seconds": imported - started, "startup_seconds": ready - imported}
+
+
+def _importtime(env: dict, top: int) -> list[dict]:
+    """Slowest modules by cumulative import time, from python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--auto-migrate", action="store_true", help="Let each process create the schema itself")
+    parser.add_argument("--max-import-seconds", type=float, help="Fail if the median import time is above this")
+    parser.add_argument("--max-startup-seconds", type=float, help="Fail if the median startup time is above this")
+    parser.add_argument("--importtime", type=int, nargs="?", const=15, help="Also list the N slowest imports")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child()))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            AUTO_MIGRATE="1" if args.auto_migrate else "0",
+            LEDGER_COMPACT_INTERVAL_SECONDS="0",
+            ANALYTICS_TAIL_SECONDS="0",
+        )
+        if not args.auto_migrate:
+            subprocess.run([sys.executable, "-m", "backend.migrate"], env=env, capture_output=True, check=True)
+
+        runs = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            run = json.loads(child.stdout.strip().splitlines()[-1])
+            run["process_seconds"] = time.perf_counter() - started
+            runs.append(run)
+        slowest = _importtime(env, args.importtime) if args.importtime else None
+
+    report = {"runs": len(runs), "auto_migrate": args.auto_migrate}
+    for field in ("import_seconds", "startup_seconds", "process_seconds"):
+        values = [run[field] for run in runs]
+        report[field] = {"median": round(statistics.median(values), 4), "max": round(max(values), 4)}
+    if slowest is not None:
+        report["slowest_imports"] = slowest
+    print(json.dumps(report, indent=2))
+
+    failed = (
+        (args.max_import_seconds is not None and report["import_seconds"]["median"] > args.max_import_seconds)
+        or (args.max_startup_seconds is not None and report["startup_seconds"]["median"] > args.max_startup_seconds)
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useAuth } from '../auth/authContext';
 
 const API_BASE_URL = ''; // Uses proxy
+const PAGE_SIZE = 1000; // The largest page GET /products serves
 
 const SweetShop = () => {
     const { userRole, token, logout } = useAuth();
@@ -23,26 +24,36 @@ const SweetShop = () => {
     const fetchSweets = useCallback(async () => {
         setError(null);
         try {
-            const response = await fetch(`${API_BASE_URL}/products?search=${searchTerm}`, {
-                headers: {
-                    'Authorization': `Bearer ${token}`, 
-                    'Content-Type': 'application/json',
-                },
-            });
+            // The catalogue comes in pages: follow X-Next-Cursor until the last one
+            const all = [];
+            let cursor = null;
+            do {
+                const params = new URLSearchParams({ search: searchTerm, limit: PAGE_SIZE });
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch(`${API_BASE_URL}/products?${params}`, {
+                    headers: {
+                        'Authorization': `Bearer ${token}`, 
+                        'Content-Type': 'application/json',
+                    },
+                });
 
-            if (response.status === 401) {
-                setError("Session expired or unauthorized. Please log in again.");
-                logout(); 
-                return;
-            }
+                if (response.status === 401) {
+                    setError("Session expired or unauthorized. Please log in again.");
+                    logout(); 
+                    return;
+                }
 
-            const data = await response.json();
-            if (!response.ok) {
-                setError(data.detail || 'Failed to fetch sweets.');
-                return;
-            }
+                const data = await response.json();
+                if (!response.ok) {
+                    setError(data.detail || 'Failed to fetch sweets.');
+                    return;
+                }
+
+                all.push(...data);
+                cursor = response.headers.get('X-Next-Cursor');
+            } while (cursor);
 
-            setSweets(data);
+            setSweets(all);
         } catch (err) {
             setError('Could not connect to the API. Check the backend server.');
         }
@@ -55,6 +66,55 @@ const SweetShop = () => {
         }
     }, [token, searchTerm, fetchSweets]); // CORRECT: dependency array now stable
 
+    // --- Live Updates ---
+    // The server pushes small deltas over Server-Sent Events, so the list is
+    // patched in place instead of being refetched after every change.
+    // The stream only depends on the token: typing a search term must not
+    // reconnect it, so the handlers read the latest term and fetch through refs.
+    const searchTermRef = useRef(searchTerm);
+    const fetchSweetsRef = useRef(fetchSweets);
+    useEffect(() => {
+        searchTermRef.current = searchTerm;
+        fetchSweetsRef.current = fetchSweets;
+    }, [searchTerm, fetchSweets]);
+
+    useEffect(() => {
+        if (!token) return undefined;
+        const source = new EventSource(`${API_BASE_URL}/products/events`);
+        let opened = false;
+        const patchSweet = (id, changes) =>
+            setSweets((current) => current.map((sweet) => (sweet.id === id ? { ...sweet, ...changes } : sweet)));
+
+        source.addEventListener('stock', (e) => {
+            const { id, quantity } = JSON.parse(e.data);
+            patchSweet(id, { quantity });
+        });
+        source.addEventListener('product', (e) => {
+            const product = JSON.parse(e.data);
+            patchSweet(product.id, product);
+        });
+        source.addEventListener('created', (e) => {
+            const product = JSON.parse(e.data);
+            const term = searchTermRef.current;
+            if (!term || product.name.toLowerCase().includes(term.toLowerCase())) {
+                setSweets((current) => (current.some((sweet) => sweet.id === product.id) ? current : [...current, product]));
+            }
+        });
+        source.addEventListener('deleted', (e) => {
+            const { id } = JSON.parse(e.data);
+            setSweets((current) => current.filter((sweet) => sweet.id !== id));
+        });
+        // Bulk imports, and reconnects after the server dropped us, need a full
+        // refetch; the first open doesn't, the effect above has just fetched
+        source.addEventListener('reload', () => fetchSweetsRef.current());
+        source.onopen = () => {
+            if (opened) fetchSweetsRef.current();
+            opened = true;
+        };
+
+        return () => source.close();
+    }, [token]);
+
     // --- Purchase Logic ---
     const handlePurchase = async (productId) => {
         setMessage(null);
@@ -72,7 +132,7 @@ const SweetShop = () => {
                 setError(data.detail || 'Purchase failed.');
             } else {
                 setMessage(`Purchased ${data.name}! New stock: ${data.quantity}`);
-                fetchSweets(); // Refresh the list
+                // The stock event from the server updates the list
             }
         } catch (err) {
             setError('Purchase failed: Network error.');
@@ -102,7 +162,6 @@ const SweetShop = () => {
                 setMessage(`Restocked ${data.name}. New quantity: ${data.quantity}`);
                 setRestockId('');
                 setRestockQuantity('');
-                fetchSweets(); 
             }
         } catch (err) { setError('Restock failed: Network error.'); }
     };
@@ -125,7 +184,6 @@ const SweetShop = () => {
             } else {
                 setMessage(`Sweet '${data.name}' added successfully!`);
                 setNewSweetName(''); setNewSweetPrice(''); setNewSweetQuantity('');
-                fetchSweets();
             }
         } catch (err) { setError('Failed to add sweet: Network error.'); }
     };